@@ -0,0 +1,332 @@
+"""
+Offline benchmarks of the image pipelines: no network, no API keys, no cost.
+
+The model is replaced by FakeVisionModel and the Mapillary / Street View endpoints by a local StubServer (see stubs.py),
+so the numbers measure the overhead of our code (download, encoding, graph, batching), not the providers.
+Each scenario runs in a fresh process, so that peak RSS is measured per scenario.
+
+Usage (from the repo root):
+    python benchmarks/bench_pipeline.py                        # all scenarios
+    python benchmarks/bench_pipeline.py -s mpllry_graph -n 200 --model-latency 1.0 --error-rate 0.05
+    python benchmarks/bench_pipeline.py --trace-alloc --output bench.json
+"""
+import argparse
+import asyncio
+import json
+import math
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+
+def _use_mpllry_graph():
+    """The mpllry_graph modules import each other as top level modules"""
+    sys.path.insert(0, str(ROOT / "src" / "mpllry_graph"))
+
+
+def _use_multimodal_graph():
+    """The multimodal_graph package is imported as src.multimodal_graph, like `python -m src.multimodal_graph.main` does"""
+    sys.path.insert(0, str(ROOT))
+
+
+# Scenarios: each one returns (number of items processed, per-item latencies in seconds, number of errors, wall time in seconds),
+# timed after the imports and the setup
+
+def bench_mpllry_fetch(args, server) -> tuple:
+    """Metadata search + thumbnail download of num_points random points (utils.get_mpllry_b64)"""
+    os.environ["MAPILLARY_TOKEN"] = "stub-token"
+    _use_mpllry_graph()
+    import utils
+
+    latencies = []
+    fetch_point = utils._fetch_point
+
+    def timed_fetch_point(*fetch_args):
+        start = time.perf_counter()
+        try:
+            return fetch_point(*fetch_args)
+        finally:
+            latencies.append(time.perf_counter() - start)
+
+    utils._fetch_point = timed_fetch_point
+    start = time.perf_counter()
+    images = utils.get_mpllry_b64(args.num, max_workers=args.concurrency)
+    return len(images), latencies, args.num - len(images), time.perf_counter() - start
+
+
+def bench_prepare_message(args, server) -> tuple:
+    """Building the multimodal HumanMessage (format detection, base64 encoding, content blocks) from image handles"""
+    _use_mpllry_graph()
+    from utils import prepare_multimodal_message
+    from image_store import IMAGE_STORE
+    from langchain_core.messages import HumanMessage
+
+    images = [IMAGE_STORE.put(img) for img in server.fixtures]
+    latencies = []
+    for i in range(args.num):
+        state = {"messages": [HumanMessage("Analize the following images")], "images": [images[i % len(images)]]}
+        start = time.perf_counter()
+        prepare_multimodal_message(state)
+        latencies.append(time.perf_counter() - start)
+    return args.num, latencies, 0, sum(latencies)
+
+
+def _fake_model(args):
+    from stubs import FakeVisionModel
+    return FakeVisionModel(latency=args.model_latency, jitter=args.model_latency / 5, error_rate=args.error_rate)
+
+
+def bench_mpllry_graph(args, server) -> tuple:
+    """End to end evaluation of num images through the mpllry graph and the batch driver (batch.run_batch)"""
+    _use_mpllry_graph()
+    import make_graph
+    from batch import run_batch
+    from state import MultiState
+    from preprocess import ImageConfig
+    from langchain.agents import create_agent
+    from langchain_core.messages import HumanMessage
+
+    agent = create_agent(
+        model=_fake_model(args),
+        tools=[],
+        system_prompt="You evaluate street view images.",
+        state_schema=MultiState,
+        response_format=make_graph.BinaryOutput
+    )
+    make_graph.get_mpllry_agent = lambda: agent
+    graph = make_graph.get_graph(image_config=ImageConfig())
+    sys_msg = HumanMessage("Keep only images of streets")
+    images = [(str(i), server.fixtures[i % len(server.fixtures)]) for i in range(args.num)]
+
+    async def run():
+        return [record async for record in run_batch(graph, images, sys_msg, concurrency=args.concurrency)]
+
+    start = time.perf_counter()
+    records = asyncio.run(run())
+    return len(records), [r.latency for r in records], sum(r.error is not None for r in records), time.perf_counter() - start
+
+
+def bench_multimodal_graph(args, server) -> tuple:
+    """num independent chat turns with one image each through the multimodal graph"""
+    _use_multimodal_graph()
+    from src.multimodal_graph import make_graph
+    from src.mpllry_graph.preprocess import ImageConfig
+    from src.mpllry_graph.image_store import IMAGE_STORE
+    from langchain.agents import create_agent
+    from langchain_core.messages import HumanMessage
+
+    model = _fake_model(args)
+    agent = create_agent(model=model, tools=[], system_prompt="You describe images.")
+    make_graph.get_model, make_graph.get_multimodal_agent = lambda: model, lambda: agent
+    graph = make_graph.get_graph(checkpointer=None, image_config=ImageConfig(max_edge=1568, jpeg_quality=90))
+    images = [IMAGE_STORE.put(img) for img in server.fixtures]
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def turn(i):
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                await graph.ainvoke({"messages": [HumanMessage("What is in this image?")], "images": [images[i % len(images)]]})
+                return time.perf_counter() - start, False
+            except Exception:
+                return time.perf_counter() - start, True
+
+    async def run():
+        return await asyncio.gather(*(turn(i) for i in range(args.num)))
+
+    start = time.perf_counter()
+    results = asyncio.run(run())
+    return len(results), [latency for latency, _ in results], sum(failed for _, failed in results), time.perf_counter() - start
+
+
+def bench_streetview_fetch(args, server) -> tuple:
+    """Street View downloads through the on-disk image cache: a cold pass (all misses) then a warm pass (all hits)"""
+    _use_mpllry_graph()
+    from image_cache import ImageCache, fetch_url_cached
+    from utils import get_mpllry_session
+    from concurrent.futures import ThreadPoolExecutor
+
+    cache = ImageCache(cache_dir=tempfile.mkdtemp(prefix="bench-cache-"))
+    session = get_mpllry_session(args.concurrency)
+    urls = [f"{server.url}/streetview?size=640x640&location={44.49 + i * 1e-4},11.34&heading=0&key=stub" for i in range(args.num // 2)]
+
+    def timed_fetch(url):
+        start = time.perf_counter()
+        fetch_url_cached(url, cache=cache, session=session)
+        return time.perf_counter() - start
+
+    latencies = []
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        for _ in range(2):  # cold, warm
+            latencies.extend(pool.map(timed_fetch, urls))
+    print(f"[streetview_fetch] cache hits: {cache.hits}, misses: {cache.misses}")
+    return len(latencies), latencies, 0, time.perf_counter() - start
+
+
+def bench_streetview_graph(args, server) -> tuple:
+    """Map-reduce grading of num Street View images (4 headings per point, horizon layer) through the streetview graph"""
+    _use_multimodal_graph()
+    from src.streetview_graph import make_graph
+    from src.mpllry_graph.image_cache import ImageCache
+    from src.mpllry_graph.downloader import AsyncDownloader
+    from stubs import FakeVisionModel
+    from langchain.agents import create_agent
+
+    model = FakeVisionModel(latency=args.model_latency, jitter=args.model_latency / 5, error_rate=args.error_rate,
+                            tool_args={"grade": 7, "description": "stub description"})
+    agent = create_agent(model=model, tools=[], system_prompt="You grade street view images.", response_format=make_graph.GradeOutput)
+    make_graph.get_grading_agent = lambda: agent
+    downloader = (ImageCache(cache_dir=tempfile.mkdtemp(prefix="bench-cache-")), AsyncDownloader(per_host=args.concurrency))
+    make_graph.get_downloader = lambda: downloader
+    latencies = []
+    grade_image = make_graph.grade_image
+
+    async def timed_grade_image(*grade_args):
+        start = time.perf_counter()
+        try:
+            return await grade_image(*grade_args)
+        finally:
+            latencies.append(time.perf_counter() - start)
+
+    make_graph.grade_image = timed_grade_image
+    graph = make_graph.get_graph()
+    streetviews = {
+        str(p): {"horizon": [f"{server.url}/streetview?size=640x640&location={44.49 + p * 1e-4},11.34&heading={h}&key={{API_KEY}}" for h in (0, 90, 180, 270)]}
+        for p in range(max(args.num // 4, 1))
+    }
+    os.environ.setdefault("GOOGLE_MAPS_API_KEY", "stub")
+
+    start = time.perf_counter()
+    result = asyncio.run(graph.ainvoke({"streetviews": streetviews}, config={"max_concurrency": args.concurrency}))
+    elapsed = time.perf_counter() - start
+    entries = [r for layers in result["results"].values() for r in layers.values()]
+    return len(latencies), latencies, sum(r["failed"] for r in entries), elapsed
+
+
+def bench_ortofoto_tiles(args, server) -> tuple:
+    """
+    A square ortofoto mosaic for all the years through the tile fetcher and the MBTiles cache, a cold pass then a warm pass:
+    the side of the square is chosen so that the two passes process about num tiles (at least one tile per year and pass)
+    """
+    os.environ["ORTOFOTO_URL"] = f"{server.url}/tiles"
+    _use_multimodal_graph()
+    from src.ortofoto.fetcher import TileFetcher, YEARS
+    from src.ortofoto.tile_cache import TileCache
+    from src.mpllry_graph.downloader import AsyncDownloader
+    from src.ortofoto.tiles import TileRange
+
+    tile_radius = max(round((math.sqrt(args.num / (2 * len(YEARS))) - 1) / 2), 0)
+    tile_range = TileRange.around(44.4939, 11.3426, 18, tile_radius)
+    fetcher = TileFetcher(TileCache(tempfile.mkdtemp(prefix="bench-tiles-")), AsyncDownloader(per_host=args.concurrency))
+    # cache hits are read a batch at a time: only the downloads have a latency of their own
+    latencies = []
+    download = fetcher._download
+
+    async def timed_download(*download_args):
+        start = time.perf_counter()
+        try:
+            return await download(*download_args)
+        finally:
+            latencies.append(time.perf_counter() - start)
+
+    fetcher._download = timed_download
+
+    async def run():
+        for _ in range(2):  # cold, warm
+            await fetcher.prefetch(YEARS, tile_range)
+        await fetcher.aclose()
+
+    start = time.perf_counter()
+    asyncio.run(run())
+    print(f"[ortofoto_tiles] {fetcher.stats()}")
+    return 2 * len(tile_range) * len(YEARS), latencies, fetcher.failed, time.perf_counter() - start
+
+
+SCENARIOS = {
+    "mpllry_fetch": bench_mpllry_fetch,
+    "prepare_message": bench_prepare_message,
+    "mpllry_graph": bench_mpllry_graph,
+    "multimodal_graph": bench_multimodal_graph,
+    "streetview_fetch": bench_streetview_fetch,
+    "streetview_graph": bench_streetview_graph,
+    "ortofoto_tiles": bench_ortofoto_tiles,
+}
+
+
+def _run_scenario(name : str, args, queue) -> None:
+    """Runs a scenario in the current (fresh) process and puts its report on the queue"""
+    try:
+        queue.put(_scenario_report(name, args))
+    except Exception as e:  # the parent is waiting on the queue
+        queue.put({"scenario": name, "failed": f"{type(e).__name__}: {e}"})
+
+
+def _scenario_report(name : str, args) -> dict:
+    from stubs import StubServer
+
+    with StubServer(latency=args.http_latency, miss_rate=args.miss_rate) as server:
+        if name == "mpllry_fetch":
+            os.environ["MAPILLARY_GRAPH_URL"] = server.url  # read when utils is imported
+        if args.trace_alloc:
+            tracemalloc.start()
+            before = tracemalloc.take_snapshot()
+
+        count, latencies, errors, elapsed = SCENARIOS[name](args, server)
+
+        report = {"scenario": name, "items": count, "errors": errors, "seconds": round(elapsed, 3), "http_requests": server.requests}
+        if args.trace_alloc:
+            allocated = tracemalloc.take_snapshot().compare_to(before, "filename")
+            report["alloc_blocks"] = sum(stat.count_diff for stat in allocated)  # blocks still alive at the end
+            report["alloc_peak_mb"] = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 1)
+            tracemalloc.stop()
+
+    report["items_per_s"] = round(count / elapsed, 2) if elapsed else None
+    if latencies:
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+        report.update({"p50_ms": round(p50 * 1000, 2), "p95_ms": round(p95 * 1000, 2), "p99_ms": round(p99 * 1000, 2)})
+    report["peak_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)  # KiB on Linux
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmarks of the image pipelines")
+    parser.add_argument("-s", "--scenario", action="append", choices=list(SCENARIOS), help="scenario(s) to run, default all")
+    parser.add_argument("-n", "--num", type=int, default=100, help="items per scenario")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--model-latency", type=float, default=0.5, help="seconds per fake model call")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="probability of a fake model call failing")
+    parser.add_argument("--http-latency", type=float, default=0.05, help="seconds per stub HTTP response")
+    parser.add_argument("--miss-rate", type=float, default=0.0, help="probability of an empty metadata search")
+    parser.add_argument("--trace-alloc", action="store_true", help="count allocations with tracemalloc (slows the scenario down)")
+    parser.add_argument("--output", help="also write the reports to this JSON file")
+    args = parser.parse_args()
+
+    ctx = multiprocessing.get_context("spawn")
+    reports = []
+    for name in args.scenario or list(SCENARIOS):
+        queue = ctx.Queue()
+        process = ctx.Process(target=_run_scenario, args=(name, args, queue))
+        process.start()
+        report = queue.get()
+        process.join()
+        print(json.dumps(report))
+        reports.append(report)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(reports, f, indent=2)
+        print(f"Reports saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
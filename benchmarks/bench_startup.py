@@ -0,0 +1,77 @@
+"""
+Startup benchmark: time to import each graph module and to build its graph, in fresh interpreters,
+i.e. what every CLI invocation and every worker start pays before doing any work. No network calls are made
+(clients are created with dummy keys, no model is called).
+
+Usage (from the repo root):
+    python benchmarks/bench_startup.py            # 5 runs per target, median
+    python benchmarks/bench_startup.py -r 10 --output startup.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# each snippet prints {"import_s", "graph_s", "providers"} and runs in its own interpreter
+SNIPPET = """
+import json, sys, time
+start = time.perf_counter()
+{import_stmt}
+imported = time.perf_counter()
+graph = make_graph.get_graph({graph_args})
+built = time.perf_counter()
+print(json.dumps({{
+    "import_s": imported - start,
+    "graph_s": built - imported,
+    "providers": sorted(m for m in ("langchain_openai", "langchain_anthropic") if m in sys.modules),
+}}))
+"""
+
+TARGETS = {
+    "mpllry_graph": {"cwd": ROOT / "src" / "mpllry_graph", "import_stmt": "import make_graph", "graph_args": ""},
+    "multimodal_graph": {"cwd": ROOT, "import_stmt": "from src.multimodal_graph import make_graph", "graph_args": "None"},
+}
+
+# dummy keys: clients are created but never called
+ENV = {"OPENAI_API_KEY": "bench", "FIREWORKS_API_KEY": "bench", "ANTHROPIC_API_KEY": "bench", "PROVIDER": "OPENAI"}
+
+
+def run_once(target : dict) -> dict:
+    code = SNIPPET.format(import_stmt=target["import_stmt"], graph_args=target["graph_args"])
+    start = time.perf_counter()
+    out = subprocess.run([sys.executable, "-c", code], cwd=target["cwd"], env={**os.environ, **ENV}, capture_output=True, text=True, check=True)
+    result = json.loads(out.stdout.strip().splitlines()[-1])
+    result["process_s"] = time.perf_counter() - start  # interpreter start included
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Startup time of the graph modules")
+    parser.add_argument("-r", "--runs", type=int, default=5, help="fresh interpreters per target (the median is reported)")
+    parser.add_argument("--output", help="also write the reports to this JSON file")
+    args = parser.parse_args()
+
+    reports = []
+    for name, target in TARGETS.items():
+        run_once(target)  # warm up the filesystem cache and the .pyc files
+        runs = [run_once(target) for _ in range(args.runs)]
+        report = {"target": name, "providers_imported": runs[-1]["providers"]}
+        for key in ("import_s", "graph_s", "process_s"):
+            report[key] = round(statistics.median(r[key] for r in runs), 3)
+        print(json.dumps(report))
+        reports.append(report)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(reports, f, indent=2)
+        print(f"Reports saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+import asyncio
+import io
+import json
+import random
+import threading
+import time
+import uuid
+import zlib
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Any, Optional
+from urllib.parse import urlparse, parse_qs
+from PIL import Image
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+# Local stand-ins for the paid / remote services, so that the pipeline overhead can be measured offline:
+# a fake vision chat model and a stub HTTP server for the Mapillary and Street View endpoints.
+
+
+class FakeVisionModel(BaseChatModel):
+    """
+    Chat model that answers after `latency` seconds (+ uniform jitter), failing with probability `error_rate`.
+    When tools are bound (e.g. the structured output tool of create_agent), it calls the first one with `tool_args`,
+    otherwise it replies with a short text. Token usage is reported like a real provider would.
+    When streamed, the text comes word by word, `token_latency` seconds apart, after the first `latency`.
+    """
+    latency: float = 0.5
+    jitter: float = 0.1
+    token_latency: float = 0.02
+    error_rate: float = 0.0
+    tool_args: dict = {"response": "yes", "reason": "stub verdict", "confidence": 0.9}
+    model_name: str = "fake-vision"
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-vision"
+
+    def bind_tools(self, tools, **kwargs):
+        return self.bind(tools=[convert_to_openai_tool(tool) for tool in tools], **kwargs)
+
+    def _reply(self, messages : list[BaseMessage], tools : Optional[list] = None, **kwargs : Any) -> ChatResult:
+        if random.random() < self.error_rate:
+            raise RuntimeError("fake provider error")
+
+        input_tokens = sum(len(str(m.content)) for m in messages) // 4  # rough, base64 images included on purpose
+        if tools:
+            message = AIMessage(content="", tool_calls=[{"name": tools[0]["function"]["name"], "args": dict(self.tool_args), "id": f"call_{uuid.uuid4().hex[:8]}"}])
+        else:
+            message = AIMessage(content="The image shows a street with buildings.")
+        message.usage_metadata = {"input_tokens": input_tokens, "output_tokens": 20, "total_tokens": input_tokens + 20}
+        message.response_metadata = {"model_name": self.model_name}
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _delay(self) -> float:
+        return max(0.0, self.latency + random.uniform(-self.jitter, self.jitter))
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self._delay())
+        return self._reply(messages, **kwargs)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self._delay())
+        return self._reply(messages, **kwargs)
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self._delay())
+        message = self._reply(messages, **kwargs).generations[0].message
+        if message.tool_calls:  # no point in streaming a tool call
+            yield ChatGenerationChunk(message=AIMessageChunk(content="", tool_call_chunks=[{"name": c["name"], "args": json.dumps(c["args"]), "id": c["id"], "index": 0} for c in message.tool_calls], usage_metadata=message.usage_metadata))
+            return
+        words = message.content.split(" ")
+        for i, word in enumerate(words):
+            if i:
+                await asyncio.sleep(self.token_latency)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=word if i == 0 else " " + word))
+            if run_manager:
+                await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+        yield ChatGenerationChunk(message=AIMessageChunk(content="", usage_metadata=message.usage_metadata, response_metadata=message.response_metadata))
+
+
+def make_fixture_jpeg(width : int = 1024, height : int = 768, seed : int = 0) -> bytes:
+    """A noisy JPEG of realistic size (noise does not compress, like real photos)"""
+    rng = random.Random(seed)
+    img = Image.frombytes("RGB", (width // 4, height // 4), rng.randbytes(width // 4 * height // 4 * 3)).resize((width, height))
+    out = io.BytesIO()
+    img.save(out, format="JPEG", quality=85)
+    return out.getvalue()
+
+
+def make_fixture_tile(seed : int = 0, size : int = 256) -> bytes:
+    """A noisy PNG map tile (256 x 256, like the ortofoto tiles)"""
+    rng = random.Random(seed)
+    img = Image.frombytes("RGB", (size // 4, size // 4), rng.randbytes(size // 4 * size // 4 * 3)).resize((size, size))
+    out = io.BytesIO()
+    img.save(out, format="PNG")
+    return out.getvalue()
+
+
+class _Server(ThreadingHTTPServer):
+    request_queue_size = 256  # listen backlog (default 5): bursts of concurrent connections would wait for SYN retransmits
+
+
+class StubServer:
+    """
+    Local HTTP server mimicking the endpoints used by the pipeline:
+
+    - GET /images?bbox=...&limit=...          Mapillary metadata search (misses with probability miss_rate)
+    - GET /<image_id>?fields=thumb_1024_url   Mapillary single image metadata
+    - GET /thumbs/<image_id>.jpg              Mapillary thumbnail
+    - GET /streetview?...                     Street View static image
+    - GET /streetview/metadata?...            Street View metadata (free, status OK with probability 1 - miss_rate, see has_coverage;
+                                              key=denied answers REQUEST_DENIED, key=html a non-JSON page)
+    - GET /tiles/Ortofoto<year>/<z>/<x>/<y>.png  Ortofoto tile (404 with probability miss_rate), the same tile for every year
+
+    Every response is delayed by `latency` seconds, to stand in for the network round trip.
+    """
+
+    def __init__(self, latency : float = 0.05, miss_rate : float = 0.0, num_fixtures : int = 8):
+        self.latency = latency
+        self.miss_rate = miss_rate
+        self.fixtures = [make_fixture_jpeg(seed=i) for i in range(num_fixtures)]
+        self.tile_fixtures = [make_fixture_tile(seed=i) for i in range(num_fixtures)]
+        self.requests = 0
+        self._httpd = _Server(("127.0.0.1", 0), self._handler())
+        self._httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+
+    def has_coverage(self, location : str) -> bool:
+        """Street View metadata: whether a location has a panorama, missing with probability miss_rate, the same on every request"""
+        return zlib.crc32(location.encode()) / 2 ** 32 >= self.miss_rate
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._httpd.server_port}"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive, like the real endpoints
+            disable_nagle_algorithm = True  # headers and body are two writes: without TCP_NODELAY each keep-alive response waits for a delayed ACK
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, body : bytes, content_type : str):
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _send_json(self, payload):
+                self._send(json.dumps(payload).encode("utf-8"), "application/json")
+
+            def do_GET(self):
+                server.requests += 1
+                time.sleep(server.latency)
+                parsed = urlparse(self.path)
+                query = {k: v[0] for k, v in parse_qs(parsed.query).items()}
+                path = parsed.path
+
+                if path == "/images":
+                    lon_min, lat_min, lon_max, lat_max = map(float, query["bbox"].split(","))
+                    count = 0 if random.random() < server.miss_rate else int(query.get("limit", 1))
+                    data = []
+                    for _ in range(count):
+                        image_id = str(random.randrange(10 ** 12))
+                        data.append({
+                            "id": image_id,
+                            "sequence": f"seq{random.randrange(100)}",
+                            "camera_type": "perspective",
+                            "computed_geometry": {"type": "Point", "coordinates": [random.uniform(lon_min, lon_max), random.uniform(lat_min, lat_max)]},
+                            "thumb_1024_url": f"{server.url}/thumbs/{image_id}.jpg",
+                        })
+                    self._send_json({"data": data})
+                elif path.startswith("/thumbs/"):
+                    image_id = int(path.rsplit("/", 1)[-1].split(".")[0])
+                    self._send(server.fixtures[image_id % len(server.fixtures)], "image/jpeg")
+                elif path == "/streetview/metadata":
+                    if query.get("key") == "denied":  # like a bad key
+                        self._send_json({"status": "REQUEST_DENIED", "error_message": "The provided API key is invalid."})
+                    elif query.get("key") == "html":  # like the error page of a proxy
+                        self._send(b"<html><body>502 Bad Gateway</body></html>", "text/html")
+                    else:
+                        status = "OK" if server.has_coverage(query["location"]) else "ZERO_RESULTS"
+                        self._send_json({"status": status, "pano_id": uuid.uuid4().hex if status == "OK" else None})
+                elif path == "/streetview":
+                    self._send(server.fixtures[hash(parsed.query) % len(server.fixtures)], "image/jpeg")
+                elif path.startswith("/tiles/"):
+                    _, _, _, _, x, y = path.removesuffix(".png").split("/")
+                    if random.random() < server.miss_rate:
+                        self.send_response(404)
+                        self.send_header("Content-Length", "0")
+                        self.end_headers()
+                        return
+                    self._send(server.tile_fixtures[hash((x, y)) % len(server.tile_fixtures)], "image/png")
+                else:  # single Mapillary image
+                    image_id = path.strip("/")
+                    self._send_json({"id": image_id, "thumb_1024_url": f"{server.url}/thumbs/{image_id}.jpg"})
+
+        return Handler
@@ -1,3 +1,4 @@
+import json
 import torch
 import numpy as np
 from groundingdino.util.inference import load_image, predict
@@ -5,62 +6,303 @@ from torchvision.ops import box_convert
 import matplotlib.pyplot as plt
 import matplotlib.patches as patches
 
+DEFAULT_DEVICE = torch.device("cuda:0" if (torch.cuda.is_available()) else "cpu")
 
 
-def GroundingSAM(g_dino, sam, image_path, text_prompt, box_threshold = 0.3, text_threshold = 0.2, show_boxes = False, device = torch.device("cuda:0" if (torch.cuda.is_available()) else "cpu")):
-    ''' Function concatenating GroundingDINO and SAM models to create binary masks of text prompted obgects
-    
+# Compact masks: COCO-style run-length encoding, {"size": [h, w], "counts": runs}, with the runs of the mask flattened
+# in column-major order, starting with a run of zeros (possibly empty). A Street View mask takes a few hundred runs
+# instead of h * w bools, and area, coverage and IoU are computed on the runs, without decoding.
+# counts are a uint32 array in memory, and COCO's compressed string on disk (rle_to_string), readable by pycocotools.
+
+def mask_to_rle(mask):
+    ''' (h, w) bool mask -> RLE '''
+    mask = np.asarray(mask, dtype=bool)
+    h, w = mask.shape
+    flat = mask.T.ravel()  # column-major, like COCO
+    changes = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+    counts = np.diff(np.concatenate(([0], changes, [flat.size])))
+    if flat.size and flat[0]:
+        counts = np.concatenate(([0], counts))  # runs start with the zeros
+    return {"size": [h, w], "counts": counts.astype(np.uint32)}
+
+
+def rle_to_mask(rle):
+    ''' RLE -> (h, w) bool mask '''
+    h, w = rle["size"]
+    counts = np.asarray(rle["counts"], dtype=np.int64)
+    values = np.arange(len(counts)) % 2 == 1
+    return np.repeat(values, counts).reshape(w, h).T
+
+
+def rle_area(rle):
+    ''' Number of pixels of the mask '''
+    return int(np.asarray(rle["counts"], dtype=np.int64)[1::2].sum())
+
+
+def rle_coverage(rle):
+    ''' Fraction of the image covered by the mask '''
+    h, w = rle["size"]
+    return rle_area(rle) / (h * w) if h * w else 0.0
+
+
+def _runs(rle):
+    ''' Sorted run boundaries of an RLE: a pixel is in the mask if an odd number of boundaries is <= its index '''
+    return np.cumsum(np.asarray(rle["counts"], dtype=np.int64))
+
+
+def rle_intersection_area(a, b):
+    ''' Pixels in both masks, from the runs: the masks are constant between two consecutive boundaries of either '''
+    if list(a["size"]) != list(b["size"]):
+        raise ValueError(f"masks of different sizes: {a['size']} and {b['size']}")
+    bounds_a, bounds_b = _runs(a), _runs(b)
+    points = np.union1d(bounds_a, bounds_b)
+    starts, lengths = points[:-1], np.diff(points)
+    in_a = np.searchsorted(bounds_a, starts, side="right") % 2 == 1
+    in_b = np.searchsorted(bounds_b, starts, side="right") % 2 == 1
+    return int(lengths[in_a & in_b].sum())
+
+
+def rle_iou(a, b):
+    ''' Intersection over union of two masks, on the runs '''
+    intersection = rle_intersection_area(a, b)
+    union = rle_area(a) + rle_area(b) - intersection
+    return intersection / union if union else 0.0
+
+
+def rle_to_string(rle):
+    ''' COCO compressed counts (pycocotools' rleToString): run deltas as 5-bit varints in printable ASCII '''
+    counts = [int(c) for c in rle["counts"]]
+    chars = []
+    for i, x in enumerate(counts):
+        if i > 2:
+            x -= counts[i - 2]  # runs alternate zeros and ones: deltas to the previous run of the same kind are small
+        more = True
+        while more:
+            c = x & 0x1f
+            x >>= 5
+            more = x != -1 if c & 0x10 else x != 0
+            if more:
+                c |= 0x20
+            chars.append(chr(c + 48))
+    return {"size": list(rle["size"]), "counts": "".join(chars)}
+
+
+def rle_from_string(rle):
+    ''' Inverse of rle_to_string (pycocotools' rleFrString) '''
+    counts, s, p = [], rle["counts"], 0
+    while p < len(s):
+        x, k, more = 0, 0, True
+        while more:
+            c = ord(s[p]) - 48
+            x |= (c & 0x1f) << 5 * k
+            more = c & 0x20
+            p += 1
+            k += 1
+            if not more and c & 0x10:
+                x |= -1 << 5 * k
+        if len(counts) > 2:
+            x += counts[-2]
+        counts.append(x)
+    return {"size": list(rle["size"]), "counts": np.array(counts, dtype=np.uint32)}
+
+
+def save_segmentations(results, path):
+    ''' Appends segment results to a JSON lines file, masks as COCO compressed RLE (a few hundred bytes each) '''
+    with open(path, "a") as f:
+        for result in results:
+            record = {**result,
+                      "masks": {prompt: rle_to_string(rle) for prompt, rle in result["masks"].items()},
+                      "mask": rle_to_string(result["mask"]),
+                      "boxes": np.asarray(result["boxes"]).tolist(),
+                      "scores": np.asarray(result["scores"]).tolist()}
+            f.write(json.dumps(record) + "\n")
+
+
+def load_segmentations(path):
+    ''' Reads back the results written by save_segmentations '''
+    results = []
+    with open(path) as f:
+        for line in f:
+            record = json.loads(line)
+            record["masks"] = {prompt: rle_from_string(rle) for prompt, rle in record["masks"].items()}
+            record["mask"] = rle_from_string(record["mask"])
+            results.append(record)
+    return results
+
+
+def detect_boxes(g_dino, image_source, image_for_dino, text_prompts, box_threshold = 0.3, text_threshold = 0.2, device = DEFAULT_DEVICE):
+    ''' GroundingDINO boxes of every text prompt, in pixels
+
+    Arguments:
+    ------------
+    g_dino : groundingdino.models.GroundingDINO, GroundingDINO model
+    image_source : np.ndarray, (h, w, 3) RGB image, as returned by load_image
+    image_for_dino : torch.Tensor, transformed image, as returned by load_image
+    text_prompts : list of str, one GroundingDINO call each (one caption per prompt keeps the labels unambiguous)
+    box_threshold : float, threshold value for box detection for GroundingDINO
+    text_threshold : float, threshold value for text correspondence for GroundingDINO
+
+    Returns:
+    ------------
+    boxes : torch.Tensor, (n, 4) xyxy boxes in pixels
+    scores : torch.Tensor, (n,)
+    labels : list of str, GroundingDINO phrase of every box
+    prompt_ids : torch.Tensor, (n,) index in text_prompts of the prompt of every box
+    '''
+    h, w, _ = image_source.shape
+    all_boxes, all_scores, labels, prompt_ids = [], [], [], []
+    for i, text_prompt in enumerate(text_prompts):
+        boxes, scores, phrases = predict(
+            model = g_dino,
+            image = image_for_dino,
+            caption = text_prompt,
+            box_threshold = box_threshold,
+            text_threshold = text_threshold,
+            device = device )
+        all_boxes.append(boxes)
+        all_scores.append(scores)
+        labels += phrases
+        prompt_ids += [i] * len(boxes)
+
+    # Converting boxes output values from [0,1] to [H,W]
+    boxes = torch.cat(all_boxes) * torch.Tensor([w, h, w, h])
+    boxes = box_convert(boxes, in_fmt="cxcywh", out_fmt="xyxy")
+    return boxes, torch.cat(all_scores), labels, torch.tensor(prompt_ids, dtype=torch.long)
+
+
+def predict_masks(sam, boxes, image_shape, box_batch_size = 16):
+    ''' SAM masks of all the boxes of the image set on the predictor (sam.set_image), in batched calls of the torch path
+
+    Arguments:
+    ------------
+    sam : segment_anything.predictor.SamPredictor, with the image already set
+    boxes : torch.Tensor, (n, 4) xyxy boxes in pixels
+    image_shape : tuple, (h, w) of the image
+    box_batch_size : int, boxes per call: every box costs a (h, w) float mask before thresholding, keep it small on CPU
+
+    Returns:
+    ------------
+    masks : torch.Tensor, (n, h, w) bool, on the CPU
+    '''
+    if len(boxes) == 0:
+        return torch.zeros((0, *image_shape), dtype=torch.bool)
+    transformed = sam.transform.apply_boxes_torch(boxes, image_shape).to(sam.device)
+    masks = []
+    with torch.inference_mode():
+        for start in range(0, len(transformed), box_batch_size):
+            batch, _, _ = sam.predict_torch(point_coords = None,
+                                            point_labels = None,
+                                            boxes = transformed[start:start + box_batch_size],
+                                            multimask_output = False)
+            masks.append(batch[:, 0].cpu())
+    return torch.cat(masks)
+
+
+def _result(text_prompts, masks, boxes, scores, labels, prompt_ids):
+    ''' Per-prompt union of the masks of an image as RLE, with the boxes and the coverage stats (compact, ready to be stored) '''
+    h, w = masks.shape[1:]
+    prompt_masks = {prompt: mask_to_rle(masks[prompt_ids == i].any(dim=0).numpy() if (prompt_ids == i).any() else np.zeros((h, w), dtype=bool))
+                    for i, prompt in enumerate(text_prompts)}
+    mask = mask_to_rle(masks.any(dim=0).numpy() if len(masks) else np.zeros((h, w), dtype=bool))
+    return {
+        "masks": prompt_masks,  # prompt -> RLE
+        "mask": mask,  # union of all the prompts, RLE
+        "mask_coverage": rle_coverage(mask),
+        "areas": {prompt: rle_area(rle) for prompt, rle in prompt_masks.items()},  # pixels per prompt
+        "boxes": boxes.numpy(),
+        "scores": scores.numpy(),
+        "labels": labels,
+        "prompts": [text_prompts[i] for i in prompt_ids.tolist()],
+    }
+
+
+def segment(g_dino, sam, image_path, text_prompts, box_threshold = 0.3, text_threshold = 0.2, box_batch_size = 16, device = DEFAULT_DEVICE):
+    ''' Headless GroundingDINO + SAM: masks of the text prompted objects of an image, with one SAM image embedding for all the prompts
+
     Arguments:
     ------------
     g_dino : groundingdino.models.GroundingDINO, GroundingDINO model
     sam :  segment_anything.predictor.SamPredictor, Segment anything model
     image_path : str
-    text_prompt : str
+    text_prompts : str or list of str
     box_threshold : float, threshold value for box detection for GroundingDINO, default is 0.3
     text_threshold : float, threshold value for text correspondence for GroundingDINO default is 0.2
-    show_boxes : bool, if True shows GroundingDINO boxes, default is False
+    box_batch_size : int, boxes per SAM call
+
+    Returns:
+    ------------
+    dict with "masks" (prompt -> RLE, see mask_to_rle), "mask" (union, RLE), "mask_coverage", "areas" (pixels per prompt),
+    "boxes", "scores", "labels" and "prompts" (prompt of every box)
     '''
-    
+    text_prompts = [text_prompts] if isinstance(text_prompts, str) else list(text_prompts)
     image_source, image_for_dino = load_image(image_path)
+    boxes, scores, labels, prompt_ids = detect_boxes(g_dino, image_source, image_for_dino, text_prompts, box_threshold, text_threshold, device)
 
-    # GroundingDINO predictions
-    boxes, scores, labels = predict(
-        model = g_dino,
-        image = image_for_dino,
-        caption = text_prompt,
-        box_threshold = box_threshold,
-        text_threshold = text_threshold,
-        device = device )
-    
-    # Converting boxes output values from [0,1] to [H,W]
     h, w, _ = image_source.shape
-    boxes = boxes * torch.Tensor([w, h, w, h])
-    boxes = box_convert(boxes, in_fmt="cxcywh", out_fmt="xyxy")
+    if len(boxes):  # no image embedding needed without boxes
+        sam.set_image(image_source)
+    masks = predict_masks(sam, boxes, (h, w), box_batch_size)
+    return _result(text_prompts, masks, boxes, scores, labels, prompt_ids)
+
+
+def segment_images(g_dino, sam, image_paths, text_prompts, box_threshold = 0.3, text_threshold = 0.2, batch_size = 2, device = DEFAULT_DEVICE):
+    ''' segment over a list of images, running the SAM image encoder on batch_size images at once (Sam.forward batched path)
+
+    Arguments:
+    ------------
+    g_dino : groundingdino.models.GroundingDINO, GroundingDINO model
+    sam :  segment_anything.predictor.SamPredictor, Segment anything model (its model and transform are used)
+    image_paths : list of str
+    text_prompts : str or list of str, the same for every image
+    batch_size : int, images per SAM encoder call: the encoder dominates on CPU, and each image adds ~1024x1024 activations,
+                 so small batches (2-4) are the sweet spot on CPU, larger ones on GPU
+
+    Returns:
+    ------------
+    list of dicts like segment, in the order of image_paths
+    '''
+    text_prompts = [text_prompts] if isinstance(text_prompts, str) else list(text_prompts)
+    results = []
+    for start in range(0, len(image_paths), batch_size):
+        detections, batched_input = [], []
+        for image_path in image_paths[start:start + batch_size]:
+            image_source, image_for_dino = load_image(image_path)
+            boxes, scores, labels, prompt_ids = detect_boxes(g_dino, image_source, image_for_dino, text_prompts, box_threshold, text_threshold, device)
+            h, w, _ = image_source.shape
+            detections.append((boxes, scores, labels, prompt_ids, (h, w)))
+            if len(boxes):  # images without boxes skip the encoder
+                image = torch.as_tensor(sam.transform.apply_image(image_source), device=sam.device).permute(2, 0, 1).contiguous()
+                batched_input.append({
+                    "image": image,
+                    "original_size": (h, w),
+                    "boxes": sam.transform.apply_boxes_torch(boxes, (h, w)).to(sam.device),
+                })
 
-    image_np = np.array(image_source)
+        with torch.inference_mode():
+            outputs = iter(sam.model(batched_input, multimask_output = False) if batched_input else [])
+        for boxes, scores, labels, prompt_ids, (h, w) in detections:
+            masks = next(outputs)["masks"][:, 0].cpu() if len(boxes) else torch.zeros((0, h, w), dtype=torch.bool)
+            results.append(_result(text_prompts, masks, boxes, scores, labels, prompt_ids))
+    return results
 
-    fig, ax = plt.subplots(1, figsize = (15, 15))
-    ax.imshow(image_np)
-    
-    
-    sam.set_image(image_source)
 
-    sam_masks = np.zeros((1, h, w), dtype = bool)
+def plot_segmentation(image_source, result, show_boxes = False, ax = None):
+    ''' Plots an image with the mask overlay of a segment result (and its GroundingDINO boxes, if show_boxes)
 
-    # Get segmenting masks for the boxes
-    for box in boxes:
-        mask, _, _ = sam.predict(point_coords = None, 
-                                        point_labels = None,
-                                        box = box.numpy(),
-                                        #mask_input=input_labels,
-                                        multimask_output = False)
-        
-        sam_masks = np.logical_or(sam_masks, mask)
+    Arguments:
+    ------------
+    image_source : np.ndarray, (h, w, 3) RGB image
+    result : dict, as returned by segment
+    show_boxes : bool, if True shows GroundingDINO boxes, default is False
+    ax : matplotlib axes, a new 15x15 figure if None
+    '''
+    if ax is None:
+        _, ax = plt.subplots(1, figsize = (15, 15))
+    ax.imshow(np.asarray(image_source))
 
-    
     if show_boxes:
-        for box, score, label in zip(boxes, scores, labels):
-           
+        for box, score, label in zip(result["boxes"], result["scores"], result["labels"]):
+
             x_min, y_min, x_max, y_max = box
 
             rect = patches.Rectangle(
@@ -83,18 +325,43 @@ def GroundingSAM(g_dino, sam, image_path, text_prompt, box_threshold = 0.3, text
                 color = "white",
                 fontsize = 7,
                 bbox=dict(facecolor="red", alpha=0.5) )
-        
-    #plt.imshow(sam_masks[0], alpha=0.5)  # Overlay the mask on the image
 
-    # Overlay the sam_masks to the original image
-    color = np.array([255, 0, 0], dtype=np.uint8) 
+    # Overlay the mask to the original image (decoded only here)
+    mask = rle_to_mask(result["mask"])
+    overlay = np.zeros((*mask.shape, 4), dtype=np.uint8)
+    overlay[..., 0] = 255
+    overlay[..., 3] = mask.astype(np.uint8) * 200
+
+    ax.imshow(overlay)
+    ax.axis('off')
+    return ax
 
-    overlay = np.zeros((sam_masks.shape[1], sam_masks.shape[2], 4), dtype=np.uint8)
-    overlay[..., :3] = color
-    overlay[..., 3] = sam_masks.astype(np.uint8) * 200
 
-    plt.imshow(overlay)
-    plt.axis('off')
-    plt.show()
+def GroundingSAM(g_dino, sam, image_path, text_prompt, box_threshold = 0.3, text_threshold = 0.2, show_boxes = False, show = False, device = DEFAULT_DEVICE):
+    ''' Function concatenating GroundingDINO and SAM models to create binary masks of text prompted obgects
+    (see segment for the headless API with several prompts, and segment_images for lists of images)
+
+    Arguments:
+    ------------
+    g_dino : groundingdino.models.GroundingDINO, GroundingDINO model
+    sam :  segment_anything.predictor.SamPredictor, Segment anything model
+    image_path : str
+    text_prompt : str
+    box_threshold : float, threshold value for box detection for GroundingDINO, default is 0.3
+    text_threshold : float, threshold value for text correspondence for GroundingDINO default is 0.2
+    show_boxes : bool, if True shows GroundingDINO boxes, default is False
+    show : bool, if True plots the image with the mask overlay, default is False (headless)
+
+    Returns:
+    ------------
+    sam_masks : np.ndarray, dense (1, h, w) bool mask (segment returns the compact RLE instead)
+    boxes : torch.Tensor, (n, 4) xyxy boxes in pixels
+    '''
+    result = segment(g_dino, sam, image_path, text_prompt, box_threshold, text_threshold, device = device)
+
+    if show or show_boxes:
+        image_source, _ = load_image(image_path)
+        plot_segmentation(image_source, result, show_boxes)
+        plt.show()
 
-    return sam_masks, boxes
\ No newline at end of file
+    return rle_to_mask(result["mask"])[None], torch.from_numpy(result["boxes"])
@@ -0,0 +1,187 @@
+import asyncio
+import time
+from typing import AsyncIterable, Iterable, Optional, Union, get_args
+from pydantic import BaseModel
+from langchain_core.messages import HumanMessage
+from langchain_core.callbacks import UsageMetadataCallbackHandler
+from dedup import PHashIndex, dhash
+from image_store import IMAGE_STORE
+
+# Batch driver: runs the compiled graph (see make_graph.get_graph) over many images,
+# with at most `concurrency` model calls in flight at once.
+
+EVAL_TEXT = "Analize the following images"
+
+
+class EvalRecord(BaseModel):
+    """Outcome of the evaluation of a single image"""
+    image_id: str
+    response: Optional[str] = None  # "yes" / "no", None if the evaluation failed
+    reason: Optional[str] = None
+    confidence: Optional[float] = None  # self-reported by the model, 0-1
+    latency: float  # seconds, from graph invocation to final state
+    error: Optional[str] = None
+    duplicate_of: Optional[str] = None  # id of the near-identical image whose verdict was reused
+    lat: Optional[float] = None
+    lon: Optional[float] = None
+    model: Optional[str] = None  # model(s) that produced the verdict
+    input_tokens: Optional[int] = None
+    output_tokens: Optional[int] = None
+
+    @classmethod
+    def field_types(cls) -> dict:
+        """Python type of each field (Optional unwrapped), e.g. to declare the schema of a ParquetSink"""
+        return {name: (get_args(field.annotation) or (field.annotation,))[0] for name, field in cls.model_fields.items()}
+
+
+async def evaluate_image(graph, sys_msg : HumanMessage, image_id : str, img_bytes : bytes, timeout : float = 120.0) -> EvalRecord:
+    """
+    Runs the graph on a single image. Never raises: errors and timeouts are reported in the record.
+    The bytes are held in IMAGE_STORE only while the image is evaluated, the state carries a handle.
+    """
+    ref = IMAGE_STORE.put(img_bytes, image_id)
+
+    # Initialize state with the image
+    init_state = {
+        "messages": [sys_msg] + [HumanMessage(EVAL_TEXT)],
+        "images": [ref]
+    }
+
+    usage = UsageMetadataCallbackHandler()  # collects token usage of every model call of this invocation, by model name
+
+    start = time.perf_counter()
+    try:
+        final_state = await asyncio.wait_for(graph.ainvoke(init_state, config={"callbacks": [usage]}), timeout=timeout)
+    except asyncio.TimeoutError:
+        return EvalRecord(image_id=image_id, latency=time.perf_counter() - start, error=f"timeout after {timeout}s")
+    except Exception as e:
+        return EvalRecord(image_id=image_id, latency=time.perf_counter() - start, error=f"{type(e).__name__}: {e}")
+    finally:
+        IMAGE_STORE.release(ref)
+    latency = time.perf_counter() - start
+
+    tokens = {
+        "model": ", ".join(usage.usage_metadata) or None,
+        "input_tokens": sum(u["input_tokens"] for u in usage.usage_metadata.values()),
+        "output_tokens": sum(u["output_tokens"] for u in usage.usage_metadata.values()),
+    }
+
+    if final_state.get("prefiltered"):
+        tokens["model"] = "prefilter"  # rejected by the pre-filter node, without a model call
+
+    verdict = final_state.get("structured_response")
+    if verdict is None:
+        return EvalRecord(image_id=image_id, latency=latency, error="no structured response", **tokens)
+    return EvalRecord(image_id=image_id, response=verdict.response, reason=verdict.reason, confidence=verdict.confidence, latency=latency, **tokens)
+
+
+async def evaluate_image_dedup(graph, sys_msg : HumanMessage, image_id : str, img_bytes : bytes, timeout : float, dedup : PHashIndex, skip_duplicates : bool = False) -> Optional[EvalRecord]:
+    """
+    Same as evaluate_image, but near-identical frames (see dedup.py) reuse the verdict of the first one instead of calling the model.
+    With skip_duplicates, near duplicates return None instead.
+    """
+    start = time.perf_counter()
+    try:
+        h = await asyncio.get_running_loop().run_in_executor(None, dhash, img_bytes)
+    except Exception:
+        # undecodable image: no hash to match on, evaluate_image reports the decode error in the record
+        return await evaluate_image(graph, sys_msg, image_id, img_bytes, timeout)
+
+    match = dedup.lookup(h)
+    if match is not None:
+        original_id, verdict_future = match
+        verdict = await verdict_future  # the original may still be in flight
+        if verdict is not None:
+            dedup.hits += 1
+            if skip_duplicates:
+                return None
+            return EvalRecord(image_id=image_id, response=verdict.response, reason=verdict.reason, confidence=verdict.confidence, latency=time.perf_counter() - start, duplicate_of=original_id, model=verdict.model)
+        # the original failed: evaluate this one on its own
+
+    dedup.misses += 1
+    verdict_future = dedup.reserve(h, image_id)
+    record = await evaluate_image(graph, sys_msg, image_id, img_bytes, timeout)
+    if record.error is None:
+        verdict_future.set_result(record)
+    else:
+        verdict_future.set_result(None)
+        dedup.discard(verdict_future)
+    return record
+
+
+async def _feed(images : Union[Iterable, AsyncIterable], queue : asyncio.Queue, num_workers : int):
+    """Producer: puts (image_id, img_bytes[, metadata]) items in the queue, then one stop marker per worker"""
+    try:
+        if hasattr(images, "__aiter__"):
+            async for item in images:
+                await queue.put(item)
+        else:
+            for item in images:
+                await queue.put(item)
+    finally:
+        for _ in range(num_workers):  # stop the workers even if the image source fails
+            await queue.put(None)
+
+
+async def _work(graph, sys_msg : HumanMessage, timeout : float, queue : asyncio.Queue, results : asyncio.Queue, dedup : PHashIndex, skip_duplicates : bool):
+    """Worker: evaluates images from the queue until the stop marker"""
+    try:
+        while (item := await queue.get()) is not None:
+            image_id, img_bytes, *metadata = item
+            if dedup is None:
+                record = await evaluate_image(graph, sys_msg, image_id, img_bytes, timeout)
+            else:
+                record = await evaluate_image_dedup(graph, sys_msg, image_id, img_bytes, timeout, dedup, skip_duplicates)
+            if record is not None:
+                if metadata and metadata[0].get("computed_geometry"):
+                    record.lon, record.lat = metadata[0]["computed_geometry"]["coordinates"][:2]
+                await results.put(record)
+    finally:
+        await results.put(None)  # always, or run_batch would wait for this worker forever
+
+
+async def run_batch(graph, images : Union[Iterable, AsyncIterable], sys_msg : HumanMessage, concurrency : int = 8, timeout : float = 120.0, dedup : PHashIndex = None, skip_duplicates : bool = False):
+    """
+    Evaluates images with at most `concurrency` graph invocations in flight, yielding records as they complete.
+
+    Images are pulled lazily from a bounded queue, so an (async) generator of downloads,
+    e.g. `utils.aiter_mpllry_images`, overlaps with the evaluation and is never read far ahead.
+
+    Args:
+        graph: Compiled graph, see make_graph.get_graph
+        images: (Async) iterable of (image_id, img_bytes) pairs, or (image_id, img_bytes, metadata) triples with the Mapillary metadata
+        sys_msg: Few-shot system message, see utils.get_multimodal_prompt
+        concurrency: Maximum number of images evaluated at the same time
+        timeout: Per-image timeout in seconds
+        dedup: Optional perceptual-hash index: near-identical frames reuse the verdict of the first one (see `dedup.hit_rate`)
+        skip_duplicates: If True (and dedup is given), near-identical frames are skipped instead of yielding the reused verdict
+
+    Yields:
+        EvalRecord, in completion order
+    """
+    queue = asyncio.Queue(maxsize=concurrency)
+    results = asyncio.Queue()
+
+    feeder = asyncio.create_task(_feed(images, queue, concurrency))
+    workers = [asyncio.create_task(_work(graph, sys_msg, timeout, queue, results, dedup, skip_duplicates)) for _ in range(concurrency)]
+
+    try:
+        running = concurrency
+        while running:
+            record = await results.get()
+            if record is None:
+                running -= 1
+                continue
+            yield record
+        await feeder  # surface errors of the image source, if any
+        await asyncio.gather(*workers)  # and of the workers
+    finally:
+        for task in [feeder, *workers]:
+            task.cancel()
+
+
+async def evaluate_batch(graph, images : Union[Iterable, AsyncIterable], sys_msg : HumanMessage, concurrency : int = 8, timeout : float = 120.0, dedup : PHashIndex = None, skip_duplicates : bool = False) -> list[EvalRecord]:
+    """
+    Library counterpart of `run_batch`: evaluates all the images and returns the records (in completion order).
+    """
+    return [record async for record in run_batch(graph, images, sys_msg, concurrency=concurrency, timeout=timeout, dedup=dedup, skip_duplicates=skip_duplicates)]
@@ -0,0 +1,79 @@
+import asyncio
+import io
+import numpy as np
+from typing import Optional
+from PIL import Image
+
+# Perceptual-hash dedup of near-identical frames.
+# Mapillary images come in sequences, and random sampling often picks almost identical frames of the same capture run:
+# the verdict of the first one is reused for the others instead of paying another model call.
+
+
+def dhash(img_bytes : bytes, hash_size : int = 8) -> int:
+    """
+    Difference hash: the image is shrunk to (hash_size + 1) x hash_size grayscale pixels,
+    and each bit tells whether a pixel is brighter than its right neighbour.
+    Robust to rescaling, re-encoding and small exposure changes, cheap to compute.
+    """
+    img = Image.open(io.BytesIO(img_bytes))
+    img.draft("L", (hash_size * 8, hash_size * 8))  # let the JPEG decoder downscale, much faster than a full decode
+    pixels = np.asarray(img.convert("L").resize((hash_size + 1, hash_size), Image.Resampling.LANCZOS), dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+class PHashIndex:
+    """
+    Index of the perceptual hashes of the evaluated images, with their verdicts.
+
+    Verdicts are futures: a frame that is a near duplicate of one still being evaluated
+    waits for that verdict instead of calling the model too.
+    """
+
+    def __init__(self, threshold : int = 6):
+        self.threshold = threshold  # max Hamming distance (out of 64 bits) between near duplicates
+        self.hits = 0  # verdicts reused (updated by the batch driver)
+        self.misses = 0  # frames sent to the model
+        self._hashes = np.zeros(1024, dtype=np.uint64)  # grown by doubling, only the first self._size are used
+        self._valid = np.zeros(1024, dtype=bool)
+        self._size = 0
+        self._entries = []  # (image_id, future), aligned with self._hashes
+
+    def lookup(self, h : int) -> Optional[tuple]:
+        """
+        Returns (image_id, verdict future) of the closest indexed frame within threshold, or None.
+        """
+        if self._size == 0:
+            return None
+        distances = np.bitwise_count(self._hashes[:self._size] ^ np.uint64(h))  # vectorized Hamming distance
+        distances[~self._valid[:self._size]] = 64 + 1
+        closest = int(np.argmin(distances))
+        if distances[closest] > self.threshold:
+            return None
+        return self._entries[closest]
+
+    def reserve(self, h : int, image_id : str) -> asyncio.Future:
+        """
+        Adds a frame that is about to be evaluated. 
+        Its verdict must be set on the returned future (None if the evaluation failed, see `discard`).
+        """
+        if self._size == len(self._hashes):
+            self._hashes = np.concatenate([self._hashes, np.zeros_like(self._hashes)])
+            self._valid = np.concatenate([self._valid, np.zeros_like(self._valid)])
+        future = asyncio.get_running_loop().create_future()
+        self._hashes[self._size] = h
+        self._valid[self._size] = True
+        self._entries.append((image_id, future))
+        self._size += 1
+        return future
+
+    def discard(self, future : asyncio.Future) -> None:
+        """Removes a frame whose evaluation failed: its near duplicates will be evaluated on their own"""
+        for i, (_, entry_future) in enumerate(self._entries):
+            if entry_future is future:
+                self._valid[i] = False
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
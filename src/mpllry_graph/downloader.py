@@ -0,0 +1,139 @@
+import asyncio
+import random
+from urllib.parse import urlsplit
+
+import httpx
+
+# Async image downloader, for graph nodes running on the asyncio loop (a blocking requests.get stalls every other node).
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}  # rate limited or transient server errors
+DEFAULT_MAX_BYTES = 20 * 1024 ** 2  # 20 MB, far above any thumbnail or Street View image
+
+
+class DownloadTooLarge(httpx.HTTPError):
+    """The response body is larger than the downloader's max_bytes"""
+
+
+class AsyncDownloader:
+    """
+    Shared async http client for image downloads:
+    - one keep-alive connection pool for every request (no new TLS handshake per image);
+    - at most `per_host` requests in flight per host, so a burst of tasks does not trip the rate limits of one API;
+    - retries on connection errors, timeouts, 429 and 5xx, with exponential backoff and full jitter (Retry-After is honored);
+    - the body is streamed into memory and the download aborted past `max_bytes`.
+
+    The client is created on first use, on the running event loop (and re-created if it is used from another loop,
+    e.g. by successive asyncio.run calls). Use it as `async with AsyncDownloader() as downloader:` or call `aclose()`.
+    """
+
+    def __init__(
+        self,
+        per_host : int = 8,
+        max_connections : int = 64,
+        timeout : float = 10.0,
+        max_retries : int = 3,
+        backoff : float = 0.5,
+        max_backoff : float = 10.0,
+        max_bytes : int = DEFAULT_MAX_BYTES,
+    ):
+        self.per_host = per_host
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_bytes = max_bytes
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+        self._client = None
+        self._loop = None
+        self._hosts = {}  # host -> asyncio.Semaphore
+
+    def _get_client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client.is_closed or self._loop is not loop:
+            # clients and semaphores are bound to the loop they are first used on
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections),
+                follow_redirects=True,
+            )
+            self._loop = loop
+            self._hosts = {}
+        return self._client
+
+    def _host_slot(self, url : str) -> asyncio.Semaphore:
+        host = urlsplit(url).netloc.lower()
+        if host not in self._hosts:
+            self._hosts[host] = asyncio.Semaphore(self.per_host)
+        return self._hosts[host]
+
+    def _delay(self, attempt : int, response : httpx.Response = None) -> float:
+        """Full jitter backoff, or the server's Retry-After (in seconds) if it asks for longer"""
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+        if response is not None:
+            try:
+                delay = max(delay, min(float(response.headers.get("Retry-After", 0)), self.max_backoff))
+            except ValueError:  # http-date form, not worth parsing
+                pass
+        return delay
+
+    async def _get_once(self, client : httpx.AsyncClient, url : str) -> bytes:
+        async with client.stream("GET", url) as response:
+            response.raise_for_status()
+            size = int(response.headers.get("Content-Length") or 0)
+            if size > self.max_bytes:
+                raise DownloadTooLarge(f"{url}: {size} bytes > {self.max_bytes}")
+            body = bytearray()
+            async for chunk in response.aiter_bytes():
+                body += chunk
+                if len(body) > self.max_bytes:
+                    raise DownloadTooLarge(f"{url}: more than {self.max_bytes} bytes")
+            return bytes(body)
+
+    async def fetch(self, url : str) -> bytes:
+        """
+        Downloads url. Raises httpx.HTTPError if the download fails after the retries
+        (httpx.HTTPStatusError for a non-retryable status, like `requests.get(...).raise_for_status()`).
+
+        Returns:
+            The raw response bytes
+        """
+        client = self._get_client()
+        slot = self._host_slot(url)
+        for attempt in range(self.max_retries + 1):
+            self.requests += 1
+            try:
+                async with slot:  # the slot is not held while backing off
+                    return await self._get_once(client, url)
+            except httpx.HTTPStatusError as e:
+                if e.response.status_code not in RETRY_STATUSES or attempt == self.max_retries:
+                    self.failures += 1
+                    raise
+                delay = self._delay(attempt, e.response)
+            except httpx.TransportError:  # connection errors and timeouts
+                if attempt == self.max_retries:
+                    self.failures += 1
+                    raise
+                delay = self._delay(attempt)
+            self.retries += 1
+            await asyncio.sleep(delay)
+
+    async def fetch_many(self, urls : list[str]) -> list:
+        """Downloads urls concurrently. Returns the bytes of each url, or the exception it failed with"""
+        return await asyncio.gather(*(self.fetch(url) for url in urls), return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {"requests": self.requests, "retries": self.retries, "failures": self.failures}
+
+    async def aclose(self) -> None:
+        if self._client is not None and not self._client.is_closed and self._loop is asyncio.get_running_loop():
+            await self._client.aclose()
+        self._client = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
@@ -0,0 +1,173 @@
+import asyncio
+import hashlib
+import os
+import tempfile
+import threading
+import requests
+from pathlib import Path
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+# Shared on-disk image cache, used by every downloader (Mapillary thumbnails, Street View images, ...).
+
+DEFAULT_CACHE_DIR = str(Path.home() / ".cache" / "lg-vision" / "images")
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3  # 2 GB
+
+# query parameters that carry credentials or signatures: they change between runs but not the image
+VOLATILE_PARAMS = {"key", "access_token", "signature", "oh", "oe", "_nc_sid", "_nc_ohc", "_nc_ht"}
+
+
+def default_cache_dir() -> str:
+    """
+    The cache directory: LG_VISION_CACHE_DIR, or DEFAULT_CACHE_DIR. Read when a cache is created, not at import,
+    so that a value in .env counts (the entry points load it first, see providers.load_env)
+    """
+    return os.getenv("LG_VISION_CACHE_DIR", DEFAULT_CACHE_DIR)
+
+
+def mpllry_key(image_id) -> str:
+    """Cache key of a Mapillary image (its thumbnail urls are signed and expire, the id does not)"""
+    return f"mapillary:{image_id}"
+
+
+def url_key(url : str) -> str:
+    """
+    Cache key of a generic image url: scheme and host lowercased, credentials dropped, query params sorted.
+    e.g. the same Street View url requested with two different API keys maps to the same key.
+    """
+    parts = urlsplit(url)
+    query = sorted((k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if k.lower() not in VOLATILE_PARAMS)
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, urlencode(query), ""))
+
+
+class ImageCache:
+    """
+    On-disk image cache with a size cap and LRU eviction.
+
+    Entries are stored under the sha256 of their key, and written atomically (temp file + rename),
+    so concurrent readers never see partial files. Reads refresh the file mtime, which is used as the LRU clock.
+    """
+
+    def __init__(self, cache_dir : str = None, max_bytes : int = DEFAULT_MAX_BYTES):
+        self.cache_dir = Path(cache_dir or default_cache_dir())
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._size = sum(p.stat().st_size for p in self._entries())
+
+    def _path(self, key : str) -> Path:
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return self.cache_dir / digest[:2] / digest
+
+    def _entries(self):
+        return (p for p in self.cache_dir.glob("??/*") if not p.name.startswith("."))
+
+    def get(self, key : str):
+        """
+        Returns the cached bytes for key, or None on a miss.
+        """
+        path = self._path(key)
+        try:
+            data = path.read_bytes()
+            os.utime(path)  # mark as recently used
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return data
+
+    def put(self, key : str, data : bytes) -> None:
+        """
+        Stores data under key, evicting the least recently used entries if the cache grows over max_bytes.
+        """
+        path = self._path(key)
+        path.parent.mkdir(exist_ok=True)
+        old_size = path.stat().st_size if path.exists() else 0
+
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)  # atomic on POSIX and Windows
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+        with self._lock:
+            self._size += len(data) - old_size
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self) -> None:
+        """Deletes the least recently used entries until the cache is back to 90% of max_bytes"""
+        entries = []
+        for p in self._entries():
+            try:
+                stat = p.stat()
+            except FileNotFoundError:  # evicted by another process
+                continue
+            entries.append((stat.st_mtime, stat.st_size, p))
+        entries.sort()
+
+        self._size = sum(size for _, size, _ in entries)
+        target = 0.9 * self.max_bytes
+        for _, size, p in entries:
+            if self._size <= target:
+                break
+            p.unlink(missing_ok=True)
+            self._size -= size
+
+    def get_or_fetch(self, key : str, fetch):
+        """
+        Returns the cached bytes for key, calling fetch() (which returns bytes, or None on failure) and caching its result on a miss.
+        """
+        data = self.get(key)
+        if data is None:
+            data = fetch()
+            if data is not None:
+                self.put(key, data)
+        return data
+
+    async def aget_or_fetch(self, key : str, fetch):
+        """
+        Async version of get_or_fetch, for the asyncio loop: fetch() is a coroutine function (e.g. an AsyncDownloader download),
+        disk reads and writes run in a worker thread.
+        """
+        data = await asyncio.to_thread(self.get, key)
+        if data is None:
+            data = await fetch()
+            if data is not None:
+                await asyncio.to_thread(self.put, key, data)
+        return data
+
+
+def fetch_url_cached(url : str, cache : ImageCache = None, session : requests.Session = None, timeout : float = 10):
+    """
+    Downloads an image through the cache: the network is only touched on a miss.
+    Raises requests.RequestException if the download fails (like `requests.get(...).raise_for_status()`).
+
+    Returns:
+        The raw image bytes
+    """
+    def fetch():
+        resp = (session or requests).get(url, timeout=timeout)
+        resp.raise_for_status()
+        return resp.content
+
+    if cache is None:
+        return fetch()
+    return cache.get_or_fetch(url_key(url), fetch)
+
+
+async def afetch_url_cached(url : str, downloader, cache : ImageCache = None) -> bytes:
+    """
+    Async version of fetch_url_cached: downloads an image through the cache with an AsyncDownloader (see downloader.py),
+    without blocking the event loop. Raises httpx.HTTPError if the download fails.
+
+    Returns:
+        The raw image bytes
+    """
+    if cache is None:
+        return await downloader.fetch(url)
+    return await cache.aget_or_fetch(url_key(url), lambda: downloader.fetch(url))
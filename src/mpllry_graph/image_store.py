@@ -0,0 +1,98 @@
+import base64
+import hashlib
+import threading
+from typing import TypedDict
+
+# Shared in-memory byte store for the images that are flowing through the graphs.
+# Graph state only carries small ImageRef handles: the raw bytes are held once here, and encoded to base64
+# only when the provider request is built (see utils.prepare_multimodal_message).
+# Entries are reference counted, so memory is given back as soon as the last user of an image releases it,
+# and peak memory scales with the images in flight, not with the images of the run.
+
+
+def detect_image_format(image_bytes: bytes) -> tuple[str, str]:
+    """
+    Detect image format from bytes using magic bytes (file signatures).
+    
+    Args:
+        image_bytes: Raw image bytes
+        
+    Returns:
+        Tuple of (mime_type, extension) e.g., ('image/jpeg', 'jpg')
+    """
+    # Check magic bytes (most reliable method)
+    if image_bytes.startswith(b'\xff\xd8\xff'):
+        return 'image/jpeg', 'jpg'
+    elif image_bytes.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'image/png', 'png'
+    elif image_bytes.startswith(b'GIF87a') or image_bytes.startswith(b'GIF89a'):
+        return 'image/gif', 'gif'
+    elif image_bytes.startswith(b'RIFF') and b'WEBP' in image_bytes[:12]:
+        return 'image/webp', 'webp'
+    else:
+        # Fallback: assume JPEG (most common for Mapillary)
+        return 'image/jpeg', 'jpg'
+
+
+class ImageRef(TypedDict):
+    """Handle of an image in the store, cheap to copy and to checkpoint"""
+    id: str  # id of the image (e.g. Mapillary id or file name), for logs and results
+    key: str  # content hash, key of the bytes in the store
+
+
+class ImageStore:
+    """
+    Content-addressed, reference-counted store of image bytes.
+    Identical images share one entry. Every `put` (or `retain`) must be balanced by a `release`.
+    Thread safe: images are added from the worker pools too.
+    """
+
+    def __init__(self):
+        self._data = {}  # key -> bytes
+        self._refcounts = {}  # key -> number of holders
+        self._lock = threading.Lock()
+
+    def put(self, img_bytes : bytes, image_id : str = None) -> ImageRef:
+        """Stores the image (or takes another reference to it, if already stored) and returns its handle"""
+        key = hashlib.blake2b(img_bytes, digest_size=16).hexdigest()
+        with self._lock:
+            if key not in self._data:
+                self._data[key] = img_bytes
+            self._refcounts[key] = self._refcounts.get(key, 0) + 1
+        return ImageRef(id=image_id or key, key=key)
+
+    def retain(self, ref : ImageRef) -> ImageRef:
+        """Takes another reference to a stored image, e.g. to hand it over to a consumer that will release it"""
+        with self._lock:
+            self._refcounts[ref["key"]] += 1
+        return ref
+
+    def release(self, ref : ImageRef) -> None:
+        """Drops a reference: the bytes are freed when the last one is released"""
+        with self._lock:
+            key = ref["key"]
+            self._refcounts[key] -= 1
+            if self._refcounts[key] == 0:
+                del self._refcounts[key]
+                del self._data[key]
+
+    def get(self, ref : ImageRef) -> bytes:
+        """Raw bytes of the image. Raises KeyError if it was already released."""
+        return self._data[ref["key"]]
+
+    def b64(self, ref : ImageRef) -> str:
+        """Base64 encoding of the image, computed on demand and never kept"""
+        return base64.b64encode(self.get(ref)).decode('utf-8')
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    @property
+    def nbytes(self) -> int:
+        """Total size of the stored images"""
+        with self._lock:
+            return sum(len(img_bytes) for img_bytes in self._data.values())
+
+
+# process-wide store, shared by the nodes of both graphs
+IMAGE_STORE = ImageStore()
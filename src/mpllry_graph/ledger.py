@@ -0,0 +1,99 @@
+import json
+import sqlite3
+import time
+
+# Persistent run ledger: records every item (image or point id) of a batch run with its status and result,
+# so that a crashed or interrupted run can be restarted with the same run id without paying twice for the same item.
+
+PENDING = "pending"
+DONE = "done"
+FAILED = "failed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    params TEXT,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS items (
+    run_id TEXT NOT NULL,
+    item_id TEXT NOT NULL,
+    status TEXT NOT NULL,
+    payload TEXT,
+    result TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (run_id, item_id)
+);
+CREATE INDEX IF NOT EXISTS items_status ON items (run_id, status);
+"""
+
+
+class RunLedger:
+    """
+    Ledger of a single run, stored in SQLite. Every update is committed immediately,
+    so after a crash the ledger reflects exactly the results already paid for.
+    """
+
+    def __init__(self, db_path : str, run_id : str, params : dict = None):
+        self.run_id = run_id
+        self.conn = sqlite3.connect(db_path)
+        self.conn.executescript(SCHEMA)
+        self.conn.execute("PRAGMA journal_mode=WAL")  # cheap commits, readers (e.g. a dashboard) do not block the run
+
+        row = self.conn.execute("SELECT params FROM runs WHERE run_id = ?", (run_id,)).fetchone()
+        self.resumed = row is not None
+        if self.resumed:
+            self.params = json.loads(row[0]) if row[0] else {}
+        else:
+            self.params = params or {}
+            with self.conn:
+                self.conn.execute("INSERT INTO runs VALUES (?, ?, ?)", (run_id, json.dumps(self.params), time.time()))
+
+    def add_item(self, item_id : str, payload : dict = None) -> None:
+        """Registers an item as pending (no-op if the run already has it)"""
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR IGNORE INTO items (run_id, item_id, status, payload, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (self.run_id, item_id, PENDING, json.dumps(payload) if payload is not None else None, time.time())
+            )
+
+    def mark_done(self, item_id : str, result : dict = None) -> None:
+        self._update(item_id, DONE, result=json.dumps(result) if result is not None else None, error=None)
+
+    def mark_failed(self, item_id : str, error : str) -> None:
+        self._update(item_id, FAILED, result=None, error=error)
+
+    def _update(self, item_id : str, status : str, result, error) -> None:
+        with self.conn:
+            self.conn.execute(
+                "UPDATE items SET status = ?, result = ?, error = ?, attempts = attempts + 1, updated_at = ? WHERE run_id = ? AND item_id = ?",
+                (status, result, error, time.time(), self.run_id, item_id)
+            )
+
+    def is_done(self, item_id : str) -> bool:
+        row = self.conn.execute("SELECT status FROM items WHERE run_id = ? AND item_id = ?", (self.run_id, item_id)).fetchone()
+        return row is not None and row[0] == DONE
+
+    def unfinished(self) -> list[tuple]:
+        """
+        Returns (item_id, payload) of the items still pending or failed, i.e. the ones to (re)try on resume.
+        """
+        rows = self.conn.execute("SELECT item_id, payload FROM items WHERE run_id = ? AND status != ?", (self.run_id, DONE)).fetchall()
+        return [(item_id, json.loads(payload) if payload else None) for item_id, payload in rows]
+
+    def results(self) -> list[tuple]:
+        """Returns (item_id, result) of the completed items"""
+        rows = self.conn.execute("SELECT item_id, result FROM items WHERE run_id = ? AND status = ?", (self.run_id, DONE)).fetchall()
+        return [(item_id, json.loads(result) if result else None) for item_id, result in rows]
+
+    def counts(self) -> dict:
+        """Number of items per status, e.g. {'done': 120, 'failed': 3, 'pending': 0}"""
+        counts = {PENDING: 0, DONE: 0, FAILED: 0}
+        for status, n in self.conn.execute("SELECT status, COUNT(*) FROM items WHERE run_id = ? GROUP BY status", (self.run_id,)):
+            counts[status] = n
+        return counts
+
+    def close(self) -> None:
+        self.conn.close()
@@ -1,46 +1,82 @@
 import asyncio
-from langgraph.checkpoint.memory import InMemorySaver
-from make_graph import get_graph
-from utils import get_multimodal_prompt, get_mpllry_b64
+import argparse
 import uuid
-from tqdm import tqdm
+import time
+from make_graph import get_graph, get_mpllry_agent
+from utils import get_multimodal_prompt, aiter_mpllry_images
+from mpllry_index import sample_from_index
+from image_cache import ImageCache
+from batch import run_batch, EvalRecord
+from preprocess import ImageConfig
+from prefilter import PrefilterConfig
+from dedup import PHashIndex
+from ledger import RunLedger
+from providers import load_env
+from sinks import JsonlSink, ParquetSink, MultiSink
 from pathlib import Path
-from dotenv import load_dotenv
-from datetime import datetime
-from langchain_core.messages import HumanMessage
-import base64
-async def main():
 
-    load_dotenv()
 
-    # memory (take this off if we want independent evaluations)
-    # checkpointer = InMemorySaver()
-    
-    # Define graph
-    graph = get_graph()
+async def mpllry_images(num_points : int, ledger : RunLedger, metadata : list[dict] = None, cache : ImageCache = None):
+    """
+    Yields (image_id, img_bytes, metadata) as soon as each image is downloaded, registering them in the run ledger.
+    Images already evaluated in this run are skipped.
+    """
+    async for img_metadata, img_content in aiter_mpllry_images(num_points, metadata=metadata, cache=cache):
+        image_id = img_metadata["id"]
+        if ledger.is_done(image_id):
+            continue
+        ledger.add_item(image_id, img_metadata)
+        yield image_id, img_content, img_metadata  # raw bytes: base64 is only built for the model request
 
-    # Set thread ID for memory
-    thread_id = str(uuid.uuid4())[:8]
-    config = {"configurable": {"thread_id": thread_id}}
-    
-    # get a mapillary image from api 
-    images = get_mpllry_b64(
-        num_points=3,
-        save_images=True,
-        save_folder=f"images/run_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-        )
+
+async def run_images(ledger : RunLedger, num_points : int, cache : ImageCache):
+    """
+    Images of the run: on resume, first the ones registered but not evaluated yet (read back from the cache), 
+    then new samples up to num_points. 
+    NOTE: without the local index, points with no image are not registered, so a resumed run can sample a few more points.
+    """
+    retry = [payload for _, payload in ledger.unfinished()]
+    to_sample = max(0, num_points - sum(ledger.counts().values()))
+    if ledger.resumed:
+        print(f"Resuming run {ledger.run_id}: {len(retry)} images to retry, {to_sample} new points to sample")
+
+    if retry:
+        async for item in mpllry_images(0, ledger, metadata=retry, cache=cache):
+            yield item
+
+    if to_sample > 0:
+        # sample offline from the local index if it was harvested (`python mpllry_index.py`), otherwise query the api point by point
+        index_path = Path("./mpllry_index.sqlite")
+        metadata = sample_from_index(str(index_path), num_points=to_sample) if index_path.exists() else None
+        async for item in mpllry_images(to_sample, ledger, metadata=metadata, cache=cache):
+            yield item
+
+
+async def main(num_points : int = 3, concurrency : int = 8, timeout : float = 120.0, image_config : ImageConfig = None, dedup_threshold : int = 6, run_id : str = None, prefilter_config : PrefilterConfig = None):
+
+    load_env()
+
+    # Define graph (no checkpointer: each image is a single, independent invocation, progress is tracked by the ledger)
+    # with the pre-filter, obviously blurry / tilted / badly exposed images are rejected without a model call
+    graph = get_graph(image_config=image_config, prefilter_config=prefilter_config)
+
+    # persistent ledger of the run: restarting with the same run id skips the images already evaluated
+    run_id = run_id or str(uuid.uuid4())[:8]
+    ledger = RunLedger("./runs.sqlite", run_id, params={"num_points": num_points})
+    num_points = ledger.params.get("num_points", num_points)  # on resume, the original size of the run
+    print(f"Run id: {run_id} (resume with --run-id {run_id})")
     
-    if len(images) == 0:
-        print("No images found. Stopping execution.")
-        return   # stop execution if no images are found
+    # get mapillary images from api (thumbnails already downloaded in previous runs are read from the shared cache)
+    # NOTE: images are downloaded while the first ones are already being evaluated
+    images = run_images(ledger, num_points, cache=ImageCache())
 
     # Construct multimodal system message
     # 1) get paths of the examples (good = acceptable images, bad = discardable images) 
     good_dir = Path("./examples/good_examples/")
     bad_dir = Path("./examples/bad_examples/")
-    good_paths = [str(p) for p in good_dir.iterdir() if p.is_file()]
-    bad_paths = [str(p) for p in bad_dir.iterdir() if p.is_file()]
-    # 2) construct the prompt (adds the example to the textual prompt in prompts/mpllry_prompt)
+    good_paths = sorted(str(p) for p in good_dir.iterdir() if p.is_file())  # sorted: the prefix must be identical across runs to hit the provider prompt cache
+    bad_paths = sorted(str(p) for p in bad_dir.iterdir() if p.is_file())
+    # 2) construct the prompt (adds the example to the textual prompt in prompts/mpllry_prompt, built once and cached on disk)
     sys_msg = get_multimodal_prompt(
         good_imgs_paths=good_paths,
         bad_imgs_paths=bad_paths,
@@ -48,22 +84,78 @@ async def main():
 
     print("\n=== Evaluating Mapillary images ===\n")
 
-    for img_b64 in images:
-    
-        # Initialize state with the image 
-        init_state = {
-            "messages": [sys_msg] + [HumanMessage("Analize the following images")],  # NOTE: 
-            "images": [img_b64]
-        }
-        
-        # AI invocation
-        print("\nAssistant: ", end="", flush=True)
-        response = None
-        async for chunk in graph.astream(init_state, stream_mode="values", config=config):
-            response = chunk["messages"][-1]
-        if response is not None:
-            print(response.content)
+    # near-identical frames (e.g. consecutive frames of a sequence) reuse the verdict of the first one
+    dedup = PHashIndex(threshold=dedup_threshold) if dedup_threshold >= 0 else None
+
+    # verdicts are appended as they complete: JSONL to follow the run (`tail -f`), rolling Parquet files for analysis
+    sink = MultiSink([
+        JsonlSink(f"results/{run_id}.jsonl"),
+        ParquetSink(f"results/{run_id}", fields={"run_id": str, "timestamp": float, **EvalRecord.field_types()}),
+    ])
+
+    evaluated = 0
+    prefiltered = 0
+    try:
+        async for record in run_batch(graph, images, sys_msg, concurrency=concurrency, timeout=timeout, dedup=dedup):
+            evaluated += 1
+            prefiltered += record.model == "prefilter"
+            sink.write({"run_id": run_id, "timestamp": time.time(), **record.model_dump()})
+            if record.error:
+                ledger.mark_failed(record.image_id, record.error)
+            else:
+                ledger.mark_done(record.image_id, record.model_dump())
+
+            if record.error:
+                print(f"[{record.image_id}] ERROR ({record.latency:.1f}s): {record.error}")
+            elif record.duplicate_of:
+                print(f"[{record.image_id}] {record.response} (duplicate of {record.duplicate_of}): {record.reason}")
+            else:
+                print(f"[{record.image_id}] {record.response} ({record.latency:.1f}s): {record.reason}")
+    finally:
+        sink.close()  # also on Ctrl-C: flushes the buffers and writes the footer of the current parquet file
+
+    if evaluated == 0:
+        print("No images to evaluate.")
+    elif dedup is not None:
+        print(f"\nDedup: {dedup.hits} verdicts reused, {dedup.misses} model calls (hit rate {dedup.hit_rate:.1%})")
+    if prefilter_config is not None and evaluated:
+        print(f"Pre-filter: {prefiltered} images rejected without a model call")
 
+    # calls, errors and latency of each model of the cascade (see MPLLRY_CASCADE in make_graph.py)
+    agent = get_mpllry_agent()
+    for level, tier in enumerate(agent.stats()):
+        print(f"Tier {level}: " + ", ".join(f"{name} {s['calls']} calls / {s['errors']} errors" for name, s in tier.items()))
+    if len(agent.tiers) > 1:
+        print(f"Escalations: {agent.escalations}")
+
+    counts = ledger.counts()
+    print(f"Run {run_id}: {counts['done']} done, {counts['failed']} failed, {counts['pending']} pending")
+    ledger.close()
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Evaluate the quality of Mapillary images")
+    parser.add_argument("--num-points", type=int, default=3, help="number of points to sample")
+    parser.add_argument("--run-id", type=str, default=None, help="id of an interrupted run to resume (a new run is started if not given)")
+    parser.add_argument("--concurrency", type=int, default=8, help="maximum number of images evaluated at the same time")
+    parser.add_argument("--timeout", type=float, default=120.0, help="per-image timeout in seconds")
+    parser.add_argument("--max-edge", type=int, default=None, help="resize images so that their longest side is at most this many pixels")
+    parser.add_argument("--jpeg-quality", type=int, default=None, help="JPEG quality used when re-encoding images (default 85)")
+    parser.add_argument("--grayscale", action="store_true", help="send images in grayscale")
+    parser.add_argument("--dedup-threshold", type=int, default=6, help="max Hamming distance between perceptual hashes of near-identical frames (-1 disables dedup)")
+    parser.add_argument("--prefilter", action="store_true", help="reject obviously blurry, tilted or badly exposed images before the model call")
+    parser.add_argument("--min-sharpness", type=float, default=None, help="pre-filter: Laplacian variance below which an image is blurry (default 20)")
+    parser.add_argument("--max-ground-fraction", type=float, default=None, help="pre-filter: share of the frame that looks like the street above which the camera points down (default 0.9)")
+    args = parser.parse_args()
+
+    # images are only preprocessed if asked to
+    image_config = None
+    if args.max_edge is not None or args.jpeg_quality is not None or args.grayscale:
+        image_config = ImageConfig(max_edge=args.max_edge, jpeg_quality=args.jpeg_quality or 85, grayscale=args.grayscale)
+
+    # thresholds not given on the command line keep their defaults (see prefilter.PrefilterConfig)
+    prefilter_config = None
+    if args.prefilter:
+        thresholds = {"min_sharpness": args.min_sharpness, "max_ground_fraction": args.max_ground_fraction}
+        prefilter_config = PrefilterConfig(**{k: v for k, v in thresholds.items() if v is not None})
+
+    asyncio.run(main(num_points=args.num_points, concurrency=args.concurrency, timeout=args.timeout, image_config=image_config, dedup_threshold=args.dedup_threshold, run_id=args.run_id, prefilter_config=prefilter_config))
@@ -2,63 +2,134 @@ from langgraph.graph import START, StateGraph
 from langgraph.types import Command
 from typing import Literal
 from langchain.agents import create_agent
-from langchain_openai import ChatOpenAI
-from dotenv import load_dotenv
 from pydantic import BaseModel
 from typing import Annotated
+import os
+from functools import cache
 from state import MultiState
 from utils import prepare_multimodal_message
-
-load_dotenv()
+from preprocess import ImageConfig, normalize_images
+from prefilter import PrefilterConfig, prefilter_images
+from image_store import IMAGE_STORE
+from providers import build_cascade, load_env
 
 # Structured output
 class BinaryOutput(BaseModel):
     response: Literal["yes", "no"]
     reason: Annotated[str, "The reason why you accepted or discarded an image"]
+    confidence: Annotated[float, "How sure you are of the response, from 0 (guess) to 1 (certain)"]
 
-# make its output structured: yes/no
-mpllry_agent = create_agent(
-    model=ChatOpenAI(model="gpt-4o-mini"),
-    tools=[],
-    system_prompt="You are a helpful AI assistant that evaluates the quality of street view images, downloaded from the Mapillary app. ",  # short prompt because the real one is passed at runtime
-    state_schema=MultiState,
-    response_format=BinaryOutput
-)
+def _confident(result : dict, min_confidence : float) -> bool:
+    """A tier's answer is kept if it is a valid verdict with enough confidence"""
+    verdict = result.get("structured_response")
+    return verdict is not None and verdict.confidence >= min_confidence
 
-async def multimodal_node(state: MultiState) -> Command[Literal["__end__"]]:   # after multimodal -> stop 
+@cache
+def get_mpllry_agent():
     """
-    Handles multimodal inputs with multimodal model
+    Builds the agent on first use (then cached), so that importing this module, building the graph or running
+    the pre-filter alone never pays for provider imports and clients.
+
+    Cheapest model first, escalating to the next tier on low confidence or invalid output, see providers.py:
+    MPLLRY_CASCADE="QWEN,OPENAI" or "QWEN|OPENAI_MINI,OPENAI" (providers of the same tier share the load).
     """
+    load_env()
+    min_confidence = float(os.getenv("MPLLRY_MIN_CONFIDENCE", "0.7"))
 
-    # construct multimodal input message
-    multimodal_msg = prepare_multimodal_message(state)  # returns HumanMessage w/ content blocks w/ image
+    # make its output structured: yes/no
+    return build_cascade(
+        os.getenv("MPLLRY_CASCADE", "OPENAI_MINI"),
+        build=lambda model: create_agent(
+            model=model,
+            tools=[],
+            system_prompt="You are a helpful AI assistant that evaluates the quality of street view images, downloaded from the Mapillary app. ",  # short prompt because the real one is passed at runtime
+            state_schema=MultiState,
+            response_format=BinaryOutput
+        ),
+        accept=lambda result: _confident(result, min_confidence)
+    )
 
-    # concatenate chat history with new multimodal message
-    history = state.get("messages", []) if state.get("messages", []) else []
-    updated_history = history + [multimodal_msg]  # LG wants lists to concatenate messages
+def make_multimodal_node(image_config : ImageConfig = None):
+    """
+    Builds the multimodal node. If image_config is given, images are resized and re-encoded before the model call.
+    """
 
-    result = await mpllry_agent.ainvoke({"messages": updated_history})
-    last_msg = result["messages"][-1]
+    async def multimodal_node(state: MultiState) -> Command[Literal["__end__"]]:   # after multimodal -> stop 
+        """
+        Handles multimodal inputs with multimodal model
+        """
 
-    return Command(
-        update={
-            "messages" : [last_msg],  # must be a list
-            "images" : [],  # clearing images after invocation, keep memory lightweight
-        },
-        goto="__end__"
-    )
+        # resize / re-encode images in a worker pool (no-op if image_config is None), into IMAGE_STORE
+        images = await normalize_images(state.get("images", []), image_config, IMAGE_STORE)
+        try:
+            # construct multimodal input message (base64 is only built here, for the request)
+            multimodal_msg = prepare_multimodal_message(state, images)  # returns HumanMessage w/ content blocks w/ image
+        finally:
+            for ref in images:  # normalized copies are not needed anymore
+                IMAGE_STORE.release(ref)
+
+        # concatenate chat history with new multimodal message
+        history = state.get("messages", []) if state.get("messages", []) else []
+        updated_history = history + [multimodal_msg]  # LG wants lists to concatenate messages
+
+        result = await get_mpllry_agent().ainvoke({"messages": updated_history})
+        last_msg = result["messages"][-1]
+
+        return Command(
+            update={
+                "messages" : [last_msg],  # must be a list
+                "images" : [],  # clearing images after invocation, keep memory lightweight
+                "structured_response" : result.get("structured_response"),  # BinaryOutput verdict, read by the batch driver
+            },
+            goto="__end__"
+        )
+
+    return multimodal_node
+
+def make_prefilter_node(prefilter_config : PrefilterConfig):
+    """
+    Builds the pre-filter node: images that are obviously blurry, tilted toward the ground or badly exposed
+    (see prefilter.py) are discarded without a model call, the others go on to the multimodal node.
+    """
+
+    async def prefilter_node(state: MultiState) -> Command[Literal["multimodal_agent", "__end__"]]:
+        """
+        Rejects the images with pixel statistics, when confident
+        """
+        images = state.get("images", [])
+        reasons = await prefilter_images(images, prefilter_config, IMAGE_STORE)
+
+        if not images or any(reason is None for reason in reasons):  # at least one image needs the model
+            return Command(goto="multimodal_agent")
+
+        return Command(
+            update={
+                "images" : [],
+                "prefiltered" : True,
+                "structured_response" : BinaryOutput(response="no", reason="Pre-filter: " + "; ".join(reasons), confidence=1.0),
+            },
+            goto="__end__"
+        )
+
+    return prefilter_node
 
-def get_graph(checkpointer=None) -> StateGraph:
+def get_graph(checkpointer=None, image_config : ImageConfig = None, prefilter_config : PrefilterConfig = None) -> StateGraph:
     """
     Builds and compiles the graph. 
 
     If a checkpointer is provided, the graph will be compiled with the checkpointer.
+    If an image_config is provided, images are normalized (resized / re-encoded) before being sent to the model.
+    If a prefilter_config is provided, obviously bad images are rejected before the model call (see prefilter.py).
     """
     builder = StateGraph(MultiState)
     # nodes
-    builder.add_node("multimodal_agent", multimodal_node)
+    builder.add_node("multimodal_agent", make_multimodal_node(image_config))
     # edges
-    builder.add_edge(START, "multimodal_agent")
+    if prefilter_config is None:
+        builder.add_edge(START, "multimodal_agent")
+    else:
+        builder.add_node("prefilter", make_prefilter_node(prefilter_config))
+        builder.add_edge(START, "prefilter")  # routes on with Command
 
     if checkpointer is None:
         graph = builder.compile()
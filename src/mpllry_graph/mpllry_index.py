@@ -0,0 +1,220 @@
+import sqlite3
+import math
+import random
+import time
+import requests
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from providers import load_env
+from utils import get_mpllry_session, _get_access_token, _resolve_bounds, MAPILLARY_IMAGES_URL
+
+# Local spatial index of Mapillary image metadata.
+# The bbox is harvested once (paging through a fixed grid of cells with large limits),
+# then points are sampled from the index with no network calls at all.
+
+HARVEST_FIELDS = "id,sequence,thumb_1024_url,camera_type,computed_geometry,geometry,thumb_original_url"
+MAX_LIMIT = 2000  # max page size accepted by the Mapillary images endpoint
+CELL_SIZE = 0.005  # size (in degrees) of the grid cells used to page through a bbox, roughly 500m
+MIN_CELL_SIZE = CELL_SIZE / 16  # do not split cells below this size, even if they are still full
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    id INTEGER PRIMARY KEY,
+    sequence TEXT,
+    lat REAL NOT NULL,
+    lon REAL NOT NULL,
+    camera_type TEXT,
+    thumb_1024_url TEXT,
+    thumb_original_url TEXT
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS images_rtree USING rtree(id, min_lat, max_lat, min_lon, max_lon);
+CREATE TABLE IF NOT EXISTS harvested_cells (
+    cell_lat INTEGER NOT NULL,
+    cell_lon INTEGER NOT NULL,
+    num_images INTEGER NOT NULL,
+    harvested_at REAL NOT NULL,
+    PRIMARY KEY (cell_lat, cell_lon)
+);
+"""
+
+
+def open_index(db_path : str) -> sqlite3.Connection:
+    """
+    Opens (and creates, if needed) the local index at db_path.
+    """
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def _grid_cells(lat_min : float, lat_max : float, lon_min : float, lon_max : float):
+    """
+    Yields the (cell_lat, cell_lon) indices of the fixed CELL_SIZE grid covering the bbox.
+    The grid is global, so overlapping bboxes share cells and never harvest the same cell twice.
+    """
+    for cell_lat in range(math.floor(lat_min / CELL_SIZE), math.floor(lat_max / CELL_SIZE) + 1):
+        for cell_lon in range(math.floor(lon_min / CELL_SIZE), math.floor(lon_max / CELL_SIZE) + 1):
+            yield cell_lat, cell_lon
+
+
+def _query_box(session : requests.Session, box : tuple, access_token : str, url : str = MAPILLARY_IMAGES_URL) -> list[dict]:
+    """
+    Single metadata call for all the images in box = (lat_min, lat_max, lon_min, lon_max), up to MAX_LIMIT.
+    Retries a few times on errors, since a failed call would leave a hole in the index.
+    """
+    lat_min, lat_max, lon_min, lon_max = box
+    params = {
+        "access_token": access_token,
+        "fields": HARVEST_FIELDS,
+        "bbox": f"{lon_min},{lat_min},{lon_max},{lat_max}",
+        "limit": MAX_LIMIT
+    }
+    for attempt in range(3):
+        try:
+            r = session.get(url, params=params, timeout=60)
+            if r.status_code == 200:
+                return r.json().get("data", [])
+        except requests.exceptions.RequestException:
+            pass
+        time.sleep(2 ** attempt)
+    raise RuntimeError(f"Could not harvest box {box}")
+
+
+def _harvest_cell(session : requests.Session, cell : tuple, access_token : str) -> list[dict]:
+    """
+    Worker: collects all the images of a grid cell.
+    The images endpoint has no cursor, so a full page means the cell is too dense: it is split in four and harvested again.
+    """
+    cell_lat, cell_lon = cell
+    boxes = [(cell_lat * CELL_SIZE, (cell_lat + 1) * CELL_SIZE, cell_lon * CELL_SIZE, (cell_lon + 1) * CELL_SIZE)]
+    images = []
+    while boxes:
+        box = boxes.pop()
+        data = _query_box(session, box, access_token)
+        lat_min, lat_max, lon_min, lon_max = box
+        if len(data) >= MAX_LIMIT and (lat_max - lat_min) > MIN_CELL_SIZE:
+            lat_mid, lon_mid = (lat_min + lat_max) / 2, (lon_min + lon_max) / 2
+            boxes += [
+                (lat_min, lat_mid, lon_min, lon_mid), (lat_min, lat_mid, lon_mid, lon_max),
+                (lat_mid, lat_max, lon_min, lon_mid), (lat_mid, lat_max, lon_mid, lon_max),
+            ]
+        else:
+            images += data
+    return images
+
+
+def _to_row(img : dict):
+    """Flattens an API record to an `images` row, or None if it has no usable geometry"""
+    geometry = img.get("computed_geometry") or img.get("geometry")
+    if not geometry or not img.get("id"):
+        return None
+    lon, lat = geometry["coordinates"][:2]
+    sequence = img.get("sequence")
+    if isinstance(sequence, dict):  # the API can return the sequence as an object
+        sequence = sequence.get("id")
+    return (int(img["id"]), sequence, lat, lon, img.get("camera_type"), img.get("thumb_1024_url"), img.get("thumb_original_url"))
+
+
+def harvest_bbox(db_path : str, bbox : list[float] = None, refresh : bool = False, max_workers : int = 8, session : requests.Session = None) -> int:
+    """
+    Pages through the whole bbox once and stores the metadata of every image in the local index.
+    Cells already harvested are skipped, so re-running on the same area makes zero metadata calls.
+
+    Args:
+        db_path: Path of the SQLite index
+        bbox: Bounding box as [lat_min, lat_max, lon_min, lon_max]. Defaults to Bologna area.
+        refresh: If True, harvest again also the cells already in the index (e.g. to renew the signed thumbnail urls)
+        max_workers: Maximum number of cells harvested concurrently
+        session: Optional requests session to reuse
+
+    Returns:
+        Number of images stored (or updated) by this call
+    """
+    bounds = _resolve_bounds(bbox)
+    access_token = _get_access_token()
+    session = session if session is not None else get_mpllry_session(max_workers)
+    conn = open_index(db_path)
+
+    cells = list(_grid_cells(*bounds))
+    if not refresh:
+        done = {(row["cell_lat"], row["cell_lon"]) for row in conn.execute("SELECT cell_lat, cell_lon FROM harvested_cells")}
+        cells = [cell for cell in cells if cell not in done]
+    print(f"Harvesting {len(cells)} cells into {db_path}")
+
+    stored = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        in_flight = {pool.submit(_harvest_cell, session, cell, access_token): cell for cell in cells}
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                cell = in_flight.pop(future)
+                rows = [row for row in map(_to_row, future.result()) if row is not None]
+                # writes happen here, in the calling thread: sqlite connections are not shared across threads
+                with conn:
+                    conn.executemany("INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+                    conn.executemany("INSERT OR REPLACE INTO images_rtree VALUES (?, ?, ?, ?, ?)", [(row[0], row[2], row[2], row[3], row[3]) for row in rows])
+                    conn.execute("INSERT OR REPLACE INTO harvested_cells VALUES (?, ?, ?, ?)", (*cell, len(rows), time.time()))
+                stored += len(rows)
+
+    conn.close()
+    print(f"Stored {stored} images")
+    return stored
+
+
+def _to_metadata(row : sqlite3.Row) -> dict:
+    """Rebuilds the same metadata dict the Mapillary API returns"""
+    return {
+        "id": str(row["id"]),
+        "sequence": row["sequence"],
+        "camera_type": row["camera_type"],
+        "computed_geometry": {"type": "Point", "coordinates": [row["lon"], row["lat"]]},
+        "thumb_1024_url": row["thumb_1024_url"],
+        "thumb_original_url": row["thumb_original_url"],
+    }
+
+
+def sample_from_index(db_path : str, num_points : int, bbox : list[float] = None, delta = 0.005, max_retries = 10) -> list[dict]:
+    """
+    Offline equivalent of the sampling in `get_mpllry_b64`: samples random points in the bbox
+    and picks the closest indexed image within delta degrees. No network calls are made.
+    The same image is never returned twice.
+
+    Args:
+        db_path: Path of the SQLite index (see `harvest_bbox`)
+        num_points: Number of points to sample
+        bbox: Bounding box as [lat_min, lat_max, lon_min, lon_max]. Defaults to Bologna area.
+        delta: Search radius in degrees around each sampled point
+        max_retries: Maximum re-samples per point if no image is close enough
+
+    Returns:
+        List of metadata dicts, to be passed to `get_mpllry_b64(..., metadata=...)`
+    """
+    lat_min, lat_max, lon_min, lon_max = _resolve_bounds(bbox)
+    conn = open_index(db_path)
+
+    query = """
+        SELECT images.* FROM images_rtree JOIN images ON images.id = images_rtree.id
+        WHERE images_rtree.min_lat >= ? AND images_rtree.max_lat <= ? AND images_rtree.min_lon >= ? AND images_rtree.max_lon <= ?
+        ORDER BY (images.lat - ?) * (images.lat - ?) + (images.lon - ?) * (images.lon - ?)
+        LIMIT ?
+    """
+    seen = set()
+    samples = []
+    for _ in range(num_points):
+        for _ in range(max_retries):
+            lat, lon = random.uniform(lat_min, lat_max), random.uniform(lon_min, lon_max)
+            rows = conn.execute(query, (lat - delta, lat + delta, lon - delta, lon + delta, lat, lat, lon, lon, len(seen) + 1)).fetchall()
+            row = next((row for row in rows if row["id"] not in seen), None)
+            if row is not None:
+                seen.add(row["id"])
+                samples.append(_to_metadata(row))
+                break
+
+    conn.close()
+    print(f"Sampled {len(samples)} images from {db_path}")
+    return samples
+
+
+if __name__ == "__main__":
+    load_env()
+    harvest_bbox("mpllry_index.sqlite")
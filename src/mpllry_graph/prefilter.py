@@ -0,0 +1,101 @@
+import asyncio
+import io
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+from PIL import Image, ImageOps
+from pydantic import BaseModel
+
+# Pixel-statistics pre-filter: rejects images that obviously fail the criteria of prompts/mpllry_prompt.py
+# (blurry, camera tilted toward the ground, unusable exposure) before paying for a model call.
+# Thresholds are deliberately conservative: only confident rejects are decided here, anything borderline goes to the model.
+
+_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="prefilter")  # decoding and numpy release the GIL
+
+
+class PrefilterConfig(BaseModel):
+    """Thresholds of the pre-filter. The statistics are computed on a copy resized to `max_edge`, so they do not depend on the resolution."""
+    max_edge: int = 512
+    min_sharpness: float = 20.0  # variance of the Laplacian (0-255 grayscale) below which an image is blurry
+    max_ground_fraction: float = 0.9  # share of rows that look like the bottom of the image (the ground) above which the camera points down
+    ground_color_tolerance: float = 0.06  # max distance (0-1) between the mean color of a row and the one of the ground to count as ground
+    ground_texture_tolerance: float = 0.5  # max relative difference between the texture of a row and the one of the ground to count as ground
+    min_brightness: float = 25.0  # mean gray level (0-255) below which an image is too dark
+    max_brightness: float = 235.0  # mean gray level (0-255) above which an image is overexposed
+    min_contrast: float = 12.0  # standard deviation of the gray levels below which an image is flat (fog, lens cap, motion blur)
+    max_clipped_fraction: float = 0.6  # share of pixels at pure black or pure white above which an image is unusable
+
+
+def image_stats(img_bytes : bytes, config : PrefilterConfig = None) -> dict:
+    """
+    Computes the statistics used by the pre-filter on a downscaled copy of the image (config.max_edge, default config if None).
+
+    Returns:
+        dict with 'sharpness' (Laplacian variance), 'ground_fraction' (share of rows that look like the ground),
+        'brightness' and 'contrast' (mean and standard deviation of the gray levels), 'clipped_fraction'
+    """
+    config = config or PrefilterConfig()
+    max_edge = config.max_edge
+    img = Image.open(io.BytesIO(img_bytes))
+    img.draft("RGB", (max_edge, max_edge))  # let the JPEG decoder downscale
+    img = ImageOps.exif_transpose(img).convert("RGB")  # rows must go from the top to the bottom of the scene
+    img.thumbnail((max_edge, max_edge), Image.Resampling.BILINEAR)
+    rgb = np.asarray(img, dtype=np.float32)
+    gray = rgb @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+    # blur: a sharp image has strong second derivatives, i.e. a high variance of its Laplacian
+    laplacian = gray[:-2, 1:-1] + gray[2:, 1:-1] + gray[1:-1, :-2] + gray[1:-1, 2:] - 4 * gray[1:-1, 1:-1]
+
+    # ground dominance: compare every row with the bottom fifth of the image, both in color and in texture.
+    # When the camera points down the whole frame is road / pavement, so almost every row looks like the bottom one.
+    row_color = rgb.mean(axis=1) / 255  # (H, 3)
+    row_texture = np.abs(np.diff(gray, axis=1)).mean(axis=1)  # (H,) mean horizontal gradient
+    bottom = max(1, len(gray) // 5)
+    ground_color = row_color[-bottom:].mean(axis=0)
+    ground_texture = row_texture[-bottom:].mean()
+    color_close = np.linalg.norm(row_color - ground_color, axis=1) / np.sqrt(3) < config.ground_color_tolerance
+    texture_close = np.abs(row_texture - ground_texture) <= config.ground_texture_tolerance * max(ground_texture, 1.0)
+
+    return {
+        "sharpness": float(laplacian.var()),
+        "ground_fraction": float(np.mean(color_close & texture_close)),
+        "brightness": float(gray.mean()),
+        "contrast": float(gray.std()),
+        "clipped_fraction": float(np.mean((gray <= 2) | (gray >= 253))),
+    }
+
+
+def prefilter_image(img_bytes : bytes, config : PrefilterConfig) -> Optional[str]:
+    """
+    Returns the reason why the image is a confident reject, or None if it must be evaluated by the model.
+    """
+    stats = image_stats(img_bytes, config)
+    if stats["clipped_fraction"] > config.max_clipped_fraction:
+        return f"{stats['clipped_fraction']:.0%} of the pixels are pure black or white"
+    if stats["brightness"] < config.min_brightness:
+        return f"the image is too dark (mean gray level {stats['brightness']:.0f})"
+    if stats["brightness"] > config.max_brightness:
+        return f"the image is overexposed (mean gray level {stats['brightness']:.0f})"
+    if stats["contrast"] < config.min_contrast:
+        return f"the image has almost no contrast (gray level deviation {stats['contrast']:.1f})"
+    if stats["sharpness"] < config.min_sharpness:
+        return f"the image is blurry (Laplacian variance {stats['sharpness']:.1f})"
+    if stats["ground_fraction"] > config.max_ground_fraction:
+        return f"the camera is tilted toward the ground ({stats['ground_fraction']:.0%} of the frame looks like the street)"
+    return None
+
+
+async def prefilter_images(refs : list[dict], config : PrefilterConfig, store) -> list[Optional[str]]:
+    """
+    Runs prefilter_image on images of an image store (see image_store.py) in the worker pool, without blocking the event loop.
+    Images that cannot be decoded are left to the model (None).
+    """
+    def run(img_bytes : bytes) -> Optional[str]:
+        try:
+            return prefilter_image(img_bytes, config)
+        except Exception as e:
+            print(f"Pre-filter skipped, cannot read image: {e}")
+            return None
+
+    loop = asyncio.get_running_loop()
+    return list(await asyncio.gather(*(loop.run_in_executor(_pool, run, store.get(ref)) for ref in refs)))
@@ -0,0 +1,60 @@
+import asyncio
+import io
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+from PIL import Image, ImageOps
+from pydantic import BaseModel
+
+# Image normalization stage: resizes and re-encodes images before they are sent to the vision model.
+# Payload size and image token cost scale with resolution, so this is the knob to trade cost for accuracy.
+
+# PIL releases the GIL while decoding, resizing and encoding, so threads are enough to keep the event loop free
+_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="preprocess")
+
+
+class ImageConfig(BaseModel):
+    """Preprocessing applied to every image before the model call"""
+    max_edge: Optional[int] = 1024  # longest side in pixels, None keeps the original size
+    jpeg_quality: int = 85
+    grayscale: bool = False
+
+
+def normalize_image(img_bytes : bytes, config : ImageConfig) -> bytes:
+    """
+    Resizes (keeping the aspect ratio) and re-encodes an image as JPEG, following config.
+    Images that are already JPEG, small enough and in the right color mode are returned untouched,
+    to avoid a lossy re-encoding for nothing.
+    """
+    img = Image.open(io.BytesIO(img_bytes))
+    needs_resize = config.max_edge is not None and max(img.size) > config.max_edge
+    target_mode = "L" if config.grayscale else "RGB"
+    if img.format == "JPEG" and not needs_resize and img.mode == target_mode:
+        return img_bytes
+
+    img = ImageOps.exif_transpose(img)  # the orientation tag would be lost when re-encoding
+    img = img.convert(target_mode)
+    if needs_resize:
+        img.thumbnail((config.max_edge, config.max_edge), Image.Resampling.LANCZOS)
+
+    out = io.BytesIO()
+    img.save(out, format="JPEG", quality=config.jpeg_quality, optimize=True)
+    return out.getvalue()
+
+
+async def normalize_images(refs : list[dict], config : Optional[ImageConfig], store) -> list[dict]:
+    """
+    Normalizes the images of an image store (see image_store.py) in the worker pool, without blocking the event loop.
+
+    Args:
+        refs: Handles of the images in store
+        config: Preprocessing to apply, if None the images are returned as they are
+        store: The image store holding the bytes, e.g. image_store.IMAGE_STORE
+
+    Returns:
+        Handles of the normalized images. They are new references owned by the caller, who must release them.
+    """
+    if config is None:
+        return [store.retain(ref) for ref in refs]
+    loop = asyncio.get_running_loop()
+    normalized = await asyncio.gather(*(loop.run_in_executor(_pool, normalize_image, store.get(ref), config) for ref in refs))
+    return [store.put(img_bytes, ref["id"]) for ref, img_bytes in zip(refs, normalized)]
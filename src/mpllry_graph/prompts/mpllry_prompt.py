@@ -26,9 +26,10 @@ Discard the image if any of the following conditions are met:
 
 The image can be tilted, that is not a problem.
 
-Your answers MUST be composed of two parths: 
+Your answers MUST be composed of three parts: 
 * a 'response' that you will fill with 'yes' if you accept the image, or fill with 'no' if you discard it;
-* an 'reason' that you will fill with the reason explaining why you accepted or discarded an image. 
+* an 'reason' that you will fill with the reason explaining why you accepted or discarded an image;
+* a 'confidence' between 0 and 1 telling how sure you are: use low values when the image is borderline or hard to judge. 
 
 ## Examples 
 
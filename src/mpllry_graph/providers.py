@@ -0,0 +1,218 @@
+from dotenv import load_dotenv
+from pydantic import SecretStr
+from functools import cache
+from typing import Any, Callable, Optional
+import os
+import time
+
+# Chat model providers, and the cascade of provider pools used to route the Mapillary verdicts (see make_graph.py).
+# NOTE: provider SDKs are imported inside the factories, so that only the providers actually used are loaded
+# (langchain_openai and langchain_anthropic take about a second each to import)
+
+def _qwen(key : str):
+    from langchain_openai import ChatOpenAI
+    return ChatOpenAI(
+        api_key=SecretStr(key),
+        base_url="https://api.fireworks.ai/inference/v1",
+        model="accounts/fireworks/models/qwen2p5-vl-32b-instruct"
+    )
+
+def _openai_mini(key : str):
+    from langchain_openai import ChatOpenAI
+    return ChatOpenAI(model="gpt-4o-mini", api_key=SecretStr(key))
+
+def _openai(key : str):
+    from langchain_openai import ChatOpenAI
+    return ChatOpenAI(model="gpt-4o", api_key=SecretStr(key))
+
+def _anthropic(key : str):
+    from langchain_anthropic import ChatAnthropic
+    return ChatAnthropic(model="claude-sonnet-4-5", api_key=SecretStr(key))
+
+# model factories by provider name: (env var with the api key(s), factory taking the key)
+# NOTE: the env var may hold several comma-separated keys, see `build_cascade`
+MODEL_FACTORIES = {
+    "QWEN": ("FIREWORKS_API_KEY", _qwen),
+    "OPENAI_MINI": ("OPENAI_API_KEY", _openai_mini),
+    "OPENAI": ("OPENAI_API_KEY", _openai),
+    "ANTHROPIC": ("ANTHROPIC_API_KEY", _anthropic),
+}
+
+
+@cache
+def load_env() -> None:
+    """Loads the .env file, once per process"""
+    load_dotenv()
+
+
+def api_keys(provider : str) -> list[str]:
+    """The api key(s) of a provider, from its env var (comma-separated). Raises if there is none"""
+    if provider not in MODEL_FACTORIES:
+        raise RuntimeError(f"Invalid provider: {provider}")
+    env_var, _ = MODEL_FACTORIES[provider]
+    keys = [key.strip() for key in os.getenv(env_var, "").split(",") if key.strip()]
+    if not keys:
+        raise EnvironmentError(f"no {env_var} in environment for {provider}!")
+    return keys
+
+
+# exception classes (anywhere in the MRO) of the SDKs that tell a provider is unhealthy, for the errors without a status code
+PROVIDER_ERRORS = {"TransportError", "TimeoutException", "APIConnectionError", "APITimeoutError", "RateLimitError", "InternalServerError"}
+
+
+def is_provider_error(error : Exception) -> bool:
+    """
+    Whether an error is about the provider (transport, timeout, rate limit, 5xx), and should put it on cooldown,
+    rather than about the answer (invalid structured output, bad request), which says nothing about its health
+    """
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    if isinstance(status, int):
+        return status in (408, 409, 429) or status >= 500
+    return any(cls.__name__ in PROVIDER_ERRORS for cls in type(error).__mro__)
+
+
+class PoolMember:
+    """A model (one provider, one api key) of a ProviderPool, with its health"""
+
+    def __init__(self, name : str, runnable):
+        self.name = name
+        self.runnable = runnable
+        self.in_flight = 0
+        self.calls = 0
+        self.errors = 0
+        self.rejected = 0  # answers that raised without a provider error, e.g. invalid structured output
+        self.consecutive_errors = 0
+        self.cooldown_until = 0.0  # time.monotonic() before which the member is not picked
+        self.latency = None  # moving average, seconds
+
+
+class ProviderPool:
+    """
+    Models of the same quality tier from different providers or api keys.
+    Every call goes to the healthy member with the fewest calls in flight (ties: the fastest),
+    so the pool sustains more than the rate limit of any single provider.
+    A member failing with a provider error (see is_provider_error) is put on cooldown, doubling with each consecutive failure.
+    """
+
+    def __init__(self, members : list[PoolMember], base_cooldown : float = 2.0, max_cooldown : float = 120.0):
+        if not members:
+            raise ValueError("A provider pool needs at least one member")
+        self.members = members
+        self.base_cooldown = base_cooldown
+        self.max_cooldown = max_cooldown
+
+    def pick(self, exclude : tuple = ()) -> Optional[PoolMember]:
+        """Returns the member to call next, or None if all of them are excluded"""
+        candidates = [m for m in self.members if m not in exclude]
+        if not candidates:
+            return None
+        now = time.monotonic()
+        healthy = [m for m in candidates if m.cooldown_until <= now]
+        if not healthy:  # everybody is cooling down: try the one that recovers first
+            return min(candidates, key=lambda m: m.cooldown_until)
+        return min(healthy, key=lambda m: (m.in_flight, m.latency or 0.0))
+
+    def report(self, member : PoolMember, latency : float, error : Exception = None, rejected : bool = False) -> None:
+        """Outcome of a call: error is a provider error, rejected an invalid answer of a healthy member"""
+        member.calls += 1
+        member.rejected += rejected
+        if error is None:
+            member.consecutive_errors = 0
+            member.cooldown_until = 0.0
+            member.latency = latency if member.latency is None else 0.8 * member.latency + 0.2 * latency
+        else:
+            member.errors += 1
+            member.consecutive_errors += 1
+            cooldown = min(self.base_cooldown * 2 ** (member.consecutive_errors - 1), self.max_cooldown)
+            member.cooldown_until = time.monotonic() + cooldown
+
+    def stats(self) -> dict:
+        """Calls, errors and average latency of each member"""
+        return {m.name: {"calls": m.calls, "errors": m.errors, "rejected": m.rejected, "latency": m.latency} for m in self.members}
+
+
+class ModelCascade:
+    """
+    Routes each request through tiers of provider pools, from the cheapest to the strongest model.
+    A tier's answer is returned if `accept(result)` is True, otherwise (low confidence, invalid output)
+    the request escalates to the next tier. A member that raises a provider error (transport, rate limit, 5xx) is
+    put on cooldown and another member of the same tier is tried; any other exception (e.g. the structured output
+    failed validation) is a rejected answer, and escalates like one. The last tier's valid answer is always returned.
+    """
+
+    def __init__(self, tiers : list[ProviderPool], accept : Callable[[Any], bool]):
+        if not tiers:
+            raise ValueError("A cascade needs at least one tier")
+        self.tiers = tiers
+        self.accept = accept
+        self.escalations = 0  # requests answered by a tier after the first one
+
+    async def ainvoke(self, input : Any, config : dict = None) -> Any:
+        fallback = None  # rejected answer of a lower tier, returned if every stronger model fails
+        error = None
+        escalated = False  # the previous tier rejected the answer (not: all its members failed)
+        for level, pool in enumerate(self.tiers):
+            if escalated:
+                self.escalations += 1
+            escalated = False
+            tried = []
+            while (member := pool.pick(exclude=tuple(tried))) is not None:
+                tried.append(member)
+                member.in_flight += 1
+                start = time.perf_counter()
+                try:
+                    result = await member.runnable.ainvoke(input, config=config)
+                except Exception as e:
+                    error = e
+                    if is_provider_error(e):
+                        pool.report(member, time.perf_counter() - start, error=e)
+                        continue  # another member of the tier
+                    pool.report(member, time.perf_counter() - start, rejected=True)
+                    escalated = True
+                    break  # invalid answer: escalate
+                finally:
+                    member.in_flight -= 1
+                pool.report(member, time.perf_counter() - start)
+
+                if level == len(self.tiers) - 1 or self.accept(result):
+                    return result
+                fallback = result
+                escalated = True
+                break  # escalate
+        if fallback is not None:
+            return fallback
+        raise error
+
+    def stats(self) -> list[dict]:
+        return [pool.stats() for pool in self.tiers]
+
+
+def build_cascade(spec : str, build : Callable[[Any], Any], accept : Callable[[Any], bool]) -> ModelCascade:
+    """
+    Builds a ModelCascade from a spec string: tiers from the cheapest to the strongest separated by ',',
+    providers of the same tier separated by '|', e.g. "QWEN,OPENAI" or "QWEN|OPENAI_MINI,OPENAI|ANTHROPIC".
+    Each provider contributes one pool member per api key in its env var (comma-separated keys, e.g. OPENAI_API_KEY="sk-1,sk-2").
+
+    Args:
+        spec: The cascade spec, provider names from MODEL_FACTORIES
+        build: Wraps each chat model in the runnable to call, e.g. lambda model: create_agent(model=model, ...)
+        accept: Tells whether the result of a tier is good enough, e.g. a valid structured output with high confidence
+    """
+    load_env()
+
+    tiers = []
+    for tier_spec in spec.split(","):
+        members = []
+        for provider in tier_spec.split("|"):
+            provider = provider.strip()
+            if provider not in MODEL_FACTORIES:
+                raise RuntimeError(f"Invalid provider: {provider}")
+            _, factory = MODEL_FACTORIES[provider]
+            keys = api_keys(provider)
+            for i, key in enumerate(keys):
+                name = provider if len(keys) == 1 else f"{provider}#{i + 1}"
+                members.append(PoolMember(name, build(factory(key))))
+        tiers.append(ProviderPool(members))
+    return ModelCascade(tiers, accept)
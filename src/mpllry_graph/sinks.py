@@ -0,0 +1,139 @@
+import json
+import time
+from pathlib import Path
+
+# Results sinks: every verdict is appended as soon as it completes, in small batches,
+# so memory stays flat and writes stay incremental however many images a run processes.
+
+
+class JsonlSink:
+    """
+    Appends records to a JSON Lines file (one record per line, easy to `tail -f`).
+    Records are buffered and flushed every `flush_every` records or `flush_interval` seconds, whichever comes first.
+    """
+
+    def __init__(self, path : str, flush_every : int = 20, flush_interval : float = 2.0):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self._file = open(self.path, "a", encoding="utf-8")
+        self._buffer = []
+        self._last_flush = time.monotonic()
+
+    def write(self, record : dict) -> None:
+        self._buffer.append(json.dumps(record, ensure_ascii=False, default=str))
+        if len(self._buffer) >= self.flush_every or time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self) -> None:
+        if self._buffer:
+            self._file.write("\n".join(self._buffer) + "\n")
+            self._file.flush()
+            self._buffer = []
+        self._last_flush = time.monotonic()
+
+    def close(self) -> None:
+        self.flush()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ParquetSink:
+    """
+    Writes records to rolling Parquet files (`<prefix>-00000.parquet`, `<prefix>-00001.parquet`, ...) in directory, for analysis.
+    Buffered records are written as one row group every `flush_every` records,
+    and a new file is started every `rows_per_file` rows, so each file is complete and readable as soon as it is rolled.
+    All records must have the same keys. Pass their python types in `fields` (e.g. {"image_id": str, "latency": float}):
+    otherwise the schema is inferred from the first row group, which fails if a column is all None there.
+    """
+
+    def __init__(self, directory : str, prefix : str = "results", flush_every : int = 500, rows_per_file : int = 50_000, fields : dict = None):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise ImportError("ParquetSink requires pyarrow: pip install pyarrow") from e
+        self._pa, self._pq = pa, pq
+
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.prefix = prefix
+        self.flush_every = flush_every
+        self.rows_per_file = rows_per_file
+        self._buffer = []
+        self._writer = None
+        self._schema = None
+        if fields is not None:
+            arrow_types = {str: pa.string(), float: pa.float64(), int: pa.int64(), bool: pa.bool_()}
+            self._schema = pa.schema([(name, arrow_types[py_type]) for name, py_type in fields.items()])
+        self._rows_in_file = 0
+        self._file_index = len(list(self.directory.glob(f"{prefix}-*.parquet")))  # never overwrite previous runs
+
+    def write(self, record : dict) -> None:
+        self._buffer.append(record)
+        if len(self._buffer) >= self.flush_every:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self._buffer:
+            return
+        table = self._pa.Table.from_pylist(self._buffer, schema=self._schema)
+        if self._schema is None:
+            self._schema = table.schema
+        if self._writer is None:
+            path = self.directory / f"{self.prefix}-{self._file_index:05d}.parquet"
+            self._writer = self._pq.ParquetWriter(path, self._schema)
+        self._writer.write_table(table)
+        self._buffer = []
+        self._rows_in_file += table.num_rows
+        if self._rows_in_file >= self.rows_per_file:
+            self._roll()
+
+    def _roll(self) -> None:
+        """Closes the current file (writing its footer) and starts a new one at the next flush"""
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+            self._file_index += 1
+            self._rows_in_file = 0
+
+    def close(self) -> None:
+        self.flush()
+        self._roll()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class MultiSink:
+    """Fans out every record to several sinks"""
+
+    def __init__(self, sinks : list):
+        self.sinks = sinks
+
+    def write(self, record : dict) -> None:
+        for sink in self.sinks:
+            sink.write(record)
+
+    def flush(self) -> None:
+        for sink in self.sinks:
+            sink.flush()
+
+    def close(self) -> None:
+        for sink in self.sinks:
+            sink.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
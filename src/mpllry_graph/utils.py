@@ -1,40 +1,26 @@
 from langchain_core.messages import HumanMessage
 from state import MultiState
+from image_store import IMAGE_STORE, ImageRef, detect_image_format
 from prompts.mpllry_prompt import prompt
+from image_cache import ImageCache, mpllry_key, default_cache_dir
 import base64
+import hashlib
+import json
 import requests
+from requests.adapters import HTTPAdapter
 import random
 import os
 import math
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from pathlib import Path 
 
-def detect_image_format(image_bytes: bytes) -> tuple[str, str]:
-    """
-    Detect image format from bytes using magic bytes (file signatures).
-    
-    Args:
-        image_bytes: Raw image bytes
-        
-    Returns:
-        Tuple of (mime_type, extension) e.g., ('image/jpeg', 'jpg')
-    """
-    # Check magic bytes (most reliable method)
-    if image_bytes.startswith(b'\xff\xd8\xff'):
-        print("Detected image format: JPEG")
-        return 'image/jpeg', 'jpg'
-    elif image_bytes.startswith(b'\x89PNG\r\n\x1a\n'):
-        print("Detected image format: PNG")
-        return 'image/png', 'png'
-    elif image_bytes.startswith(b'GIF87a') or image_bytes.startswith(b'GIF89a'):
-        print("Detected image format: GIF")
-        return 'image/gif', 'gif'
-    elif image_bytes.startswith(b'RIFF') and b'WEBP' in image_bytes[:12]:
-        print("Detected image format: WebP")
-        return 'image/webp', 'webp'
-    else:
-        # Fallback: assume JPEG (most common for Mapillary)
-        print("Could not detect image format, defaulting to JPEG")
-        return 'image/jpeg', 'jpg'
+MAPILLARY_GRAPH_URL = os.getenv("MAPILLARY_GRAPH_URL", "https://graph.mapillary.com")  # overridable, e.g. to point the benchmarks to a local stub
+MAPILLARY_IMAGES_URL = f"{MAPILLARY_GRAPH_URL}/images"
+MAPILLARY_FIELDS = "id,sequence,thumb_1024_url,camera_type,computed_geometry,thumb_original_url"
+BOLOGNA_BBOX = [44.4789, 44.5141, 11.3205, 11.3691]  # [lat_min, lat_max, lon_min, lon_max]
+
+_few_shot_memo = {}  # few-shot key -> system message, see get_multimodal_prompt
 
 def encode_b64_from_path(file_path):
     with open(file_path, "rb") as f:
@@ -43,9 +29,11 @@ def encode_b64_from_path(file_path):
 def encode_b64_paths(file_paths: list[str]) -> list[str]:
     return [encode_b64_from_path(file_path) for file_path in file_paths]
 
-def prepare_multimodal_message(state: MultiState) -> HumanMessage:
+def prepare_multimodal_message(state: MultiState, images: list[ImageRef] = None) -> HumanMessage:
     """
-    Helper to create multimodal message from state
+    Helper to create multimodal message from state.
+    If images (handles in IMAGE_STORE) are given, they are used instead of the ones in the state.
+    Images are encoded to base64 here, only for the provider request.
 
     Returns:
         message (HumanMessage): The multimodal message
@@ -60,12 +48,13 @@ def prepare_multimodal_message(state: MultiState) -> HumanMessage:
     
     content_blocks = [{"type": "text", "text": text}]   # it is a list of typed dicts, see https://docs.langchain.com/oss/python/langchain/messages#multimodal
     
-    # Add images
-    for img_b64 in state.get("images", []):
+    # Add images (already normalized ones if given, see preprocess.py)
+    for ref in (images if images is not None else state.get("images", [])):
+        mime_type, _ = detect_image_format(IMAGE_STORE.get(ref))
         content_blocks.append({
             "type": "image",
-            "base64": img_b64,
-            "mime_type": "image/jpeg"  # NOTE: mpllry images are jpg
+            "base64": IMAGE_STORE.b64(ref),
+            "mime_type": mime_type
         })
 
 
@@ -74,11 +63,17 @@ def prepare_multimodal_message(state: MultiState) -> HumanMessage:
     
     return message   # NOTE: returns msg as is, then you need to wrap it in a list!
 
-def get_multimodal_prompt(good_imgs_paths : list[str], bad_imgs_paths : list[str], text : str = prompt):
-    """
-    Constructs a multimodal system message, given the textual prompt and images to refer to. 
-    The textual prompt defaults to our own custom system prompt.
-    """
+def _few_shot_key(good_imgs_paths : list[str], bad_imgs_paths : list[str], text : str) -> str:
+    """Hash of the prompt text and of the content (and role) of every example image, in order"""
+    h = hashlib.sha256(text.encode("utf-8"))
+    for label, paths in (("good", good_imgs_paths), ("bad", bad_imgs_paths)):
+        for path in paths:
+            h.update(label.encode("utf-8"))
+            h.update(hashlib.sha256(Path(path).read_bytes()).digest())
+    return h.hexdigest()
+
+
+def _build_few_shot_content(good_imgs_paths : list[str], bad_imgs_paths : list[str], text : str) -> list[dict]:
     content = [{"type": "text", "text": text}]  # start with the prompt
     
     # encode both good and bad images
@@ -96,16 +91,310 @@ def get_multimodal_prompt(good_imgs_paths : list[str], bad_imgs_paths : list[str
         content.append({"type" : "text", "text" : bad_text})
         content.append({"type" : "image", "base64" : bad_img, "mime_type" : "image/png"})
 
+    # mark the end of the fixed few-shot prefix as cacheable: Anthropic needs an explicit cache_control breakpoint,
+    # OpenAI caches identical prefixes automatically (and ignores the marker)
+    content[-1]["extras"] = {"cache_control": {"type": "ephemeral"}}
+    return content
+
+
+def get_multimodal_prompt(good_imgs_paths : list[str], bad_imgs_paths : list[str], text : str = prompt, cache_dir : str = None):
+    """
+    Constructs a multimodal system message, given the textual prompt and images to refer to. 
+    The textual prompt defaults to our own custom system prompt.
+
+    The message is built once and memoized (in memory and on disk in cache_dir), keyed by the hash of the 
+    example files plus the prompt text: changing any of them rebuilds it.
+    NOTE: pass the paths in a stable order (e.g. sorted), otherwise the provider-side prompt cache is missed.
+    """
+    cache_dir = cache_dir or str(Path(default_cache_dir()).parent / "prompts")  # next to the image cache
+    key = _few_shot_key(good_imgs_paths, bad_imgs_paths, text)
+    if key in _few_shot_memo:
+        return _few_shot_memo[key]
+
+    cache_file = Path(cache_dir) / f"few_shot_{key}.json"
+    if cache_file.exists():
+        content = json.loads(cache_file.read_text())
+    else:
+        content = _build_few_shot_content(good_imgs_paths, bad_imgs_paths, text)
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = cache_file.with_suffix(f".tmp{os.getpid()}")
+        tmp_file.write_text(json.dumps(content))
+        os.replace(tmp_file, cache_file)  # atomic, concurrent runs never read a partial file
+
     system_prompt = HumanMessage(content_blocks=content)
+    _few_shot_memo[key] = system_prompt
     return system_prompt
 
 
-def get_mpllry_b64(num_points : int, bbox : list[float] = None, delta = 0.005, max_retries = 10, offset_radius_meters = 50, save_images : bool = False, save_folder : str = None) -> list:
+def get_mpllry_session(max_workers : int = 8) -> requests.Session:
+    """
+    Creates a keep-alive session whose connection pool is large enough for `max_workers` threads.
+    Reusing it across calls avoids paying a TCP + TLS handshake for every request.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max_workers)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def _sample_points(num_points : int, lat_min : float, lat_max : float, lon_min : float, lon_max : float):
+    """Yields num_points random (lat, lon) points, uniformly distributed in the bounding box."""
+    for _ in range(num_points):
+        yield random.uniform(lat_min, lat_max), random.uniform(lon_min, lon_max)
+
+
+def _find_metadata(session : requests.Session, base_lat : float, base_lon : float, bounds : tuple, access_token : str, delta : float, max_retries : int, offset_radius_meters : float, url : str = MAPILLARY_IMAGES_URL):
+    """
+    Looks for the metadata of a Mapillary image close to (base_lat, base_lon), 
+    retrying with a random offset (within offset_radius_meters) if nothing is found.
+
+    Returns:
+        The metadata dict of the first image found, or None
+    """
+    lat_min, lat_max, lon_min, lon_max = bounds
+
+    # Approximate conversion for offset calculations
+    avg_lat = (lat_min + lat_max) / 2
+    meters_per_deg_lat = 111000  # meters per degree latitude
+    meters_per_deg_lon = 111000 * math.cos(math.radians(avg_lat))  # longitude depends on latitude
+
+    base_params = {
+        "access_token": access_token,
+        "fields": MAPILLARY_FIELDS,
+        "limit": 1
+    }
+
+    for attempt in range(max_retries):
+        # Calculate coordinates (with offset for retries)
+        if attempt > 0:
+            # Random offset within radius
+            angle = random.uniform(0, 2 * math.pi)
+            distance = offset_radius_meters * math.sqrt(random.uniform(0, 1))
+            
+            offset_lat = (distance / meters_per_deg_lat) * math.cos(angle)
+            offset_lon = (distance / meters_per_deg_lon) * math.sin(angle)
+            
+            # Ensure we stay within bounds
+            lat = max(lat_min, min(lat_max, base_lat + offset_lat))
+            lon = max(lon_min, min(lon_max, base_lon + offset_lon))
+        else:
+            lat, lon = base_lat, base_lon
+        
+        # Construct bbox for Mapillary query
+        bbox_str = f"{lon-delta},{lat-delta},{lon+delta},{lat+delta}"
+        point_params = {**base_params, "bbox": bbox_str}
+        
+        try:
+            r = session.get(url, params=point_params, timeout=15)
+            
+            if r.status_code == 200:
+                data = r.json().get("data", [])
+                if data:
+                    return data[0]  # Found metadata, stop retrying
+                # No data found, continue to next attempt with offset
+            # Status not 200, continue to next attempt
+        
+        except requests.exceptions.RequestException:
+            # Timeout or other request error, try with offset
+            continue
+
+    return None
+
+
+def _download_image(session : requests.Session, image_url : str):
+    """
+    Downloads a single image (no retry).
+
+    Returns:
+        The raw image bytes, or None if the download failed
+    """
+    try:
+        img_response = session.get(image_url, timeout=20)
+        if img_response.status_code == 200:
+            return img_response.content
+        # If status not 200, just give up on this point (no retry)
+    except requests.exceptions.Timeout as e:
+        print(f"Timeout downloading image from {image_url}: {e}")
+    except requests.exceptions.RequestException as e:
+        print(f"Error downloading image from {image_url}: {e}")
+    return None
+
+
+def _fetch_point(session : requests.Session, base_lat : float, base_lon : float, bounds : tuple, access_token : str, delta : float, max_retries : int, offset_radius_meters : float, cache : ImageCache = None):
+    """
+    Worker: metadata lookup + thumbnail download for a single sampled point.
+
+    Returns:
+        Tuple (metadata, image_bytes), or None if the point has no (downloadable) image
+    """
+    img_metadata = _find_metadata(session, base_lat, base_lon, bounds, access_token, delta, max_retries, offset_radius_meters)
+    if not img_metadata:
+        return None
+    
+    return _fetch_known_image(session, img_metadata, access_token, cache)
+
+
+def _refresh_thumb_url(session : requests.Session, image_id : str, access_token : str):
+    """Asks Mapillary for a fresh thumbnail url of a known image (the signed urls expire after a while)"""
+    try:
+        r = session.get(f"{MAPILLARY_GRAPH_URL}/{image_id}", params={"access_token": access_token, "fields": "thumb_1024_url"}, timeout=15)
+        if r.status_code == 200:
+            return r.json().get("thumb_1024_url")
+    except requests.exceptions.RequestException:
+        pass
+    return None
+
+
+def _fetch_known_image(session : requests.Session, img_metadata : dict, access_token : str = None, cache : ImageCache = None):
+    """
+    Worker: thumbnail download for an image whose metadata is already known (e.g. read from the local index).
+    The cache (if any) is checked first, by image id. 
+    If the stored url is stale and an access token is available, the url is refreshed once.
+
+    Returns:
+        Tuple (metadata, image_bytes), or None if the image could not be downloaded
+    """
+    if cache is not None and img_metadata.get('id'):
+        img_content = cache.get(mpllry_key(img_metadata['id']))
+        if img_content is not None:
+            return img_metadata, img_content
+
+    image_url = img_metadata.get('thumb_1024_url')
+    img_content = _download_image(session, image_url) if image_url else None
+
+    if img_content is None and access_token and img_metadata.get('id'):
+        image_url = _refresh_thumb_url(session, img_metadata['id'], access_token)
+        if image_url:
+            img_metadata = {**img_metadata, 'thumb_1024_url': image_url}
+            img_content = _download_image(session, image_url)
+
+    if img_content is None:
+        return None
+
+    if cache is not None and img_metadata.get('id'):
+        cache.put(mpllry_key(img_metadata['id']), img_content)
+    
+    return img_metadata, img_content
+
+
+def _resolve_bounds(bbox : list[float] = None) -> tuple:
+    """Returns (lat_min, lat_max, lon_min, lon_max), defaulting to a bbox centered on Bologna"""
+    if bbox is None:
+        return tuple(BOLOGNA_BBOX)
+    lat_min, lat_max, lon_min, lon_max = bbox
+    return lat_min, lat_max, lon_min, lon_max
+
+
+def _get_access_token(required : bool = True) -> str:
+    access_token = os.getenv('MAPILLARY_TOKEN')
+    if not access_token and required:
+        raise ValueError("MAPILLARY_TOKEN environment variable not set")
+    return access_token
+
+
+def _fetch_tasks(num_points : int, bbox, delta, max_retries, offset_radius_meters, session, metadata, cache):
+    """
+    Yields the (worker, args) pairs to run in the pool: 
+    one lookup + download per sampled point, or just one download per image if metadata is already known.
+    """
+    if metadata is not None:
+        access_token = _get_access_token(required=False)  # only used to refresh stale urls
+        for img_metadata in metadata:
+            yield _fetch_known_image, (session, img_metadata, access_token, cache)
+        return
+
+    bounds = _resolve_bounds(bbox)
+    access_token = _get_access_token()
+    for base_lat, base_lon in _sample_points(num_points, *bounds):
+        yield _fetch_point, (session, base_lat, base_lon, bounds, access_token, delta, max_retries, offset_radius_meters, cache)
+
+
+def iter_mpllry_images(num_points : int, bbox : list[float] = None, delta = 0.005, max_retries = 10, offset_radius_meters = 50, max_workers : int = 8, session : requests.Session = None, metadata : list[dict] = None, cache : ImageCache = None):
+    """
+    Streaming variant of `get_mpllry_b64`: samples num_points and yields images as soon as they are downloaded.
+
+    Points are processed concurrently by a pool of max_workers threads sharing one keep-alive session, 
+    so metadata lookups and downloads of different points overlap. 
+    At most 2 * max_workers points are in flight at once, so memory does not grow with num_points.
+    NOTE: results are yielded in completion order, not in sampling order.
+
+    Args:
+        num_points: Number of points to sample
+        bbox: Bounding box as [lat_min, lat_max, lon_min, lon_max]. Defaults to Bologna area.
+        delta: Search radius in degrees for initial bbox (roughly 500m for 0.005)
+        max_retries: Maximum retry attempts per point with random offset if metadata not found
+        offset_radius_meters: Radius in meters for random offset retries
+        max_workers: Maximum number of points processed concurrently
+        session: Optional requests session to reuse (one is created if not provided)
+        metadata: Optional image metadata already known (e.g. from `mpllry_index.sample_from_index`). 
+            If given, no points are sampled and no metadata calls are made: only the thumbnails are downloaded.
+        cache: Optional image cache, checked (by image id) before downloading any thumbnail
+
+    Yields:
+        Tuples (metadata, image_bytes) 
+    """
+    session = session if session is not None else get_mpllry_session(max_workers)
+
+    pool = ThreadPoolExecutor(max_workers=max_workers)
+    in_flight = set()
+    try:
+        for worker, args in _fetch_tasks(num_points, bbox, delta, max_retries, offset_radius_meters, session, metadata, cache):
+            if len(in_flight) >= 2 * max_workers:   # bounded window, wait for a slot
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future.result() is not None:
+                        yield future.result()
+            in_flight.add(pool.submit(worker, *args))
+        
+        # drain the remaining points
+        while in_flight:
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.result() is not None:
+                    yield future.result()
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+async def aiter_mpllry_images(num_points : int, bbox : list[float] = None, delta = 0.005, max_retries = 10, offset_radius_meters = 50, max_workers : int = 8, session : requests.Session = None, metadata : list[dict] = None, cache : ImageCache = None):
+    """
+    Async-iterator variant of `iter_mpllry_images`, to be consumed with `async for` without blocking the event loop.
+    Same arguments, same (metadata, image_bytes) tuples, yielded in completion order.
+    """
+    session = session if session is not None else get_mpllry_session(max_workers)
+
+    loop = asyncio.get_running_loop()
+    pool = ThreadPoolExecutor(max_workers=max_workers)
+    in_flight = set()
+    try:
+        for worker, args in _fetch_tasks(num_points, bbox, delta, max_retries, offset_radius_meters, session, metadata, cache):
+            if len(in_flight) >= 2 * max_workers:   # bounded window, wait for a slot
+                done, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    if future.result() is not None:
+                        yield future.result()
+            in_flight.add(loop.run_in_executor(pool, worker, *args))
+        
+        # drain the remaining points
+        while in_flight:
+            done, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                if future.result() is not None:
+                    yield future.result()
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def get_mpllry_b64(num_points : int, bbox : list[float] = None, delta = 0.005, max_retries = 10, offset_radius_meters = 50, save_images : bool = False, save_folder : str = None, max_workers : int = 8, metadata : list[dict] = None, cache : ImageCache = None) -> list:
     """
     Leverages the Mapillary API to download images by sampling num_points.
     NOTE: images <= num_points since some points won't have images associated. 
     
     Encodes the images in base 64, and returns a list of the encodings.
+    Points are fetched concurrently (see `iter_mpllry_images`), so the order of the list is not the sampling order.
+    NOTE: all the encodings are held in memory at once. For large batches stream raw bytes with `iter_mpllry_images`
+    (or `aiter_mpllry_images`) instead, as main.py does: the batch driver keeps only the images in flight.
 
     Args:
         num_points: Number of images to retrieve
@@ -115,128 +404,41 @@ def get_mpllry_b64(num_points : int, bbox : list[float] = None, delta = 0.005, m
         offset_radius_meters: Radius in meters for random offset retries (~25m default)
         save_images: If True, save downloaded images to disk
         save_folder: Folder path to save images to (required if save_images=True)
+        max_workers: Maximum number of points fetched concurrently
+        metadata: Optional image metadata already known (e.g. sampled offline from the local index), 
+            in which case only the thumbnails are downloaded
+        cache: Optional image cache, checked (by image id) before downloading any thumbnail. 
+            Together with `metadata`, re-evaluating the same images makes no network calls at all.
 
     Returns:
         List of base64-encoded image strings
     """
-    # bbox centered on Bologna
-    if bbox is None:
-        lat_min = 44.4789
-        lat_max = 44.5141
-        lon_min = 11.3205
-        lon_max = 11.3691
-    else:
-        lat_min, lat_max, lon_min, lon_max = bbox
-
-    # Approximate conversion for offset calculations
-    avg_lat = (lat_min + lat_max) / 2
-    meters_per_deg_lat = 111000  # meters per degree latitude
-    meters_per_deg_lon = 111000 * math.cos(math.radians(avg_lat))  # longitude depends on latitude
-
-    access_token = os.getenv('MAPILLARY_TOKEN')
-    if not access_token:
-        raise ValueError("MAPILLARY_TOKEN environment variable not set")
-
     if save_images:
         if save_folder is None:
             raise ValueError("save_folder must be provided when save_images=True")
         save_path = Path(save_folder)
         save_path.mkdir(parents=True, exist_ok=True)
 
-    url = "https://graph.mapillary.com/images"
-    base_params = {
-        "access_token": access_token,
-        "fields": "id,sequence,thumb_1024_url,camera_type,computed_geometry,thumb_original_url",
-        "limit": 1
-    }
-
     images_b64 = []
     saved_count = 0
-    
-    # Sample points uniformly in this bounding box
-    for point_idx in range(num_points):
-        # Generate base random point
-        base_lat = random.uniform(lat_min, lat_max)
-        base_lon = random.uniform(lon_min, lon_max)
+
+    for img_metadata, img_content in iter_mpllry_images(num_points, bbox=bbox, delta=delta, max_retries=max_retries, offset_radius_meters=offset_radius_meters, max_workers=max_workers, metadata=metadata, cache=cache):
+        # Detect actual image format from content
+        mime_type, ext = detect_image_format(img_content)
         
-        # Try to find metadata, retrying with offset if not found
-        img_metadata = None
-        for attempt in range(max_retries):
-            # Calculate coordinates (with offset for retries)
-            if attempt > 0:
-                # Random offset within radius
-                angle = random.uniform(0, 2 * math.pi)
-                distance = offset_radius_meters * math.sqrt(random.uniform(0, 1))
-                
-                offset_lat = (distance / meters_per_deg_lat) * math.cos(angle)
-                offset_lon = (distance / meters_per_deg_lon) * math.sin(angle)
-                
-                lat = base_lat + offset_lat
-                lon = base_lon + offset_lon
-                
-                # Ensure we stay within bounds
-                lat = max(lat_min, min(lat_max, lat))
-                lon = max(lon_min, min(lon_max, lon))
-            else:
-                lat, lon = base_lat, base_lon
-            
-            # Construct bbox for Mapillary query
-            bbox_str = f"{lon-delta},{lat-delta},{lon+delta},{lat+delta}"
-            point_params = {**base_params, "bbox": bbox_str}
-            
-            try:
-                r = requests.get(url, params=point_params, timeout=15)
-                
-                if r.status_code == 200:
-                    data = r.json().get("data", [])
-                    if data:
-                        img_metadata = data[0]
-                        break  # Found metadata, exit retry loop
-                    # No data found, continue to next attempt with offset
-                # Status not 200, continue to next attempt
-            
-            except (requests.exceptions.Timeout, requests.exceptions.RequestException):
-                # Timeout or other request error, try with offset
-                continue
+        # Save image if requested
+        if save_images:
+            # Use image ID from metadata if available, otherwise use index
+            img_id = img_metadata.get('id', f'img_{len(images_b64)}')
+            file_path = save_path / f"{img_id}.{ext}"
+            file_path.write_bytes(img_content)
+            saved_count += 1
         
-        # If we found metadata, try to download the image
-        if img_metadata:
-            image_url = img_metadata.get('thumb_1024_url')
-            if image_url:
-                try:
-                    img_response = requests.get(image_url, timeout=20)
-                    if img_response.status_code == 200:
-                        img_content = img_response.content
-                        
-                        # Detect actual image format from content
-                        mime_type, ext = detect_image_format(img_content)
-                        
-                        # Save image if requested
-                        if save_images:
-                            # Use image ID from metadata if available, otherwise use index
-                            img_id = img_metadata.get('id', f'img_{len(images_b64)}')
-                            file_path = save_path / f"{img_id}.{ext}"
-                            file_path.write_bytes(img_content)
-                            saved_count += 1
-                        
-                        # Encode to base64
-                        img_b64 = base64.b64encode(img_content).decode('utf-8')
-                        images_b64.append(img_b64)
-                    # If status not 200, just continue to next point (no retry)
-                except requests.exceptions.Timeout as e:
-                    print(f"Timeout downloading image from {image_url}: {e}")
-                    # Continue to next point, no retry
-                except requests.exceptions.RequestException as e:
-                    print(f"Error downloading image from {image_url}: {e}")
-                    # Continue to next point, no retry
+        # Encode to base64
+        img_b64 = base64.b64encode(img_content).decode('utf-8')
+        images_b64.append(img_b64)
 
     print(f"Downloaded {len(images_b64)} images")
     if save_images:
         print(f"Saved {saved_count} images to {save_folder}")
     return images_b64
-        
-
-
-
-
-
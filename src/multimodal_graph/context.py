@@ -0,0 +1,76 @@
+from langchain_core.messages import AnyMessage, HumanMessage
+from langchain_core.messages.utils import count_tokens_approximately
+from langgraph.constants import TAG_NOSTREAM  # tokens of calls with this tag are not streamed to the chat
+from pydantic import BaseModel
+
+# Bounded-context mode for long chat sessions: the model only sees a rolling summary of the older turns
+# plus a sliding window of the recent messages, capped by a token budget, so per-turn latency and cost stay flat.
+
+SUMMARY_PROMPT = """Update the running summary of a conversation between a user and a vision assistant about images.
+Keep the facts, the user's goals and what was concluded about each image; drop greetings and repetitions.
+Answer with the updated summary only, at most {max_words} words.
+
+Current summary:
+{summary}
+
+New messages:
+{transcript}"""
+
+DESCRIPTION_PROMPT = "Describe this image in at most two sentences, for someone who cannot see it. Mention the elements a follow-up question could be about."
+
+
+class ContextConfig(BaseModel):
+    """Limits of the context sent to the model on every turn"""
+    max_messages: int = 10  # sliding window of the most recent messages kept verbatim (user + assistant)
+    max_tokens: int = 4000  # approximate token budget of the window plus the summary
+    summary_max_words: int = 200
+    describe_images: bool = True  # after its first turn, an image is kept in the history as a short description
+    description_max_edge: int = 512  # the description is generated from a downscaled copy of the image
+
+
+def split_history(messages : list[AnyMessage], summary : str, config : ContextConfig) -> tuple[list, list]:
+    """
+    Splits the previous messages of the conversation into the ones to fold into the summary and the ones to keep verbatim:
+    the most recent `max_messages` messages that fit, together with the summary, into `max_tokens`.
+    The kept window always starts with a user message, so that the model never sees an answer without its question.
+
+    Returns:
+        (to_fold, kept)
+    """
+    budget = config.max_tokens - count_tokens_approximately([HumanMessage(summary)]) if summary else config.max_tokens
+    start = len(messages)
+    used = 0
+    while start > 0 and len(messages) - start < config.max_messages:
+        cost = count_tokens_approximately([messages[start - 1]])
+        if used + cost > budget:
+            break
+        used += cost
+        start -= 1
+    while start < len(messages) and not isinstance(messages[start], HumanMessage):
+        start += 1
+    return messages[:start], messages[start:]
+
+
+def summary_message(summary : str) -> HumanMessage:
+    """The rolling summary, as the first message of the context"""
+    return HumanMessage(f"Summary of the conversation so far:\n{summary}")
+
+
+async def summarize(model, summary : str, messages : list[AnyMessage], max_words : int = 200) -> str:
+    """Folds messages into the running summary with a single, text-only model call"""
+    transcript = "\n".join(f"{m.type}: {m.text}" for m in messages)
+    response = await model.ainvoke(
+        [HumanMessage(SUMMARY_PROMPT.format(max_words=max_words, summary=summary or "(empty)", transcript=transcript))],
+        config={"tags": [TAG_NOSTREAM]}
+    )
+    return response.text
+
+
+async def describe_image(model, image_message : HumanMessage) -> str:
+    """
+    Short description of the images of a multimodal message (see utils.prepare_multimodal_message),
+    kept in the history in place of the images once they have been discussed.
+    """
+    images = [block for block in image_message.content_blocks if block["type"] == "image"]
+    response = await model.ainvoke([HumanMessage(content_blocks=[{"type": "text", "text": DESCRIPTION_PROMPT}, *images])], config={"tags": [TAG_NOSTREAM]})
+    return response.text
@@ -1,24 +1,50 @@
 import os
 import asyncio
-from dotenv import load_dotenv
-from langchain_core.messages import HumanMessage
+import argparse
+from langchain_core.messages import HumanMessage, AIMessage
 from langgraph.checkpoint.memory import InMemorySaver
-from make_graph import get_graph
-from utils import encode_b64
+from .make_graph import get_graph, get_multimodal_agent
+from .context import ContextConfig
+from ..mpllry_graph.image_store import IMAGE_STORE
+from ..mpllry_graph.preprocess import ImageConfig
+from ..mpllry_graph.providers import load_env, api_keys
 import uuid
+import time
+from pathlib import Path
 
 
-async def main():
+async def stream_turn(graph, state : dict, config : dict) -> None:
+    """
+    Runs one turn of the chat, printing the reply token by token as the model generates it,
+    then the time to first token and the total latency of the turn.
+    """
+    start = time.perf_counter()
+    first_token = None
+    # subgraphs=True: the tokens come from the agent invoked inside multimodal_node
+    async for _, (chunk, metadata) in graph.astream(state, stream_mode="messages", config=config, subgraphs=True):
+        if isinstance(chunk, AIMessage) and chunk.text:  # token chunks of the model (background calls are tagged nostream)
+            if first_token is None:
+                first_token = time.perf_counter() - start
+            print(chunk.text, end="", flush=True)
+    total = time.perf_counter() - start
+
+    ttft = f"{first_token:.2f}s" if first_token is not None else "n/a"
+    print(f"\n[time to first token: {ttft}, total: {total:.2f}s]")
+
+
+async def main(context_config : ContextConfig = None):
     
-    load_keys = load_dotenv()
-    if not os.getenv("OPENAI_API_KEY") or not os.getenv("FIREWORKS_API_KEY") or not os.getenv("ANTHROPIC_API_KEY"):
-        raise EnvironmentError("no api key in environment!")
+    load_env()
+    api_keys(os.getenv("PROVIDER", "QWEN"))  # only the key of the provider in use is needed (see models.py)
 
     # memory
     checkpointer = InMemorySaver()
     
-    # Define graph
-    graph = get_graph(checkpointer)
+    # Define graph (images are downscaled to at most 1568px, larger ones are resized by the providers anyway)
+    # with a context_config, long sessions keep a roughly constant per-turn cost (summary + recent window)
+    graph = get_graph(checkpointer, image_config=ImageConfig(max_edge=1568, jpeg_quality=90), context_config=context_config)
+    # build the agent (provider imports, client) in the background while the user picks an image
+    warmup = asyncio.get_running_loop().run_in_executor(None, get_multimodal_agent)
 
     # Set user ID for storing memories
     thread_id = str(uuid.uuid4())[:8]
@@ -40,7 +66,7 @@ async def main():
             continue
         
         try:
-            img_b64 = encode_b64(img_path)
+            img_ref = IMAGE_STORE.put(Path(img_path).read_bytes(), Path(img_path).name)  # the state only carries the handle
             break
         except Exception as e:
             print(f"Error loading image: {e}\n")
@@ -55,16 +81,15 @@ async def main():
     # Initialize state with first message and image
     init_state = {
         "messages": [HumanMessage(content=user_message)],
-        "images": [img_b64]
+        "images": [img_ref]
     }
     
+    await warmup  # raises the errors of the agent build (config, client), and the first turn reuses the built agent
+
     # First interaction
     print("\nAssistant: ", end="", flush=True)
-    response = None
-    async for chunk in graph.astream(init_state, stream_mode="values", config=config):
-        response = chunk["messages"][-1]
-    if response:
-        print(response.content)
+    await stream_turn(graph, init_state, config)
+    IMAGE_STORE.release(img_ref)  # the image was consumed by the first turn
     
     # Conversation loop
     while True:
@@ -83,12 +108,15 @@ async def main():
         }
         
         print("\nAssistant: ", end="", flush=True)
-        response = None
-        async for chunk in graph.astream(state, stream_mode="values", config=config):
-            response = chunk["messages"][-1]
-        if response:
-            print(response.content)
+        await stream_turn(graph, state, config)
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Chat with a vision model about an image")
+    parser.add_argument("--bounded-context", action="store_true", help="send a rolling summary plus the recent messages instead of the whole history")
+    parser.add_argument("--max-messages", type=int, default=10, help="bounded context: recent messages kept verbatim")
+    parser.add_argument("--max-tokens", type=int, default=4000, help="bounded context: approximate token budget of summary + recent messages")
+    args = parser.parse_args()
+
+    context_config = ContextConfig(max_messages=args.max_messages, max_tokens=args.max_tokens) if args.bounded_context else None
+    asyncio.run(main(context_config))
\ No newline at end of file
@@ -2,48 +2,110 @@ from langgraph.graph import END, START, StateGraph
 from langgraph.types import Command
 from typing import Literal
 from langchain.agents import create_agent
+from langchain_core.messages import HumanMessage, RemoveMessage
+from langchain_core.runnables import RunnableConfig
+import asyncio
+from functools import cache
 
 from .state import MultiState
 from .utils import prepare_multimodal_message
 from .prompts.multimodal_prompt import multimodal_prompt
 from .models import get_multimodal_model
+from .context import ContextConfig, split_history, summary_message, summarize, describe_image
+from ..mpllry_graph.preprocess import ImageConfig, normalize_images
+from ..mpllry_graph.image_store import IMAGE_STORE
 
-multimodal_agent = create_agent(
-    model=get_multimodal_model(),
-    tools=[],
-    system_prompt=multimodal_prompt
-)
+@cache
+def get_model():
+    """The multimodal model, built on first use (then cached): also used, text only, for the summaries of the bounded-context mode"""
+    return get_multimodal_model()
 
-async def multimodal_node(state: MultiState) -> Command[Literal["__end__"]]:   # after multimodal -> stop (could change later)
+@cache
+def get_multimodal_agent():
+    """The agent, built on first use (then cached), so that importing this module or building the graph stays cheap"""
+    return create_agent(
+        model=get_model(),
+        tools=[],
+        system_prompt=multimodal_prompt
+    )
+
+def make_multimodal_node(image_config : ImageConfig = None, context_config : ContextConfig = None):
     """
-    Handles multimodal inputs with multimodal model
+    Builds the multimodal node. If image_config is given, images are resized and re-encoded before the model call.
+    If context_config is given, the model sees a rolling summary plus a bounded window of the history instead of
+    the whole conversation (see context.py).
     """
 
-    # construct multimodal input message
-    multimodal_msg = prepare_multimodal_message(state)  # returns HumanMessage
+    async def multimodal_node(state: MultiState, config: RunnableConfig) -> Command[Literal["__end__"]]:   # after multimodal -> stop (could change later)
+        """
+        Handles multimodal inputs with multimodal model
+        """
+        refs = state.get("images", [])
+        describe = context_config is not None and context_config.describe_images and len(refs) > 0
+    
+        # resize / re-encode images in a worker pool (no-op if image_config is None), into IMAGE_STORE
+        images = await normalize_images(refs, image_config, IMAGE_STORE)
+        small_images = await normalize_images(refs, ImageConfig(max_edge=context_config.description_max_edge), IMAGE_STORE) if describe else []
+        try:
+            # construct multimodal input message (base64 is only built here, for the request)
+            multimodal_msg = prepare_multimodal_message(state, images)  # returns HumanMessage
+            description_msg = prepare_multimodal_message(state, small_images) if describe else None
+        finally:
+            for ref in images + small_images:  # normalized copies are not needed anymore
+                IMAGE_STORE.release(ref)
+    
+        # clear history of last message to swap last one with the new, multimodal one
+        history = state.get("messages", [])[:-1] if state.get("messages", []) else []
 
-    # clear history of last message to swap last one with the new, multimodal one
-    history = state.get("messages", [])[:-1] if state.get("messages", []) else []
-    updated_history = history + [multimodal_msg]  # LG wants lists to concatenate messages
+        if context_config is None:
+            updated_history = history + [multimodal_msg]  # LG wants lists to concatenate messages
+            result = await get_multimodal_agent().ainvoke({"messages": updated_history}, config=config)  # config: tokens reach the graph stream
+            return Command(
+                update={
+                    "messages" : [result["messages"][-1]],  # must be a list
+                    "images" : [],  # clearing images after invocation, keep memory lightweight
+                },
+                goto=END
+            )
 
-    result = await multimodal_agent.ainvoke({"messages": updated_history})
-    last_msg = result["messages"][-1]
+        # bounded context: summary + recent window. Messages leaving the window are folded into the summary
+        # (and the images described) concurrently with the answer: until the new summary covers them, they stay
+        # in this turn's context, and they are removed from the history in the same update that writes the summary
+        summary = state.get("summary", "")
+        to_fold, kept = split_history(history, summary, context_config)
+        updated_history = ([summary_message(summary)] if summary else []) + to_fold + kept + [multimodal_msg]
 
-    return Command(
-        update={
-            "messages" : [last_msg],  # must be a list
-            "images" : [],  # clearing images after invocation, keep memory lightweight
-        },
-        goto=END
-    )
+        tasks = [get_multimodal_agent().ainvoke({"messages": updated_history}, config=config)]
+        if to_fold:
+            tasks.append(summarize(get_model(), summary, to_fold, context_config.summary_max_words))
+        if describe:
+            tasks.append(describe_image(get_model(), description_msg))
+        result, *extra = await asyncio.gather(*tasks)
+
+        update = {
+            "messages" : [RemoveMessage(id=m.id) for m in to_fold] + [result["messages"][-1]],
+            "images" : [],
+        }
+        if to_fold:
+            update["summary"] = extra.pop(0)
+        if describe:
+            # the images are replaced in the history by their description, for the next turns
+            user_msg = state["messages"][-1]
+            update["messages"].insert(0, HumanMessage(f"{user_msg.text}\n[Image: {extra.pop(0)}]", id=user_msg.id))  # same id: replaces it
+
+        return Command(update=update, goto=END)
+
+    return multimodal_node
 
-def get_graph(checkpointer, save_display=False) -> StateGraph:
+def get_graph(checkpointer, save_display=False, image_config : ImageConfig = None, context_config : ContextConfig = None) -> StateGraph:
     """
-    Get the builder for the graph
+    Get the builder for the graph.
+    If an image_config is provided, images are normalized (resized / re-encoded) before being sent to the model.
+    If a context_config is provided, the context sent to the model is bounded (sliding window, token budget, rolling summary).
     """
     builder = StateGraph(MultiState)
     # nodes
-    builder.add_node("multimodal_agent", multimodal_node)
+    builder.add_node("multimodal_agent", make_multimodal_node(image_config, context_config))
     # edges
     builder.add_edge(START, "multimodal_agent")
 
@@ -1,10 +1,11 @@
 from langchain.agents import AgentState
 from typing import List, Union
-from typing_extensions import Annotated
+from typing_extensions import Annotated, NotRequired
+from ..mpllry_graph.image_store import ImageRef
 
-def add_b64(left : Union[List[str], None], right : Union[List[str], None]) -> List:
+def add_images(left : Union[List[ImageRef], None], right : Union[List[ImageRef], None]) -> List:
     """
-    Reducer to combine two lists of base64 strings.
+    Reducer to combine two lists of image handles (the bytes live in image_store.IMAGE_STORE, not in the state).
     If right is empty list, it clears (allows nodes to reset media).
     In the future: could swap lists with dicitonaries with boolean flags for already inserted in chat.
     """
@@ -23,4 +24,5 @@ def add_b64(left : Union[List[str], None], right : Union[List[str], None]) -> Li
 
 class MultiState(AgentState):
     """State of multimodal agent, inherits from AgentState, so it gets `messages` and `remaining_steps` keys for free"""
-    images : Annotated[List[str], add_b64]
\ No newline at end of file
+    images : Annotated[List[ImageRef], add_images]
+    summary : NotRequired[str]  # rolling summary of the older turns, bounded-context mode only (see context.py)
\ No newline at end of file
@@ -1,15 +1,12 @@
 from langchain_core.messages import HumanMessage
 from .state import MultiState
-import base64
+from ..mpllry_graph.image_store import IMAGE_STORE, ImageRef, detect_image_format
 
-# this is actually used in main.py
-def encode_b64(file_path):
-    with open(file_path, "rb") as f:
-        return base64.b64encode(f.read()).decode('utf-8')
-
-def prepare_multimodal_message(state: MultiState) -> HumanMessage:
+def prepare_multimodal_message(state: MultiState, images: list[ImageRef] = None) -> HumanMessage:
     """
-    Helper to create multimodal message from state
+    Helper to create multimodal message from state.
+    If images (handles in IMAGE_STORE) are given, they are used instead of the ones in the state.
+    Images are encoded to base64 here, only for the provider request.
 
     Returns:
         message (HumanMessage): The multimodal message
@@ -24,12 +21,13 @@ def prepare_multimodal_message(state: MultiState) -> HumanMessage:
     
     content_blocks = [{"type": "text", "text": text}]   # it is a list of typed dicts, see https://docs.langchain.com/oss/python/langchain/messages#multimodal
     
-    # Add images
-    for img_b64 in state.get("images", []):
+    # Add images (already normalized ones if given, see mpllry_graph/preprocess.py)
+    for ref in (images if images is not None else state.get("images", [])):
+        mime_type, _ = detect_image_format(IMAGE_STORE.get(ref))
         content_blocks.append({
             "type": "image",
-            "base64": img_b64,
-            "mime_type": "image/png"  # it would be better to auto detect myme at runtime - so maybe img encoding should be here and not in main
+            "base64": IMAGE_STORE.b64(ref),
+            "mime_type": mime_type
         })
 
 
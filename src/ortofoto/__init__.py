@@ -0,0 +1 @@
+# Bologna ortofoto tiles: tile math (tiles.py), fetching and MBTiles cache (fetcher.py, tile_cache.py), mosaics (mosaic.py) and change detection (change.py)
@@ -0,0 +1,178 @@
+import asyncio
+import io
+
+import numpy as np
+from PIL import Image
+from pydantic import BaseModel
+
+from .tiles import TILE_SIZE, TileRange
+from .mosaic import Mosaic
+
+# Multi-year change detection on aligned mosaics (see mosaic.py), to send only the tiles that changed to the vision model.
+# Every tile is standardized per channel (zero mean, unit variance), which cancels the differences in exposure, white
+# balance and season between flights, then cut into blocks: the per-channel mean and standard deviation of every block
+# are compared between the years. Block statistics are robust to the small misregistrations between flights, which
+# would light up every edge in a pixel difference. Tiles are processed a chunk of a tile row at a time, vectorized over
+# the tiles of the chunk, so memory stays bounded whatever the size of the mosaics.
+
+CHANGE_PROMPT = (
+    "These are two aerial ortofotos of the same area of Bologna, {before} on the left and {after} on the right. "
+    "Describe what changed between the two years (new or demolished buildings, construction sites, roads, green areas, "
+    "parking lots...), in two or three sentences. If nothing substantial changed (only light, shadows, seasons or cars), say so."
+)
+
+
+class ChangeConfig(BaseModel):
+    """Change detection parameters, distances are in standard deviations of the tile"""
+    level: int = 0  # mosaic level compared (0 = full resolution, 1 = half...)
+    block_size: int = 32  # pixels of a block side, at the compared level
+    threshold: float = 0.5  # block distance above which a block counts as changed
+    min_changed: float = 0.05  # fraction of changed blocks for a tile to be reported
+    chunk_tiles: int = 64  # tiles processed at once (memory: chunk_tiles * 256 * 256 * 3 floats per year)
+
+
+def block_stats(tiles : np.ndarray, block_size : int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Per-block statistics of (n, s, s, 3) uint8 tiles, standardized per tile and channel.
+    Standardizing is linear, so it is applied to the block statistics of the raw pixels (sums of x and x^2)
+    instead of to the pixels: the tile statistics come from the block ones, in one pass over the tiles.
+
+    Returns:
+        (block means, block standard deviations), both (n, s / block_size, s / block_size, 3),
+        and a (n,) mask of the tiles with content (not a flat fill, e.g. missing on the server)
+    """
+    n, s, _, c = tiles.shape
+    blocks = s // block_size
+    x = tiles.reshape(n, blocks, block_size, blocks, block_size, c)
+    x = x.transpose(0, 1, 3, 5, 2, 4).astype(np.float32).reshape(n, blocks, blocks, c, block_size * block_size)  # pixels of a block last: fast reductions
+    block_mean = x.mean(axis=-1, dtype=np.float64)
+    block_sq = np.einsum("...i,...i->...", x, x, dtype=np.float64) / (block_size * block_size)
+    block_var = np.maximum(block_sq - block_mean ** 2, 0.0)
+
+    mean = block_mean.mean(axis=(1, 2), keepdims=True)  # blocks have the same size: tile stats from the block ones
+    std = np.sqrt(np.maximum(block_sq.mean(axis=(1, 2), keepdims=True) - mean ** 2, 0.0))
+    valid = std.max(axis=(1, 2, 3)) > 1.0  # a flat tile has no texture to compare
+    std = np.maximum(std, 1.0)
+    return (block_mean - mean) / std, np.sqrt(block_var) / std, valid
+
+
+def tile_changes(before : np.ndarray, after : np.ndarray, config : ChangeConfig = ChangeConfig()) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Change scores of aligned tiles, (n, s, s, 3) uint8 arrays of the same area in two years.
+
+    Returns:
+        scores (n,): 90th percentile of the block distances (NaN for tiles without content in either year),
+        changed (n,): fraction of the blocks whose distance is above config.threshold
+    """
+    mean_a, std_a, valid_a = block_stats(before, config.block_size)
+    mean_b, std_b, valid_b = block_stats(after, config.block_size)
+    distance = (np.abs(mean_a - mean_b) + np.abs(std_a - std_b)).mean(axis=-1)  # (n, blocks, blocks)
+    distance = distance.reshape(len(distance), -1)
+    scores = np.percentile(distance, 90, axis=1)  # a change covering a tenth of the tile is enough, a single noisy block is not
+    changed = (distance > config.threshold).mean(axis=1)
+    invalid = ~(valid_a & valid_b)
+    scores[invalid], changed[invalid] = np.nan, 0.0
+    return scores, changed
+
+
+def _chunk(mosaic : Mosaic, level : int, row : int, col_start : int, col_end : int) -> np.ndarray:
+    """Tiles [col_start, col_end) of tile row `row` of a level, as (n, s, s, 3)"""
+    size = TILE_SIZE >> level
+    band = mosaic.levels[level][row * size:(row + 1) * size, col_start * size:col_end * size]
+    return np.ascontiguousarray(band).reshape(size, col_end - col_start, size, 3).transpose(1, 0, 2, 3)
+
+
+def detect_changes(before : Mosaic, after : Mosaic, config : ChangeConfig = ChangeConfig()) -> list[dict]:
+    """
+    Ranks the tiles of two mosaics of the same tile range (different years) by how much they changed.
+
+    Args:
+        before: Mosaic of the earlier year
+        after: Mosaic of the later year
+        config: Detection parameters
+
+    Returns:
+        [{"z", "x", "y", "score", "changed", "bbox"}] for the tiles with at least config.min_changed of changed blocks,
+        highest score first (bbox = [lon_min, lat_min, lon_max, lat_max] of the tile)
+    """
+    tile_range = before.tile_range
+    if vars(tile_range) != vars(after.tile_range):
+        raise ValueError(f"mosaics cover different tiles: {tile_range} and {after.tile_range}")
+    if (TILE_SIZE >> config.level) % config.block_size:
+        raise ValueError(f"block_size {config.block_size} does not divide the tile size at level {config.level}")
+
+    results = []
+    for row in range(tile_range.height):
+        for col_start in range(0, tile_range.width, config.chunk_tiles):
+            col_end = min(col_start + config.chunk_tiles, tile_range.width)
+            scores, changed = tile_changes(_chunk(before, config.level, row, col_start, col_end), _chunk(after, config.level, row, col_start, col_end), config)
+            for i in np.flatnonzero(changed >= config.min_changed):
+                x, y = tile_range.x_min + col_start + i, tile_range.y_min + row
+                results.append({
+                    "z": tile_range.zoom, "x": int(x), "y": int(y),
+                    "score": float(scores[i]), "changed": float(changed[i]),
+                    "bbox": TileRange(tile_range.zoom, x, x, y, y).bbox(),
+                })
+    results.sort(key=lambda change: change["score"], reverse=True)
+    return results
+
+
+def change_image(before : Mosaic, after : Mosaic, change : dict, context : int = 1) -> Image.Image:
+    """
+    Side-by-side image of a changed tile, before on the left and after on the right (like the notebook's comparison),
+    with `context` tiles of surroundings on each side, clipped to the mosaics
+    """
+    tile_range = before.tile_range
+    x0, x1 = max(change["x"] - context, tile_range.x_min), min(change["x"] + context, tile_range.x_max)
+    y0, y1 = max(change["y"] - context, tile_range.y_min), min(change["y"] + context, tile_range.y_max)
+    rows = slice((y0 - tile_range.y_min) * TILE_SIZE, (y1 - tile_range.y_min + 1) * TILE_SIZE)
+    cols = slice((x0 - tile_range.x_min) * TILE_SIZE, (x1 - tile_range.x_min + 1) * TILE_SIZE)
+    left, right = Image.fromarray(np.asarray(before.levels[0][rows, cols])), Image.fromarray(np.asarray(after.levels[0][rows, cols]))
+
+    width, height = left.size
+    comparison = Image.new("RGB", (width * 2 + 10, height), (255, 255, 255))  # 10 px white separator
+    comparison.paste(left, (0, 0))
+    comparison.paste(right, (width + 10, 0))
+    return comparison
+
+
+async def describe_changes(before : Mosaic, after : Mosaic, changes : list[dict], years : tuple[int, int], top_k : int = 20, max_concurrency : int = 4) -> list[dict]:
+    """
+    Sends the top_k changes to the multimodal graph, one side-by-side image each, concurrently.
+
+    Args:
+        before: Mosaic of the earlier year
+        after: Mosaic of the later year
+        changes: Output of detect_changes, highest score first
+        years: (earlier year, later year), for the prompt
+        top_k: Number of changes described
+        max_concurrency: Model calls in flight
+
+    Returns:
+        The top_k changes, each with a "description" (None if the model call failed)
+    """
+    from langchain_core.messages import HumanMessage  # the detection itself does not need the model stack
+    from ..multimodal_graph.make_graph import get_graph
+    from ..mpllry_graph.image_store import IMAGE_STORE
+    from ..mpllry_graph.preprocess import ImageConfig
+
+    graph = get_graph(checkpointer=None, image_config=ImageConfig(max_edge=1568, jpeg_quality=90))
+    prompt = CHANGE_PROMPT.format(before=years[0], after=years[1])
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def describe(change):
+        async with semaphore:
+            out = io.BytesIO()
+            image = await asyncio.to_thread(change_image, before, after, change)
+            await asyncio.to_thread(image.save, out, "PNG")
+            ref = IMAGE_STORE.put(out.getvalue(), f"change_{change['z']}_{change['x']}_{change['y']}")
+            try:
+                result = await graph.ainvoke({"messages": [HumanMessage(content=prompt)], "images": [ref]})
+                return {**change, "description": result["messages"][-1].text}
+            except Exception as e:
+                print(f"Warning: failed to describe tile {change['x']}/{change['y']}: {e!r}")
+                return {**change, "description": None}
+            finally:
+                IMAGE_STORE.release(ref)
+
+    return await asyncio.gather(*(describe(change) for change in changes[:top_k]))
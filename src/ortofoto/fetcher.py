@@ -0,0 +1,114 @@
+import asyncio
+import io
+import os
+
+import httpx
+from PIL import Image
+
+from .tiles import TILE_SIZE, TileRange
+from .tile_cache import MISSING, TileCache
+from ..mpllry_graph.downloader import AsyncDownloader
+from ..mpllry_graph.providers import load_env
+
+DEFAULT_ORTOFOTO_URL = "http://sitmappe.comune.bologna.it/tms/tileserver"
+YEARS = [2017, 2018, 2020, 2021, 2022, 2023, 2024]  # ortofoto years available from Comune di Bologna
+
+
+def ortofoto_url() -> str:
+    """The tile server: ORTOFOTO_URL (environment or .env, e.g. to point to a local stub), or the Comune di Bologna one"""
+    load_env()
+    return os.getenv("ORTOFOTO_URL", DEFAULT_ORTOFOTO_URL)
+
+
+def tile_url(year : int, z : int, x : int, y : int) -> str:
+    return f"{ortofoto_url()}/Ortofoto{year}/{z}/{x}/{y}.png"
+
+
+class TileFetcher:
+    """
+    Concurrent tile downloader backed by the persistent tile cache: only the tiles never seen before hit the server.
+    Downloads share one pooled client (keep-alive, at most `per_host` requests in flight, retries with jittered backoff),
+    and new tiles are written to the cache in one transaction per batch.
+    Tiles the server answers 404 for are cached as missing; other failures are not cached, and retried on the next call.
+    """
+
+    def __init__(self, cache : TileCache = None, downloader : AsyncDownloader = None, batch_size : int = 256):
+        self.cache = cache or TileCache()
+        self.downloader = downloader or AsyncDownloader(per_host=8)  # a public municipal server: be gentle
+        self.batch_size = batch_size
+        self.downloaded = 0
+        self.failed = 0
+
+    async def _download(self, year : int, tile : tuple[int, int, int]):
+        try:
+            return tile, await self.downloader.fetch(tile_url(year, *tile))
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code == 404:
+                return tile, MISSING
+            error = e
+        except httpx.HTTPError as e:
+            error = e
+        print(f"Warning: failed to download tile {year}/{'/'.join(map(str, tile))}: {error!r}")
+        self.failed += 1
+        return tile, None
+
+    async def iter_tiles(self, year : int, tiles):
+        """
+        Yields ((z, x, y), png bytes or None) for every tile, as soon as it is available:
+        batch by batch, the cached tiles first, then the downloads in completion order. None: the tile is missing on the server, or failed.
+        Only one batch of tiles is held in memory at a time, whatever the number of tiles.
+        """
+        tiles = list(tiles)
+        for start in range(0, len(tiles), self.batch_size):
+            batch = tiles[start:start + self.batch_size]
+            cached = await asyncio.to_thread(self.cache.get_many, year, batch)
+            for tile, data in cached.items():
+                yield tile, data or None
+
+            fetched = {}
+            for done in asyncio.as_completed([self._download(year, tile) for tile in batch if tile not in cached]):
+                tile, data = await done
+                if data is not None:
+                    fetched[tile] = data
+                yield tile, data or None
+            if fetched:
+                await asyncio.to_thread(self.cache.put_many, year, fetched)
+                self.downloaded += sum(1 for data in fetched.values() if data)
+
+    async def fetch_tiles(self, year : int, tiles) -> dict:
+        """Returns {(z, x, y): png bytes or None} for every tile (see iter_tiles)"""
+        return {tile: data async for tile, data in self.iter_tiles(year, tiles)}
+
+    async def prefetch(self, years : list[int], tile_range : TileRange) -> dict:
+        """
+        Fills the cache with every tile of the range, for every year (concurrently), e.g. a whole bbox before building mosaics.
+
+        Returns:
+            Number of available tiles per year
+        """
+        async def prefetch_year(year):
+            return sum([data is not None async for _, data in self.iter_tiles(year, tile_range)])
+
+        counts = await asyncio.gather(*(prefetch_year(year) for year in years))
+        return dict(zip(years, counts))
+
+    def stats(self) -> dict:
+        return {"cache_hits": self.cache.hits, "cache_misses": self.cache.misses, "downloaded": self.downloaded, "failed": self.failed}
+
+    async def aclose(self) -> None:
+        await self.downloader.aclose()
+
+
+async def ortofoto_image(fetcher : TileFetcher, year : int, tile_range : TileRange) -> Image.Image:
+    """
+    Stitches the tiles of a range into one PIL image (missing tiles are left grey), like the notebook's create_ortofoto_image.
+
+    Returns:
+        PIL Image object
+    """
+    result_image = Image.new("RGB", (tile_range.width * TILE_SIZE, tile_range.height * TILE_SIZE), color=(200, 200, 200))
+    async for (_, x, y), data in fetcher.iter_tiles(year, tile_range):
+        if data:
+            tile_img = Image.open(io.BytesIO(data))
+            result_image.paste(tile_img, ((x - tile_range.x_min) * TILE_SIZE, (y - tile_range.y_min) * TILE_SIZE))
+    return result_image
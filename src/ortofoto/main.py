@@ -0,0 +1,75 @@
+import argparse
+import asyncio
+import json
+import time
+
+from .fetcher import TileFetcher, YEARS
+from .mosaic import build_mosaic, Mosaic
+from .change import ChangeConfig, detect_changes, describe_changes
+from .tiles import TileRange
+from ..mpllry_graph.providers import load_env
+
+
+def _floats(value : str) -> list[float]:
+    return [float(v) for v in value.split(",")]
+
+
+async def main(args):
+    years = [int(year) for year in args.years.split(",")] if args.years else YEARS
+    if args.bbox:
+        tile_range = TileRange.from_bbox(args.bbox, args.zoom)
+    else:
+        tile_range = TileRange.around(args.center[0], args.center[1], args.zoom, args.tile_radius)
+    print(f"Prefetching {len(tile_range)} tiles x {len(years)} years ({tile_range})")
+
+    fetcher = TileFetcher()
+    start = time.perf_counter()
+    counts = await fetcher.prefetch(years, tile_range)
+    elapsed = time.perf_counter() - start
+    await fetcher.aclose()
+
+    for year, count in counts.items():
+        print(f"  {year}: {count}/{len(tile_range)} tiles available, {fetcher.cache.path(year)}")
+    print(f"Done in {elapsed:.1f}s: {fetcher.stats()}")
+
+    if args.mosaic:
+        fetcher = TileFetcher(fetcher.cache)  # tiles are all cached now
+        for year in years:
+            start = time.perf_counter()
+            mosaic = await build_mosaic(fetcher, year, tile_range, f"{args.mosaic}/{year}")
+            shapes = ", ".join(f"{level.shape[1]}x{level.shape[0]}" for level in mosaic.levels)
+            print(f"  {year}: mosaic in {mosaic.directory} ({shapes}) in {time.perf_counter() - start:.1f}s")
+        await fetcher.aclose()
+
+    if args.compare:
+        before_year, after_year = sorted(int(year) for year in args.compare.split(","))
+        before, after = Mosaic(f"{args.mosaic}/{before_year}"), Mosaic(f"{args.mosaic}/{after_year}")
+        start = time.perf_counter()
+        changes = detect_changes(before, after, ChangeConfig(threshold=args.change_threshold))
+        print(f"{len(changes)}/{len(tile_range)} tiles changed between {before_year} and {after_year} ({time.perf_counter() - start:.1f}s)")
+        if args.describe:
+            load_env()  # model API keys
+            changes[:args.describe] = await describe_changes(before, after, changes, (before_year, after_year), top_k=args.describe)
+        for change in changes[:10]:
+            print(f"  {change['x']}/{change['y']}: score {change['score']:.2f}, {change['changed']:.0%} of the tile" + (f"\n    {change['description']}" if change.get("description") else ""))
+        output = f"{args.mosaic}/changes_{before_year}_{after_year}.json"
+        with open(output, "w") as f:
+            json.dump(changes, f, indent=2)
+        print(f"Ranked changes saved to {output}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Download Bologna ortofoto tiles into the persistent tile cache")
+    parser.add_argument("--bbox", type=_floats, help="lon_min,lat_min,lon_max,lat_max of the area")
+    parser.add_argument("--center", type=_floats, default=[44.4939, 11.3426], help="lat,lon of the center, if no bbox (default: Piazza Maggiore)")
+    parser.add_argument("--tile-radius", type=int, default=4, help="tiles in each direction from the center, if no bbox")
+    parser.add_argument("--zoom", type=int, default=18, help="zoom level (higher = more detail, 16-18 recommended)")
+    parser.add_argument("--mosaic", help="also build the memory-mapped mosaic of every year, in MOSAIC/<year> (see mosaic.py)")
+    parser.add_argument("--compare", help="two comma-separated years: rank the tiles that changed between their mosaics (needs --mosaic, see change.py)")
+    parser.add_argument("--change-threshold", type=float, default=0.5, help="block distance (in standard deviations) counted as a change")
+    parser.add_argument("--describe", type=int, default=0, help="send the top N changes to the multimodal graph for a description")
+    parser.add_argument("--years", help=f"comma-separated years, default all ({','.join(map(str, YEARS))})")
+    args = parser.parse_args()
+    if args.compare and not args.mosaic:
+        parser.error("--compare needs --mosaic")
+    asyncio.run(main(args))
@@ -0,0 +1,188 @@
+import asyncio
+import io
+import json
+import mmap
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from .tiles import TILE_SIZE, TileRange
+from .fetcher import TileFetcher
+
+# Mosaics of any size with bounded RAM: tiles are decoded and written straight into memory-mapped .npy canvases
+# (level 0 at full resolution, then overviews at 1/2, 1/4, ...) as they arrive, so only the tiles in flight are in memory.
+# Tile boundaries are aligned with every overview level (256 px = 2^8), so each tile updates its own block of every
+# overview on arrival (2x2 box filter), and the pyramid is complete as soon as the last tile is written.
+
+FILL = 200  # grey, for tiles missing on the server (like the notebook)
+META_FILE = "mosaic.json"
+RELEASE_EVERY = 256  # tiles between two releases of the written pages
+
+
+def _level_path(directory : Path, level : int) -> Path:
+    return directory / f"level{level}.npy"
+
+
+def _release(canvas : np.memmap) -> None:
+    """
+    Writes the dirty pages of a canvas to its file and unmaps them from the process: the data stays in the file
+    (and in the page cache, which the OS can reclaim), so the resident memory of a mosaic does not grow with its size
+    """
+    canvas.flush()
+    if hasattr(mmap, "MADV_DONTNEED") and canvas._mmap is not None:  # not on Windows: pages stay mapped until close
+        canvas._mmap.madvise(mmap.MADV_DONTNEED)
+
+
+def _default_levels(tile_range : TileRange, min_edge : int = 1024) -> int:
+    """Number of levels (full resolution included) until the smallest overview fits in min_edge pixels"""
+    edge = max(tile_range.width, tile_range.height) * TILE_SIZE
+    levels = 1
+    while edge > min_edge and levels <= 8:  # 8 halvings bring a tile down to a single pixel
+        edge //= 2
+        levels += 1
+    return levels
+
+
+def decode_tile(data : bytes) -> np.ndarray:
+    """PNG (or JPEG) tile -> (256, 256, 3) uint8 array"""
+    with Image.open(io.BytesIO(data)) as img:
+        return np.asarray(img.convert("RGB"))
+
+
+def downsample(block : np.ndarray) -> np.ndarray:
+    """2x2 box filter, for blocks with even sides"""
+    summed = block[0::2, 0::2].astype(np.uint16)  # four strided adds: much faster than a reduction over the reshaped axes
+    summed += block[1::2, 0::2]
+    summed += block[0::2, 1::2]
+    summed += block[1::2, 1::2]
+    summed += 2  # rounding
+    return (summed >> 2).astype(np.uint8)
+
+
+class MosaicBuilder:
+    """
+    Writes the tiles of a range into memory-mapped canvases (`level0.npy`, `level1.npy`, ... in directory),
+    plus a `mosaic.json` sidecar with the tile range and bbox. add_tile is safe to call from several threads
+    (tiles write disjoint blocks).
+    """
+
+    def __init__(self, directory : str, tile_range : TileRange, levels : int = None, fill : int = FILL):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.tile_range = tile_range
+        self.levels = levels or _default_levels(tile_range)
+        if not 1 <= self.levels <= 9:
+            raise ValueError(f"levels must be between 1 and 9, got {self.levels}")
+        height, width = tile_range.height * TILE_SIZE, tile_range.width * TILE_SIZE
+        self.canvases = []
+        for level in range(self.levels):
+            canvas = np.lib.format.open_memmap(_level_path(self.directory, level), mode="w+", dtype=np.uint8, shape=(height >> level, width >> level, 3))
+            band = TILE_SIZE >> level
+            for row in range(0, canvas.shape[0], band):  # one row of tiles at a time: never the whole canvas dirty in memory
+                canvas[row:row + band] = fill
+                _release(canvas)
+            self.canvases.append(canvas)
+        self.tiles_written = 0
+        self._lock = threading.Lock()
+
+    def add_tile(self, x : int, y : int, tile : np.ndarray) -> None:
+        """Writes a (256, 256, 3) tile at tile coordinates (x, y) into every level"""
+        row, col = (y - self.tile_range.y_min) * TILE_SIZE, (x - self.tile_range.x_min) * TILE_SIZE
+        block = tile
+        for level, canvas in enumerate(self.canvases):
+            if level:
+                block = downsample(block)
+            size = TILE_SIZE >> level
+            canvas[row >> level:(row >> level) + size, col >> level:(col >> level) + size] = block
+        with self._lock:
+            self.tiles_written += 1
+            if self.tiles_written % RELEASE_EVERY == 0:
+                for canvas in self.canvases:
+                    _release(canvas)
+
+    def close(self) -> "Mosaic":
+        for canvas in self.canvases:
+            _release(canvas)
+        meta = {
+            "zoom": self.tile_range.zoom,
+            "x_min": self.tile_range.x_min, "x_max": self.tile_range.x_max,
+            "y_min": self.tile_range.y_min, "y_max": self.tile_range.y_max,
+            "bbox": self.tile_range.bbox(),
+            "levels": self.levels,
+            "tiles_written": self.tiles_written,
+        }
+        (self.directory / META_FILE).write_text(json.dumps(meta, indent=2))
+        self.canvases = []
+        return Mosaic(self.directory)
+
+
+class Mosaic:
+    """A mosaic built by MosaicBuilder, opened read-only and memory-mapped: only the windows actually read are loaded"""
+
+    def __init__(self, directory : str):
+        self.directory = Path(directory)
+        self.meta = json.loads((self.directory / META_FILE).read_text())
+        self.tile_range = TileRange(self.meta["zoom"], self.meta["x_min"], self.meta["x_max"], self.meta["y_min"], self.meta["y_max"])
+        self.levels = [np.load(_level_path(self.directory, level), mmap_mode="r") for level in range(self.meta["levels"])]
+
+    @property
+    def bbox(self) -> list[float]:
+        return self.meta["bbox"]
+
+    def tile(self, x : int, y : int, level : int = 0) -> np.ndarray:
+        """The block of tile (x, y) at a level, (256 >> level, 256 >> level, 3)"""
+        size = TILE_SIZE >> level
+        row, col = (y - self.tile_range.y_min) * size, (x - self.tile_range.x_min) * size
+        return self.levels[level][row:row + size, col:col + size]
+
+    def image(self, level : int = None, max_edge : int = None) -> Image.Image:
+        """
+        A level as a PIL image (loaded in memory): by default the most detailed level whose longest edge fits in max_edge
+        (all of level 0 if max_edge is None)
+        """
+        if level is None:
+            level = 0
+            while max_edge is not None and max(self.levels[level].shape[:2]) > max_edge and level < len(self.levels) - 1:
+                level += 1
+        return Image.fromarray(np.asarray(self.levels[level]))
+
+
+async def build_mosaic(fetcher : TileFetcher, year : int, tile_range : TileRange, directory : str, levels : int = None, workers : int = 4) -> Mosaic:
+    """
+    Builds the mosaic of a tile range for a year: tiles come from the fetcher (cache first, then the server) and are decoded
+    and written by a pool of worker threads as they arrive, at most 2 * workers tiles in flight.
+
+    Args:
+        fetcher: The tile fetcher (see fetcher.py)
+        year: Year of the ortofoto
+        tile_range: The tiles of the mosaic
+        directory: Output directory of the canvases (level0.npy, level1.npy, ..., mosaic.json)
+        levels: Number of levels, overviews included (default: until the smallest one fits in 1024 px)
+        workers: Decoding threads
+
+    Returns:
+        The Mosaic, memory-mapped read-only
+    """
+    builder = MosaicBuilder(directory, tile_range, levels)
+    loop = asyncio.get_running_loop()
+
+    def write(x, y, data):
+        builder.add_tile(x, y, decode_tile(data))
+
+    pending = set()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        async for (_, x, y), data in fetcher.iter_tiles(year, tile_range):
+            if not data:
+                continue
+            pending.add(loop.run_in_executor(pool, write, x, y, data))
+            if len(pending) >= 2 * workers:  # backpressure: bounded number of decoded tiles in memory
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    future.result()
+        for future in await asyncio.gather(*pending, return_exceptions=True):
+            if isinstance(future, BaseException):
+                raise future
+    return builder.close()
@@ -0,0 +1,134 @@
+import os
+import sqlite3
+import threading
+from pathlib import Path
+
+from ..mpllry_graph.providers import load_env
+
+# Persistent tile cache: one MBTiles file per year (Ortofoto<year>.mbtiles), so every (year, z, x, y) tile is downloaded once,
+# across runs, mosaics and notebooks. The files follow the MBTiles 1.3 layout (TMS rows, y flipped), so they also open in QGIS.
+# Tiles the server does not have (404, outside the covered area) are remembered too, in a side table, and not requested again.
+
+DEFAULT_CACHE_DIR = str(Path.home() / ".cache" / "lg-vision" / "ortofoto")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS tiles (
+    zoom_level INTEGER NOT NULL,
+    tile_column INTEGER NOT NULL,
+    tile_row INTEGER NOT NULL,
+    tile_data BLOB NOT NULL,
+    PRIMARY KEY (zoom_level, tile_column, tile_row)
+);
+CREATE TABLE IF NOT EXISTS missing_tiles (
+    zoom_level INTEGER NOT NULL,
+    tile_column INTEGER NOT NULL,
+    tile_row INTEGER NOT NULL,
+    PRIMARY KEY (zoom_level, tile_column, tile_row)
+);
+"""
+
+MISSING = b""  # returned by TileCache.get for tiles known to be missing on the server (None: not cached)
+
+
+def default_cache_dir() -> str:
+    """The cache directory: ORTOFOTO_CACHE_DIR (environment or .env), or DEFAULT_CACHE_DIR"""
+    load_env()
+    return os.getenv("ORTOFOTO_CACHE_DIR", DEFAULT_CACHE_DIR)
+
+
+def _tms_row(z : int, y : int) -> int:
+    """XYZ row -> MBTiles (TMS) row, the transform is its own inverse"""
+    return (1 << z) - 1 - y
+
+
+class TileCache:
+    """
+    Tile cache keyed by (year, z, x, y), with XYZ coordinates. Safe to share between threads.
+    """
+
+    def __init__(self, cache_dir : str = None, tile_format : str = "png"):
+        self.cache_dir = Path(cache_dir or default_cache_dir())
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.tile_format = tile_format
+        self.hits = 0
+        self.misses = 0
+        self._conns = {}  # year -> sqlite3.Connection
+        self._lock = threading.Lock()
+
+    def path(self, year : int) -> Path:
+        return self.cache_dir / f"Ortofoto{year}.mbtiles"
+
+    def _conn(self, year : int) -> sqlite3.Connection:
+        if year not in self._conns:
+            conn = sqlite3.connect(self.path(year), check_same_thread=False)
+            conn.executescript(SCHEMA)
+            conn.execute("PRAGMA journal_mode=WAL")
+            with conn:
+                conn.executemany("INSERT OR IGNORE INTO metadata VALUES (?, ?)", [
+                    ("name", f"Ortofoto{year}"), ("format", self.tile_format), ("type", "baselayer"),
+                    ("description", f"Comune di Bologna ortofoto {year}, cached tiles"),
+                ])
+            self._conns[year] = conn
+        return self._conns[year]
+
+    def get(self, year : int, z : int, x : int, y : int):
+        """
+        Returns the tile bytes, MISSING if the server does not have the tile, or None if it is not cached
+        """
+        return self.get_many(year, [(z, x, y)]).get((z, x, y))
+
+    def get_many(self, year : int, tiles : list[tuple[int, int, int]]) -> dict:
+        """
+        Cached tiles among tiles = [(z, x, y)], in one pass per zoom level.
+
+        Returns:
+            {(z, x, y): bytes or MISSING}, without the tiles that are not cached
+        """
+        found = {}
+        by_zoom = {}
+        for z, x, y in tiles:
+            by_zoom.setdefault(z, []).append((x, y))
+        with self._lock:
+            conn = self._conn(year)
+            for z, coords in by_zoom.items():
+                xs, ys = [x for x, _ in coords], [y for _, y in coords]
+                # the range query is served by the primary key, the exact set is filtered here
+                bounds = (z, min(xs), max(xs), _tms_row(z, max(ys)), _tms_row(z, min(ys)))
+                wanted = set(coords)
+                for table, data in (("tiles", "tile_data"), ("missing_tiles", "NULL")):
+                    query = f"SELECT tile_column, tile_row, {data} FROM {table} WHERE zoom_level = ? AND tile_column BETWEEN ? AND ? AND tile_row BETWEEN ? AND ?"
+                    for x, row, tile_data in conn.execute(query, bounds):
+                        y = _tms_row(z, row)
+                        if (x, y) in wanted:
+                            found[(z, x, y)] = tile_data if tile_data is not None else MISSING
+        self.hits += len(found)
+        self.misses += len(tiles) - len(found)
+        return found
+
+    def put_many(self, year : int, tiles : dict) -> None:
+        """Stores {(z, x, y): bytes, or MISSING for a tile the server does not have} in one transaction"""
+        with self._lock:
+            conn = self._conn(year)
+            with conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?)",
+                    [(z, x, _tms_row(z, y), data) for (z, x, y), data in tiles.items() if data]
+                )
+                conn.executemany(
+                    "INSERT OR IGNORE INTO missing_tiles VALUES (?, ?, ?)",
+                    [(z, x, _tms_row(z, y)) for (z, x, y), data in tiles.items() if not data]
+                )
+
+    def put(self, year : int, z : int, x : int, y : int, data : bytes) -> None:
+        self.put_many(year, {(z, x, y): data})
+
+    def count(self, year : int) -> int:
+        with self._lock:
+            return self._conn(year).execute("SELECT COUNT(*) FROM tiles").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            for conn in self._conns.values():
+                conn.close()
+            self._conns = {}
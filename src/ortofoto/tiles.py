@@ -0,0 +1,79 @@
+import math
+from typing import Iterator
+
+# Slippy-map tile math (XYZ scheme: y grows southwards), as used by the Comune di Bologna tile server.
+
+TILE_SIZE = 256  # pixels
+
+
+def deg2float(lat_deg : float, lon_deg : float, zoom : int) -> tuple[float, float]:
+    """Convert lat/lon to fractional tile coordinates"""
+    lat_rad = math.radians(lat_deg)
+    n = 2.0 ** zoom
+    xtile = (lon_deg + 180.0) / 360.0 * n
+    ytile = (1.0 - math.asinh(math.tan(lat_rad)) / math.pi) / 2.0 * n
+    return xtile, ytile
+
+
+def deg2num(lat_deg : float, lon_deg : float, zoom : int) -> tuple[int, int]:
+    """Convert lat/lon to tile numbers"""
+    xtile, ytile = deg2float(lat_deg, lon_deg, zoom)
+    return int(xtile), int(ytile)
+
+
+def num2deg(xtile : float, ytile : float, zoom : int) -> tuple[float, float]:
+    """Convert tile numbers to lat/lon (of the north-west corner of the tile)"""
+    n = 2.0 ** zoom
+    lon_deg = xtile / n * 360.0 - 180.0
+    lat_rad = math.atan(math.sinh(math.pi * (1 - 2 * ytile / n)))
+    lat_deg = math.degrees(lat_rad)
+    return lat_deg, lon_deg
+
+
+class TileRange:
+    """Rectangle of tiles [x_min, x_max] x [y_min, y_max] (inclusive) at one zoom level"""
+
+    def __init__(self, zoom : int, x_min : int, x_max : int, y_min : int, y_max : int):
+        self.zoom = zoom
+        self.x_min, self.x_max = x_min, x_max
+        self.y_min, self.y_max = y_min, y_max
+
+    @classmethod
+    def around(cls, lat : float, lon : float, zoom : int, tile_radius : int) -> "TileRange":
+        """The (2 * tile_radius + 1)^2 tiles centered on the tile of (lat, lon), like the notebook's create_ortofoto_image"""
+        x, y = deg2num(lat, lon, zoom)
+        return cls(zoom, x - tile_radius, x + tile_radius, y - tile_radius, y + tile_radius)
+
+    @classmethod
+    def from_bbox(cls, bbox : list[float], zoom : int) -> "TileRange":
+        """The tiles covering bbox = [lon_min, lat_min, lon_max, lat_max]"""
+        lon_min, lat_min, lon_max, lat_max = bbox
+        x_min, y_min = deg2num(lat_max, lon_min, zoom)  # north-west corner
+        x_max, y_max = deg2float(lat_min, lon_max, zoom)  # south-east corner: a bbox ending on a tile border does not take the next tile
+        return cls(zoom, x_min, max(x_min, math.ceil(x_max - 1e-9) - 1), y_min, max(y_min, math.ceil(y_max - 1e-9) - 1))
+
+    @property
+    def width(self) -> int:
+        return self.x_max - self.x_min + 1
+
+    @property
+    def height(self) -> int:
+        return self.y_max - self.y_min + 1
+
+    def __len__(self) -> int:
+        return self.width * self.height
+
+    def __iter__(self) -> Iterator[tuple[int, int, int]]:
+        """(z, x, y) of every tile, row by row"""
+        for y in range(self.y_min, self.y_max + 1):
+            for x in range(self.x_min, self.x_max + 1):
+                yield self.zoom, x, y
+
+    def bbox(self) -> list[float]:
+        """[lon_min, lat_min, lon_max, lat_max] covered by the tiles"""
+        lat_max, lon_min = num2deg(self.x_min, self.y_min, self.zoom)
+        lat_min, lon_max = num2deg(self.x_max + 1, self.y_max + 1, self.zoom)
+        return [lon_min, lat_min, lon_max, lat_max]
+
+    def __repr__(self) -> str:
+        return f"TileRange(zoom={self.zoom}, x={self.x_min}..{self.x_max}, y={self.y_min}..{self.y_max})"
@@ -0,0 +1 @@
+# Street View grading: sampling grids (grid.py), the map-reduce grading graph (make_graph.py) and its results store (results_store.py)
@@ -0,0 +1,272 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+
+import numpy as np
+from pydantic import BaseModel
+
+from ..mpllry_graph.providers import load_env
+from ..mpllry_graph.downloader import AsyncDownloader
+
+# Street View sample grids: points on a regular grid around a center, times headings, times layers (camera pitch).
+# Everything is computed on NumPy / Arrow columns, so a city-scale grid (millions of views) takes seconds,
+# and points without coverage are dropped with the free metadata endpoint before any (paid) image request.
+
+DEFAULT_STREETVIEW_URL = "https://maps.googleapis.com/maps/api/streetview"
+METERS_PER_DEGREE = 111_000  # rough, like the sampler of notebooks/pipeline.ipynb
+
+NO_COVERAGE_STATUSES = {"ZERO_RESULTS", "NOT_FOUND"}  # metadata statuses of points without a panorama
+FATAL_STATUSES = {"REQUEST_DENIED", "INVALID_REQUEST", "OVER_QUERY_LIMIT"}  # bad or over quota key: no point would pass
+
+LAYER_PITCHES = {"ground": -45, "horizon": 0, "sky": 45}
+GRID_COLUMNS = ["point_id", "lat", "lon", "layer", "heading", "pitch", "fov", "size", "url_template"]
+
+
+class GridConfig(BaseModel):
+    """Sampling grid: points every `spacing_m` meters within `radius_m` of the center, and the views of each point"""
+    center_lat: float = 44.4949  # Piazza Maggiore, Bologna
+    center_lon: float = 11.3426
+    radius_m: float = 1000
+    spacing_m: float = 50
+    headings: list[int] = [0, 90, 180, 270]
+    layers: list[str] = ["ground", "horizon", "sky"]
+    single_sky_heading: bool = True  # the sky looks the same from every direction: one view per point
+    fov: int = 90
+    size: str = "640x640"
+
+
+def api_key() -> str:
+    """The Street View API key, from GOOGLE_MAPS_API_KEY (or GOOGLE_API_KEY, as in the notebooks)"""
+    load_env()
+    key = os.getenv("GOOGLE_MAPS_API_KEY") or os.getenv("GOOGLE_API_KEY")
+    if not key:
+        raise EnvironmentError("no GOOGLE_MAPS_API_KEY in environment!")
+    return key
+
+
+def streetview_url() -> str:
+    """The Street View endpoint: STREETVIEW_URL (environment or .env, e.g. to point to a local stub), or Google's"""
+    load_env()
+    return os.getenv("STREETVIEW_URL", DEFAULT_STREETVIEW_URL)
+
+
+def grid_points(config : GridConfig) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Points of a square grid with `spacing_m` step, clipped to the circle of radius `radius_m` around the center.
+
+    Returns:
+        (lat, lon) arrays
+    """
+    steps = np.arange(-config.radius_m, config.radius_m + config.spacing_m / 2, config.spacing_m)
+    north, east = np.meshgrid(steps, steps, indexing="ij")
+    inside = north ** 2 + east ** 2 <= config.radius_m ** 2
+    north, east = north[inside], east[inside]
+
+    lat = config.center_lat + north / METERS_PER_DEGREE
+    lon = config.center_lon + east / (METERS_PER_DEGREE * np.cos(np.radians(config.center_lat)))
+    return lat, lon
+
+
+def view_offsets(config : GridConfig) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    The views taken at every point, in the order of notebooks/streetview_samples.csv (by heading, then by layer).
+
+    Returns:
+        (layer, heading, pitch) arrays, one entry per view
+    """
+    views = [
+        (layer, heading, LAYER_PITCHES[layer])
+        for i, heading in enumerate(config.headings)
+        for layer in config.layers
+        if not (layer == "sky" and config.single_sky_heading and i > 0)
+    ]
+    layers, headings, pitches = zip(*views)
+    return np.array(layers), np.array(headings, dtype=np.int16), np.array(pitches, dtype=np.int8)
+
+
+def _grid_batch(config : GridConfig, lat : np.ndarray, lon : np.ndarray, point_id : np.ndarray):
+    """Sample rows of a chunk of points: point columns repeated, view columns tiled, url templates joined by Arrow kernels"""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    layers, headings, pitches = view_offsets(config)
+    n_points, n_views = len(lat), len(layers)
+
+    # rows: point-major, views inner
+    rows_lat = pa.array(np.repeat(lat, n_views))
+    rows_lon = pa.array(np.repeat(lon, n_views))
+    rows_heading = pa.array(np.tile(headings, n_points))
+    rows_pitch = pa.array(np.tile(pitches, n_points))
+    # layer and size: dictionary encoded (few distinct values), compact in memory and in the Parquet file
+    rows_layer = pa.DictionaryArray.from_arrays(pa.array(np.tile(np.arange(n_views, dtype=np.int8), n_points)), pa.array(layers))
+    rows_size = pa.DictionaryArray.from_arrays(pa.array(np.zeros(n_points * n_views, dtype=np.int8)), pa.array([config.size]))
+
+    url_template = pc.binary_join_element_wise(
+        f"{streetview_url()}?size={config.size}&location=", pc.cast(rows_lat, pa.string()), ",", pc.cast(rows_lon, pa.string()),
+        "&heading=", pc.cast(rows_heading, pa.string()), "&pitch=", pc.cast(rows_pitch, pa.string()),
+        f"&fov={config.fov}&key={{API_KEY}}", ""
+    )
+
+    return pa.record_batch([
+        pa.array(np.repeat(point_id, n_views)), rows_lat, rows_lon, rows_layer, rows_heading, rows_pitch,
+        pa.array(np.full(n_points * n_views, config.fov, dtype=np.int16)), rows_size, url_template,
+    ], names=GRID_COLUMNS)
+
+
+def iter_grid(config : GridConfig, lat : np.ndarray = None, lon : np.ndarray = None, point_id : np.ndarray = None, points_per_batch : int = 100_000):
+    """
+    Expands points x views into the sample table (columns GRID_COLUMNS), one Arrow record batch per `points_per_batch` points,
+    without a python loop per row. Batches keep the memory bounded (and every string column under Arrow's 2 GB per array)
+    for grids of tens of millions of views.
+    The url templates hold a `{API_KEY}` placeholder, filled in at download time.
+
+    Args:
+        config: The grid configuration
+        lat, lon: The points, e.g. the ones with coverage (default: every point of the grid)
+        point_id: Ids of the points (default: their index)
+        points_per_batch: Points per record batch
+
+    Yields:
+        pyarrow RecordBatch
+    """
+    if lat is None or lon is None:
+        lat, lon = grid_points(config)
+    if point_id is None:
+        point_id = np.arange(len(lat))
+    for start in range(0, len(lat), points_per_batch):
+        end = start + points_per_batch
+        yield _grid_batch(config, lat[start:end], lon[start:end], point_id[start:end])
+
+
+def build_grid(config : GridConfig, lat : np.ndarray = None, lon : np.ndarray = None, point_id : np.ndarray = None):
+    """The whole sample table in memory, as a pyarrow Table (see iter_grid)"""
+    import pyarrow as pa
+    return pa.Table.from_batches(list(iter_grid(config, lat, lon, point_id)))
+
+
+async def check_coverage(
+    lat : np.ndarray,
+    lon : np.ndarray,
+    key : str,
+    downloader : AsyncDownloader = None,
+    batch_size : int = 500,
+    dedupe_panos : bool = True,
+) -> np.ndarray:
+    """
+    Queries the Street View metadata endpoint (free, no image quota) for every point, concurrently in batches,
+    and tells which points are worth an image request: points with a panorama, and (if dedupe_panos) only the first point
+    snapping to each panorama, since two points on the same panorama get the same images.
+    Points without a panorama (ZERO_RESULTS, NOT_FOUND) are dropped. Points whose metadata request fails after
+    the downloader's retries, or answers something else than JSON, are dropped too, and counted.
+
+    Returns:
+        Boolean mask over the points
+
+    Raises:
+        RuntimeError: the endpoint rejects the key or the requests (REQUEST_DENIED, INVALID_REQUEST, OVER_QUERY_LIMIT):
+            every point would be dropped, which is not a coverage result
+    """
+    downloader = downloader or AsyncDownloader(per_host=32)
+    base_url = streetview_url()
+    keep = np.zeros(len(lat), dtype=bool)
+    seen_panos = set()
+    failed = 0
+    for start in range(0, len(lat), batch_size):
+        batch = range(start, min(start + batch_size, len(lat)))
+        urls = [f"{base_url}/metadata?location={lat[i]},{lon[i]}&key={key}" for i in batch]
+        responses = await downloader.fetch_many(urls)
+        for i, response in zip(batch, responses):
+            if isinstance(response, Exception):
+                failed += 1
+                continue
+            try:
+                data = json.loads(response)
+            except ValueError:  # e.g. an HTML error page of a proxy
+                failed += 1
+                continue
+            status = data.get("status")
+            if status in FATAL_STATUSES:
+                raise RuntimeError(f"Street View metadata request rejected: {status} {data.get('error_message', '')}".strip())
+            if status in NO_COVERAGE_STATUSES:
+                continue
+            if status != "OK":  # UNKNOWN_ERROR (transient on Google's side) or unexpected
+                failed += 1
+                continue
+            pano_id = data.get("pano_id")
+            if dedupe_panos and pano_id is not None:
+                if pano_id in seen_panos:
+                    continue
+                seen_panos.add(pano_id)
+            keep[i] = True
+        print(f"Coverage: {start + len(batch)}/{len(lat)} points checked, {int(keep.sum())} kept, {failed} failed")
+    return keep
+
+
+def write_grid(batches, path : str) -> int:
+    """
+    Writes the sample table (a pyarrow Table or an iterable of record batches, see iter_grid) to Parquet, batch by batch,
+    or to CSV if path ends with .csv (the format of notebooks/streetview_samples.csv).
+
+    Returns:
+        The number of rows written
+    """
+    import pyarrow as pa
+    import pyarrow.csv as pcsv
+    import pyarrow.parquet as pq
+
+    if isinstance(batches, pa.Table):
+        batches = batches.to_batches()
+    rows = 0
+    writer = None
+    try:
+        for batch in batches:
+            if str(path).endswith(".csv"):
+                batch = batch.cast(pa.schema([(f.name, pa.string() if pa.types.is_dictionary(f.type) else f.type) for f in batch.schema]))
+                writer = writer or pcsv.CSVWriter(path, batch.schema)
+            else:
+                writer = writer or pq.ParquetWriter(path, batch.schema, compression="zstd")
+            writer.write_batch(batch)
+            rows += batch.num_rows
+    finally:
+        if writer is not None:
+            writer.close()
+    print(f"Saved {rows} views to {path}")
+    return rows
+
+
+async def main(args):
+    config = GridConfig(
+        center_lat=args.center[0], center_lon=args.center[1], radius_m=args.radius, spacing_m=args.spacing,
+        layers=args.layers.split(","),
+    )
+    start = time.perf_counter()
+    lat, lon = grid_points(config)
+    point_id = np.arange(len(lat))
+    print(f"{len(lat)} grid points, {len(lat) * len(view_offsets(config)[0])} views")
+
+    if args.check_coverage:
+        async with AsyncDownloader(per_host=args.concurrency) as downloader:
+            keep = await check_coverage(lat, lon, api_key(), downloader)
+        lat, lon, point_id = lat[keep], lon[keep], point_id[keep]  # point ids stay the ones of the full grid
+
+    write_grid(iter_grid(config, lat, lon, point_id), args.output)
+    print(f"Done in {time.perf_counter() - start:.1f}s")
+
+
+def _lat_lon(value : str) -> tuple[float, float]:
+    lat, lon = value.split(",")
+    return float(lat), float(lon)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a Street View sample grid (points x headings x layers)")
+    parser.add_argument("--center", type=_lat_lon, default=(44.4949, 11.3426), help="lat,lon of the center")
+    parser.add_argument("--radius", type=float, default=1000, help="radius of the grid, in meters")
+    parser.add_argument("--spacing", type=float, default=50, help="distance between grid points, in meters")
+    parser.add_argument("--layers", default="ground,horizon,sky", help="comma-separated layers, among ground,horizon,sky")
+    parser.add_argument("--check-coverage", action="store_true", help="drop the points without a panorama (free metadata requests)")
+    parser.add_argument("--concurrency", type=int, default=32, help="metadata requests in flight")
+    parser.add_argument("--output", default="streetview_grid.parquet", help="Parquet (or .csv) output file")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,111 @@
+import argparse
+import asyncio
+import csv
+import time
+import uuid
+from pathlib import Path
+
+from .make_graph import get_graph, get_grading_agent, get_downloader
+from .results_store import GradeStore
+from ..mpllry_graph.image_cache import url_key
+
+DEFAULT_CSV = Path(__file__).resolve().parents[2] / "notebooks" / "streetview_samples.csv"
+
+
+def _read_rows(path : str):
+    """Rows (point_id, layer, url_template) of a samples CSV or of a Parquet grid"""
+    if str(path).endswith(".parquet"):
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(columns=["point_id", "layer", "url_template"]):
+            for point_id, layer, url in zip(*(column.to_pylist() for column in batch.columns)):
+                yield {"point_id": str(point_id), "layer": layer, "url_template": url}
+    else:
+        with open(path, newline="") as f:
+            yield from csv.DictReader(f)
+
+
+def load_streetviews(path : str, layers : list[str], limit : int = None) -> dict:
+    """
+    Reads a Street View sample grid into the `streetviews` state key: {point_id: {layer: [urls]}},
+    keeping the url templates (the API key is filled in at download time).
+
+    Args:
+        path: Samples CSV (see notebooks/streetview_samples.csv) or Parquet grid (see grid.py)
+        layers: Layers to grade, among horizon / ground / sky
+        limit: Keep only the first `limit` points
+    """
+    streetviews = {}
+    for row in _read_rows(path):
+        if row["layer"] not in layers:
+            continue
+        if row["point_id"] not in streetviews and limit is not None:
+            if len(streetviews) >= limit:
+                break  # rows are grouped by point
+        streetviews.setdefault(row["point_id"], {}).setdefault(row["layer"], []).append(row["url_template"])
+    return streetviews
+
+
+def skip_graded(streetviews : dict, graded : set) -> dict:
+    """Drops the images already graded in this run (resume), and the points and layers left with no image"""
+    remaining = {}
+    for point_id, layers in streetviews.items():
+        for layer, urls in layers.items():
+            urls = [url for url in urls if (point_id, layer, url_key(url)) not in graded]
+            if urls:
+                remaining.setdefault(point_id, {})[layer] = urls
+    return remaining
+
+
+def export_grades(store : GradeStore, layers : list[str], output : str) -> None:
+    """
+    Writes the grades of every point in the store (all runs) to a CSV file, from the running aggregates:
+    mean grade per layer, then count, mean and standard deviation over all the layers (empty cells: no grade yet)
+    """
+    layer_stats = store.layer_stats()
+    with open(output, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["point_id", *layers, "count", "mean", "std"])
+        for point_id, point in store.point_stats().items():
+            means = [layer_stats[point_id].get(layer, {}).get("mean", "") for layer in layers]
+            writer.writerow([point_id, *means, point["count"], point["mean"], point["std"]])
+    print(f"Grades saved to {output}")
+
+
+async def main(args):
+    layers = args.layers.split(",")
+    run_id = args.run_id or str(uuid.uuid4())[:8]
+    store = GradeStore(args.db, run_id)  # grades are appended as the tasks complete: restarting with the same run id skips them
+    print(f"Run id: {run_id} (resume with --run-id {run_id})")
+
+    streetviews = skip_graded(load_streetviews(args.csv, layers, args.limit), store.graded_images())
+    print(f"Grading {len(streetviews)} points ({', '.join(layers)}), up to {args.max_concurrency} tasks in parallel")
+
+    get_grading_agent()  # build the agent once, before the tasks start
+    graph = get_graph(store=store)
+
+    start = time.perf_counter()
+    result = await graph.ainvoke({"streetviews": streetviews}, config={"max_concurrency": args.max_concurrency})
+    elapsed = time.perf_counter() - start
+
+    graded = sum(r["count"] for layers_ in result.get("results", {}).values() for r in layers_.values())
+    failed = sum(r["failed"] for layers_ in result.get("results", {}).values() for r in layers_.values())
+    print(f"Graded {graded} images in {elapsed:.1f}s ({failed} failed)")
+    cache, downloader = get_downloader()
+    print(f"Downloads: {downloader.stats()}, cache hits: {cache.hits}, misses: {cache.misses}")
+    await downloader.aclose()
+
+    if args.output:
+        export_grades(store, layers, args.output)
+    store.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Grade Street View points with a vision model, one parallel task per point and layer")
+    parser.add_argument("--csv", default=str(DEFAULT_CSV), help="Street View samples, CSV (see notebooks/streetview_samples.csv) or Parquet grid (see grid.py)")
+    parser.add_argument("--layers", default="horizon", help="comma-separated layers to grade, among horizon,ground,sky")
+    parser.add_argument("--max-concurrency", type=int, default=16, help="grading tasks in flight at the same time")
+    parser.add_argument("--limit", type=int, help="grade only the first N points")
+    parser.add_argument("--db", default="streetview_results.sqlite", help="SQLite store of the grades and of their running aggregates")
+    parser.add_argument("--run-id", help="resume a previous run: its images already graded are skipped")
+    parser.add_argument("--output", default="streetview_grades.csv", help="also export the grades of every point in the store to this CSV file")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,139 @@
+from langgraph.graph import END, START, StateGraph
+from langgraph.types import Send
+from langchain.agents import create_agent
+from langchain_core.messages import HumanMessage
+from pydantic import BaseModel, Field
+import asyncio
+from functools import cache
+
+from .state import StreetViewState, LayerTask, mean_grades
+from .prompts.grading_prompt import grading_prompt, layer_prompts
+from .grid import api_key
+from .results_store import GradeStore
+from ..multimodal_graph.models import get_multimodal_model
+from ..multimodal_graph.utils import prepare_multimodal_message
+from ..mpllry_graph.image_store import IMAGE_STORE
+from ..mpllry_graph.image_cache import ImageCache, afetch_url_cached, url_key
+from ..mpllry_graph.downloader import AsyncDownloader
+from ..mpllry_graph.providers import load_env
+
+
+class GradeOutput(BaseModel):
+    """
+    Grade given to the scene
+    """
+    grade : int = Field(description="The grade from 1 to 10 that the agent gave to the scene")
+    description : str = Field(description="A description of the scene")
+
+
+@cache
+def get_grading_agent():
+    """The grading agent, built on first use (then cached), so that importing this module or building the graph stays cheap"""
+    return create_agent(
+        model=get_multimodal_model(),
+        tools=[],
+        system_prompt=grading_prompt,
+        response_format=GradeOutput  # result["structured_response"] is a GradeOutput
+    )
+
+
+@cache
+def get_downloader() -> tuple[ImageCache, AsyncDownloader]:
+    """Image cache and async http client shared by all the grading tasks (keep-alive connections, per-host cap, retries)"""
+    load_env()  # LG_VISION_CACHE_DIR may come from .env
+    return ImageCache(), AsyncDownloader(per_host=16)
+
+
+def fan_out(state : StreetViewState) -> list[Send]:
+    """
+    Map step: one grading task per point and layer, all run in parallel (up to `max_concurrency` of the run config),
+    so a slow or failing point does not hold back the others
+    """
+    return [
+        Send("grade_layer", {"point_id": point_id, "layer": layer, "urls": urls})
+        for point_id, layers in state.get("streetviews", {}).items()
+        for layer, urls in layers.items()
+        if urls
+    ]
+
+
+async def grade_image(url : str, layer : str) -> GradeOutput:
+    """Downloads one Street View image (through the shared cache) and grades it"""
+    cache, downloader = get_downloader()
+    if "{API_KEY}" in url:  # urls are stored without credentials, see notebooks/streetview_samples.csv
+        url = url.replace("{API_KEY}", api_key())
+    img_bytes = await afetch_url_cached(url, downloader, cache)  # awaited: the downloads of every task overlap
+
+    ref = IMAGE_STORE.put(img_bytes)
+    try:
+        message = prepare_multimodal_message({"messages": [HumanMessage(layer_prompts[layer])]}, [ref])
+    finally:
+        IMAGE_STORE.release(ref)  # the message holds its own base64 copy
+    result = await get_grading_agent().ainvoke({"messages": [message]})
+    return result["structured_response"]
+
+
+def describe_error(error : BaseException) -> str:
+    """
+    Error type and HTTP status, if any, without the message: the message of an HTTP error holds the request url,
+    and with it the Street View key
+    """
+    response = getattr(error, "response", None)
+    status = getattr(response, "status_code", None)
+    return f"{type(error).__name__} {status}" if status is not None else type(error).__name__
+
+
+def make_grade_layer_node(store : GradeStore = None):
+    """
+    Builds the map node. If a store is given, the grades of every task are appended to it as soon as the task is done
+    (crash-safe, no rewrite of previous results), updating the running aggregates of the point and layer.
+    """
+
+    async def grade_layer(task : LayerTask) -> dict:
+        """
+        Grades the images of one layer of one point concurrently. Errors are counted, not raised:
+        an exception would fail the whole superstep, i.e. every other point of the run.
+
+        Returns:
+            A partial `results` update, summed into the state by the `add_dict` reducer
+        """
+        outcomes = await asyncio.gather(*(grade_image(url, task["layer"]) for url in task["urls"]), return_exceptions=True)
+
+        entry = {"grade_sum": 0, "count": 0, "failed": 0, "records": []}
+        for url, outcome in zip(task["urls"], outcomes):
+            if isinstance(outcome, BaseException):
+                print(f"Failed to grade an image of {task['point_id']} ({task['layer']}): {describe_error(outcome)}")
+                entry["failed"] += 1
+                continue
+            entry["grade_sum"] += outcome.grade
+            entry["count"] += 1
+            entry["records"].append({"image": url_key(url), "grade": outcome.grade, "description": outcome.description})
+
+        if store is not None and entry["records"]:
+            await asyncio.to_thread(store.add_grades, task["point_id"], task["layer"], entry["records"])
+        return {"results": {task["point_id"]: {task["layer"]: entry}}}
+
+    return grade_layer
+
+
+def aggregate(state : StreetViewState) -> dict:
+    """Reduce step: per-point mean grades, once every task is done"""
+    return {"grades": mean_grades(state.get("results", {}))}
+
+
+def get_graph(checkpointer=None, store : GradeStore = None) -> StateGraph:
+    """
+    Get the map-reduce grading graph: START -> grade_layer (one task per point and layer) -> aggregate -> END.
+    Run it with config={"max_concurrency": k} to cap the number of tasks in flight.
+    If a store is given, the grades are persisted as the tasks complete (see results_store.py).
+    """
+    builder = StateGraph(StreetViewState)
+    # nodes
+    builder.add_node("grade_layer", make_grade_layer_node(store))
+    builder.add_node("aggregate", aggregate)
+    # edges
+    builder.add_conditional_edges(START, fan_out, ["grade_layer"])
+    builder.add_edge("grade_layer", "aggregate")
+    builder.add_edge("aggregate", END)
+
+    return builder.compile(checkpointer=checkpointer)
@@ -0,0 +1,22 @@
+grading_prompt = """
+You are a helpful AI assistant specialized in the analysis of Google Street View images.
+The images you will be shown are from the city of Bologna, Italy.
+You will grade each scene from 1 (worst) to 10 (best) following the criteria given with the image, 
+and describe the scene in one or two sentences, mentioning the elements that drove your grade.
+"""
+
+# grading criteria by layer (camera pitch): horizon = facades and street, ground = street surface, sky = openness of the view
+layer_prompts = {
+    "horizon": (
+        "Analyze this Street View horizon image and grade the scene from 1 to 10. "
+        "Consider urban quality, cleanliness, architectural appeal, and overall visual pleasantness."
+    ),
+    "ground": (
+        "Analyze this Street View image of the ground and grade it from 1 to 10. "
+        "Consider the condition and cleanliness of the pavement and sidewalks, litter, and accessibility for pedestrians."
+    ),
+    "sky": (
+        "Analyze this Street View image of the sky and grade the scene from 1 to 10. "
+        "Consider the openness of the view, visible greenery, and the presence of wires, scaffolding or other clutter."
+    ),
+}
@@ -0,0 +1,148 @@
+import math
+import sqlite3
+import threading
+import time
+
+# Append-only store of the Street View grades, with running aggregates per point and layer.
+# Every grade is appended once (re-grading the same image in the same run is a no-op), and the count, mean and
+# variance of its point and layer are updated in the same transaction, so aggregate queries never rescan the grades
+# and concurrent workers (WAL mode, one transaction per task) never overwrite each other's results.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS grades (
+    run_id TEXT NOT NULL,
+    point_id TEXT NOT NULL,
+    layer TEXT NOT NULL,
+    image TEXT NOT NULL,
+    grade REAL NOT NULL,
+    description TEXT,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (run_id, point_id, layer, image)
+);
+CREATE INDEX IF NOT EXISTS grades_point_layer ON grades (point_id, layer);
+CREATE TABLE IF NOT EXISTS aggregates (
+    point_id TEXT NOT NULL,
+    layer TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    mean REAL NOT NULL,
+    m2 REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (point_id, layer)
+);
+"""
+
+# Chan et al. parallel update: merges the (count, mean, m2) of a batch of new grades (excluded.*) into the stored ones.
+# m2 is the sum of squared deviations from the mean (Welford), variance = m2 / (count - 1)
+MERGE_AGGREGATE = """
+INSERT INTO aggregates (point_id, layer, count, mean, m2, updated_at) VALUES (?, ?, ?, ?, ?, ?)
+ON CONFLICT (point_id, layer) DO UPDATE SET
+    mean = mean + (excluded.mean - mean) * excluded.count / (count + excluded.count),
+    m2 = m2 + excluded.m2 + (excluded.mean - mean) * (excluded.mean - mean) * count * excluded.count / (count + excluded.count),
+    count = count + excluded.count,
+    updated_at = excluded.updated_at
+"""
+
+
+def _moments(values : list[float]) -> tuple[int, float, float]:
+    """(count, mean, m2) of values, with Welford's algorithm"""
+    count, mean, m2 = 0, 0.0, 0.0
+    for x in values:
+        count += 1
+        delta = x - mean
+        mean += delta / count
+        m2 += delta * (x - mean)
+    return count, mean, m2
+
+
+def _merge(a : tuple[int, float, float], b : tuple[int, float, float]) -> tuple[int, float, float]:
+    """Merges two (count, mean, m2) triples, like MERGE_AGGREGATE"""
+    (n_a, mean_a, m2_a), (n_b, mean_b, m2_b) = a, b
+    n = n_a + n_b
+    if n == 0:
+        return 0, 0.0, 0.0
+    delta = mean_b - mean_a
+    return n, mean_a + delta * n_b / n, m2_a + m2_b + delta * delta * n_a * n_b / n
+
+
+def _summary(count : int, mean : float, m2 : float) -> dict:
+    variance = m2 / (count - 1) if count > 1 else 0.0
+    return {"count": count, "mean": mean, "variance": variance, "std": math.sqrt(variance)}
+
+
+class GradeStore:
+    """
+    Grades of a run, stored in SQLite next to the running aggregates of every run (see SCHEMA).
+    Safe to share between the tasks of a graph: writes are serialized by a lock and committed one batch at a time.
+    """
+
+    def __init__(self, db_path : str, run_id : str):
+        self.run_id = run_id
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)  # used from worker threads (asyncio.to_thread)
+        self.conn.executescript(SCHEMA)
+        self.conn.execute("PRAGMA journal_mode=WAL")  # cheap commits, readers do not block the writers
+        self.conn.execute("PRAGMA busy_timeout=30000")  # other processes writing to the same store: wait, do not fail
+        self._lock = threading.Lock()
+
+    def add_grades(self, point_id : str, layer : str, records : list[dict]) -> int:
+        """
+        Appends the grades of one point and layer ({"image", "grade", "description"} records) and folds the new ones
+        into the running aggregate of the point and layer, in one transaction.
+
+        Returns:
+            The number of grades added (grades of images already graded in this run are ignored)
+        """
+        now = time.time()
+        with self._lock, self.conn:
+            added = []
+            for record in records:
+                cursor = self.conn.execute(
+                    "INSERT OR IGNORE INTO grades VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (self.run_id, point_id, layer, record["image"], record["grade"], record.get("description"), now)
+                )
+                if cursor.rowcount:
+                    added.append(record["grade"])
+            if added:
+                count, mean, m2 = _moments(added)
+                self.conn.execute(MERGE_AGGREGATE, (point_id, layer, count, mean, m2, now))
+        return len(added)
+
+    def graded_images(self) -> set[tuple[str, str, str]]:
+        """(point_id, layer, image) of the images already graded in this run, to skip them on resume"""
+        with self._lock:
+            rows = self.conn.execute("SELECT point_id, layer, image FROM grades WHERE run_id = ?", (self.run_id,)).fetchall()
+        return set(rows)
+
+    def layer_stats(self, point_id : str = None) -> dict:
+        """
+        Count, mean, variance and standard deviation of the grades of each point and layer (all runs), read from the aggregates.
+
+        Returns:
+            {point_id: {layer: {"count", "mean", "variance", "std"}}}
+        """
+        query, params = "SELECT point_id, layer, count, mean, m2 FROM aggregates", ()
+        if point_id is not None:
+            query, params = query + " WHERE point_id = ?", (point_id,)
+        stats = {}
+        with self._lock:
+            rows = self.conn.execute(query, params).fetchall()
+        for point, layer, count, mean, m2 in rows:
+            stats.setdefault(point, {})[layer] = _summary(count, mean, m2)
+        return stats
+
+    def point_stats(self) -> dict:
+        """
+        Count, mean, variance and standard deviation of the grades of each point over all its layers,
+        merged from the per-layer aggregates.
+
+        Returns:
+            {point_id: {"count", "mean", "variance", "std"}}
+        """
+        merged = {}
+        with self._lock:
+            rows = self.conn.execute("SELECT point_id, count, mean, m2 FROM aggregates").fetchall()
+        for point, count, mean, m2 in rows:
+            merged[point] = _merge(merged.get(point, (0, 0.0, 0.0)), (count, mean, m2))
+        return {point: _summary(*moments) for point, moments in merged.items()}
+
+    def close(self) -> None:
+        self.conn.close()
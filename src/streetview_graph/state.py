@@ -0,0 +1,75 @@
+from typing import Union
+from typing_extensions import Annotated, TypedDict
+
+
+def add_dict(left : Union[dict, None], right : Union[dict, None]) -> dict:
+    """
+    Reducer to combine two nested dictionaries. Used for streetview urls and grades.
+    Nested dictionaries are merged recursively, lists are concatenated and numbers are summed,
+    so the partial results of parallel tasks add up instead of overwriting each other.
+
+    The streetview urls dictionary is of the form:
+    {
+        "point_id" : {
+            "horizon" : [urls],
+            "ground" : [urls],
+            "sky" : [url]  # (unique url)
+        }
+    }
+
+    The results dictionary is of the form (see `mean_grades`):
+    {
+        "point_id" : {
+            "horizon" : {"grade_sum" : float, "count" : int, "failed" : int, "records" : [{"image", "grade", "description"}]},
+            ...
+        }
+    }
+    """
+    if left is None:  # init left dict
+        left = {}
+
+    if right is None:   # init right dict
+        right = {}
+
+    merged = dict(left)
+    for key, value in right.items():
+        if key not in merged:
+            merged[key] = value
+        elif isinstance(value, dict) and isinstance(merged[key], dict):
+            merged[key] = add_dict(merged[key], value)
+        elif isinstance(value, list) and isinstance(merged[key], list):
+            merged[key] = merged[key] + value
+        elif isinstance(value, (int, float)) and isinstance(merged[key], (int, float)) and not isinstance(value, bool):
+            merged[key] = merged[key] + value
+        else:
+            merged[key] = value  # anything else: right wins
+    return merged
+
+
+def mean_grades(results : dict) -> dict:
+    """
+    Reduces the results to mean grades: {point_id: {layer: mean grade, ..., "mean": mean over all the graded images}}.
+    Layers whose images all failed are left out.
+    """
+    grades = {}
+    for point_id, layers in results.items():
+        point = {layer: r["grade_sum"] / r["count"] for layer, r in layers.items() if r.get("count")}
+        total = sum(r.get("count", 0) for r in layers.values())
+        if total:
+            point["mean"] = sum(r.get("grade_sum", 0) for r in layers.values()) / total
+        grades[point_id] = point
+    return grades
+
+
+class StreetViewState(TypedDict):
+    """State of the Street View grading graph"""
+    streetviews : Annotated[dict[str, dict[str, list[str]]], add_dict]
+    results : Annotated[dict[str, dict[str, dict]], add_dict]
+    grades : dict[str, dict[str, float]]  # per-point mean grades, written once all the points are graded
+
+
+class LayerTask(TypedDict):
+    """Input of a single fan-out task: the images of one layer of one point"""
+    point_id : str
+    layer : str
+    urls : list[str]
@@ -0,0 +1,47 @@
+import asyncio
+import io
+import sys
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src" / "mpllry_graph"))  # the mpllry_graph modules import each other as top level modules
+
+import make_graph
+from batch import evaluate_image
+from prefilter import PrefilterConfig
+from langchain_core.messages import AIMessage, HumanMessage
+
+
+class UsagelessAgent:
+    """An agent whose provider reports no token usage"""
+
+    async def ainvoke(self, state):
+        verdict = make_graph.BinaryOutput(response="yes", reason="a street", confidence=0.9)
+        return {"messages": [AIMessage("yes")], "structured_response": verdict}
+
+
+def _jpeg(pixels : np.ndarray) -> bytes:
+    out = io.BytesIO()
+    Image.fromarray(pixels).save(out, "JPEG")
+    return out.getvalue()
+
+
+def _evaluate(monkeypatch, img_bytes : bytes):
+    monkeypatch.setattr(make_graph, "get_mpllry_agent", lambda: UsagelessAgent())
+    graph = make_graph.get_graph(prefilter_config=PrefilterConfig())
+    return asyncio.run(evaluate_image(graph, HumanMessage("Keep only images of streets"), "img", img_bytes))
+
+
+def test_prefilter_reject_is_labelled(monkeypatch):
+    record = _evaluate(monkeypatch, _jpeg(np.full((64, 64, 3), 128, dtype=np.uint8)))  # flat grey: no contrast
+    assert record.response == "no"
+    assert record.model == "prefilter"
+
+
+def test_model_verdict_without_usage_is_not_labelled_prefilter(monkeypatch):
+    sky_to_street = np.linspace(220, 40, 64)[:, None, None] + np.random.default_rng(0).normal(0, 20, (64, 64, 3))
+    record = _evaluate(monkeypatch, _jpeg(np.clip(sky_to_street, 0, 255).astype(np.uint8)))
+    assert record.response == "yes"
+    assert record.model is None
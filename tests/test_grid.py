@@ -0,0 +1,40 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from stubs import StubServer
+from src.streetview_graph.grid import GridConfig, check_coverage, grid_points
+from src.mpllry_graph.downloader import AsyncDownloader
+
+
+def _check(monkeypatch, server, lat, lon, key):
+    monkeypatch.setenv("STREETVIEW_URL", f"{server.url}/streetview")
+
+    async def run():
+        async with AsyncDownloader(per_host=16, max_retries=0) as downloader:
+            return await check_coverage(lat, lon, key, downloader, batch_size=64)
+
+    return asyncio.run(run())
+
+
+def test_check_coverage_keeps_points_with_a_panorama(monkeypatch):
+    lat, lon = grid_points(GridConfig(radius_m=300, spacing_m=50))
+    with StubServer(latency=0.0, miss_rate=0.3) as server:
+        keep = _check(monkeypatch, server, lat, lon, "stub")
+        expected = np.array([server.has_coverage(f"{la},{lo}") for la, lo in zip(lat, lon)])
+    assert 0 < expected.sum() < len(lat)
+    np.testing.assert_array_equal(keep, expected)
+
+
+def test_check_coverage_raises_on_rejected_key(monkeypatch):
+    lat, lon = grid_points(GridConfig(radius_m=100, spacing_m=50))
+    with StubServer(latency=0.0) as server, pytest.raises(RuntimeError, match="REQUEST_DENIED"):
+        _check(monkeypatch, server, lat, lon, "denied")
+
+
+def test_check_coverage_counts_non_json_answers_as_failures(monkeypatch):
+    lat, lon = grid_points(GridConfig(radius_m=100, spacing_m=50))
+    with StubServer(latency=0.0) as server:
+        keep = _check(monkeypatch, server, lat, lon, "html")
+    assert not keep.any()